@@ -0,0 +1,238 @@
+from keypool import KeyPool
+from tracing import run
+
+from subprocess import PIPE
+from os import remove
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+try:
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID, ExtendedKeyUsageOID, AuthorityInformationAccessOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+except ImportError:
+    x509 = None
+
+CURVES = {"P-256": "SECP256R1", "P-384": "SECP384R1"}
+
+
+class CliBackend:
+    def __init__(self, pool: KeyPool):
+        self.pool = pool
+
+    def key(self, out: str, keylen: int, password: str = None, algorithm: str = "rsa"):
+        if algorithm == "rsa":
+            # Taking RSA-key with specified length from the pool, generating it if pool is empty
+            self.pool.take("rsa", keylen, out, password=password)
+            return
+        # Elliptic curve keys are generated in a millisecond, pool is not needed for them
+        if algorithm == "ed25519":
+            options = ["-algorithm", "ED25519"]
+        else:
+            options = ["-algorithm", "EC", "-pkeyopt", f"ec_paramgen_curve:{algorithm.split(':')[1]}"]
+        encryption = ["-aes256", "-pass", f"pass:{password}"] if password else []
+        run(["openssl", "genpkey", *options, *encryption, "-out", out], check=True)
+
+    def self_signed(self, key: str, subject: str, days: int, extensions: list, out: str, password: str = None):
+        # Generating self-signed certificate with specified RSA key
+        run(["openssl", "req", "-x509", "-new",
+             "-key", key, *passin(password),                                 # Passing RSA key and password for encrypted one
+             "-days", f"{days}",                                             # Setting time limit for certificate
+             "-subj", subject,                                               # Setting certificate parameters in format /param1=value1/param2=value2/...
+             *addext(extensions),                                            # Adding x509v3 extensions
+             "-out", out], check=True)                                       # Setting up output file
+
+    def issue(self, key: str, subject: str, days: int, extensions: list, out: str,
+              ca_cert: str, ca_key: str, password: str = None, ca_password: str = None):
+        # Generating certificate signing request, it is handed to the next command through memory instead of .csr file
+        request = run(["openssl", "req", "-new",
+                       "-key", key, *passin(password),                       # Passing RSA key and password for encrypted one
+                       "-subj", subject,                                     # Setting certificate parameters in format /param1=value1/param2=value2/...
+                       *addext(extensions)],                                 # Adding x509v3 extensions
+                      stdout=PIPE, check=True).stdout                        # Request is written to stdout
+        # Generating certificate from request
+        run(["openssl", "x509", "-req", "-days", f"{days}",
+             "-CA", ca_cert, "-CAkey", ca_key, *passin(ca_password),         # Passing issuer cerificate with key and password
+             "-copy_extensions", "copy",                                     # Copying x509v3 extensions from request to certificate
+             "-out", out],                                                   # Specifying output path
+            input=request, check=True)                                       # Request is read from stdin
+
+
+class InProcessBackend:
+    def __init__(self, pool: KeyPool):
+        self.pool = pool
+        self.keys = {}              # path -> private key object
+        self.certs = {}             # path -> certificate object
+        self.lock = Lock()
+
+    def key(self, out: str, keylen: int, password: str = None, algorithm: str = "rsa"):
+        claimed = self.pool.claim("rsa", keylen) if algorithm == "rsa" else None
+        if algorithm == "ed25519":
+            key = ed25519.Ed25519PrivateKey.generate()
+        elif algorithm != "rsa":
+            key = ec.generate_private_key(getattr(ec, CURVES[algorithm.split(":")[1]])())
+        elif claimed is None:
+            key = rsa.generate_private_key(public_exponent=65537, key_size=keylen)
+        else:
+            # Pooled keys are generated by openssl itself, so expensive RSA consistency check is skipped
+            with open(claimed, "rb") as pem:
+                key = serialization.load_pem_private_key(pem.read(), password=None, unsafe_skip_rsa_key_validation=True)
+            remove(claimed)
+        with self.lock:
+            self.keys[out] = key
+        write_key(key, out, password)
+
+    def load_key(self, path: str, password: str = None):
+        # Key is decrypted only once, all other steps reuse the object
+        with self.lock:
+            if path not in self.keys:
+                with open(path, "rb") as pem:
+                    self.keys[path] = serialization.load_pem_private_key(pem.read(), password=password.encode() if password else None,
+                                                                         unsafe_skip_rsa_key_validation=True)
+            return self.keys[path]
+
+    def load_cert(self, path: str):
+        with self.lock:
+            if path not in self.certs:
+                with open(path, "rb") as pem:
+                    self.certs[path] = x509.load_pem_x509_certificate(pem.read())
+            return self.certs[path]
+
+    def self_signed(self, key: str, subject: str, days: int, extensions: list, out: str, password: str = None):
+        private_key = self.load_key(key, password)
+        name = parse_subject(subject)
+        builder = certificate_builder(name, name, private_key.public_key(), days)
+        builder = builder.add_extension(x509.SubjectKeyIdentifier.from_public_key(private_key.public_key()), critical=False)
+        builder = builder.add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(private_key.public_key()), critical=False)
+        for extension, critical in parse_extensions(extensions):
+            builder = builder.add_extension(extension, critical=critical)
+        self.save_cert(builder.sign(private_key, signature_hash(private_key)), out)
+
+    def issue(self, key: str, subject: str, days: int, extensions: list, out: str,
+              ca_cert: str, ca_key: str, password: str = None, ca_password: str = None):
+        # Certificate is built directly from the key, no request is written to disk
+        public_key = self.load_key(key, password).public_key()
+        issuer = self.load_cert(ca_cert)
+        issuer_key = self.load_key(ca_key, ca_password)
+        builder = certificate_builder(parse_subject(subject), issuer.subject, public_key, days)
+        for extension, critical in parse_extensions(extensions):
+            builder = builder.add_extension(extension, critical=critical)
+        builder = builder.add_extension(x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False)
+        builder = builder.add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(issuer_key.public_key()), critical=False)
+        self.save_cert(builder.sign(issuer_key, signature_hash(issuer_key)), out)
+
+    def save_cert(self, cert, out: str):
+        with self.lock:
+            self.certs[out] = cert
+        with open(out, "wb") as pem:
+            pem.write(cert.public_bytes(serialization.Encoding.PEM))
+
+
+def make_backend(name: str, pool: KeyPool):
+    if name == "inprocess" and x509 is None:
+        print(f"Python package cryptography is needed for in-process backend, install it with pip")
+        print(f"e.g. \x1b[1mpip install cryptography\x1b[0m")
+        exit(1)
+    return {"cli": CliBackend, "inprocess": InProcessBackend}[name](pool)
+
+
+def passin(password: str) -> list:
+    return ["-passin", f"pass:{password}"] if password else []
+
+
+def addext(extensions: list) -> list:
+    return [argument for extension in extensions for argument in ["-addext", extension]]
+
+
+def signature_hash(key):
+    # Ed25519 signs the message itself, other keys sign its SHA-256 digest
+    return None if isinstance(key, ed25519.Ed25519PrivateKey) else hashes.SHA256()
+
+
+def write_key(key, out: str, password: str = None):
+    if password:
+        encryption = serialization.BestAvailableEncryption(password.encode())
+    else:
+        encryption = serialization.NoEncryption()
+    with open(out, "wb") as pem:
+        pem.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, encryption))
+
+
+def certificate_builder(subject, issuer, public_key, days: int):
+    now = datetime.now(timezone.utc)
+    return (x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(issuer)
+            .public_key(public_key)
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now)
+            .not_valid_after(now + timedelta(days=days)))
+
+
+########## Parsing openssl-style subjects and -addext arguments ##########
+
+SUBJECT_FIELDS = {"C": "COUNTRY_NAME", "ST": "STATE_OR_PROVINCE_NAME", "L": "LOCALITY_NAME",
+                  "O": "ORGANIZATION_NAME", "OU": "ORGANIZATIONAL_UNIT_NAME", "CN": "COMMON_NAME",
+                  "emailAddress": "EMAIL_ADDRESS"}
+
+KEY_USAGES = {"digitalSignature": "digital_signature", "nonRepudiation": "content_commitment",
+              "keyEncipherment": "key_encipherment", "dataEncipherment": "data_encipherment",
+              "keyAgreement": "key_agreement", "keyCertSign": "key_cert_sign", "cRLSign": "crl_sign",
+              "encipherOnly": "encipher_only", "decipherOnly": "decipher_only"}
+
+EXTENDED_KEY_USAGES = {"serverAuth": "SERVER_AUTH", "clientAuth": "CLIENT_AUTH", "codeSigning": "CODE_SIGNING",
+                       "emailProtection": "EMAIL_PROTECTION", "timeStamping": "TIME_STAMPING", "OCSPSigning": "OCSP_SIGNING"}
+
+
+def parse_subject(subject: str):
+    # /C=RU/ST=Moscow/.../emailAddress=user@host
+    attributes = []
+    for field in subject.strip("/").split("/"):
+        name, value = field.split("=", 1)
+        attributes.append(x509.NameAttribute(getattr(NameOID, SUBJECT_FIELDS[name]), value))
+    return x509.Name(attributes)
+
+
+def parse_general_name(value: str):
+    kind, name = value.split(":", 1)
+    if kind == "DNS": return x509.DNSName(name)
+    if kind == "URI": return x509.UniformResourceIdentifier(name)
+    if kind == "email": return x509.RFC822Name(name)
+    raise ValueError(f"Unsupported general name: {value}")
+
+
+def parse_extensions(extensions: list) -> list:
+    parsed = []
+    for extension in extensions:
+        name, value = extension.split("=", 1)
+        items = [item.strip() for item in value.split(",")]
+        critical = "critical" in items
+        items = [item for item in items if item != "critical"]
+
+        if name == "basicConstraints":
+            options = dict(item.split(":", 1) for item in items)
+            ca = options.get("CA", "FALSE").upper() == "TRUE"
+            pathlen = int(options["pathlen"]) if "pathlen" in options else None
+            parsed.append((x509.BasicConstraints(ca=ca, path_length=pathlen), critical))
+        elif name == "keyUsage":
+            usages = {usage: False for usage in KEY_USAGES.values()}
+            usages.update({KEY_USAGES[item]: True for item in items})
+            parsed.append((x509.KeyUsage(**usages), critical))
+        elif name == "extendedKeyUsage":
+            parsed.append((x509.ExtendedKeyUsage([getattr(ExtendedKeyUsageOID, EXTENDED_KEY_USAGES[item]) for item in items]), critical))
+        elif name == "subjectAltName":
+            parsed.append((x509.SubjectAlternativeName([parse_general_name(item) for item in items]), critical))
+        elif name == "crlDistributionPoints":
+            points = [x509.DistributionPoint([parse_general_name(item)], None, None, None) for item in items]
+            parsed.append((x509.CRLDistributionPoints(points), critical))
+        elif name == "authorityInfoAccess":
+            descriptions = []
+            for item in items:
+                method, location = item.split(";", 1)
+                method = {"OCSP": AuthorityInformationAccessOID.OCSP, "caIssuers": AuthorityInformationAccessOID.CA_ISSUERS}[method]
+                descriptions.append(x509.AccessDescription(method, parse_general_name(location)))
+            parsed.append((x509.AuthorityInformationAccess(descriptions), critical))
+        else:
+            raise ValueError(f"Unsupported extension: {extension}")
+    return parsed
@@ -1,6 +1,25 @@
 from json import load
+from argparse import ArgumentParser
+
+# Key algorithms of task profiles (*_key fields), length of RSA keys is taken from *_keylen fields
+KEY_ALGORITHMS = ["rsa", "ec:P-256", "ec:P-384", "ed25519"]
 
 class Config:
     def __init__(self, config_filename: str):
         with open(config_filename) as config:
-            self.__dict__ = load(config)
\ No newline at end of file
+            self.__dict__ = load(config)
+
+def arguments(description: str) -> ArgumentParser:
+    # Options shared by all task generators
+    parser = ArgumentParser(description=description)
+    parser.add_argument("--backend", choices=["cli", "inprocess"], default="cli",
+                        help="run openssl CLI for every step or keep keys and certificates in process (needs cryptography package)")
+    parser.add_argument("--keys", choices=KEY_ALGORITHMS,
+                        help="key algorithm of every certificate instead of the profiles of task configs (*_key fields)")
+    parser.add_argument("--force", action="store_true", help="rebuild every step instead of reusing cached results")
+    parser.add_argument("--clean", action="store_true", help="remove all cached results before the build")
+    parser.add_argument("--cache-size", type=int, default=256, metavar="MB", help="size limit of the build cache")
+    parser.add_argument("--jobs", type=int, help="steps run at once, number of CPUs by default")
+    parser.add_argument("--profile", nargs="?", const="profile.json", metavar="FILE",
+                        help="trace time, CPU and memory of every started process into Chrome trace file (profile.json by default)")
+    return parser
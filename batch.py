@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+from subprocess import run, DEVNULL, PIPE
+from os import makedirs, symlink, cpu_count
+from os.path import isfile, islink, join, abspath, dirname
+from shutil import copy
+from json import dump, loads, dumps
+from csv import DictReader, Error as CSVError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from time import perf_counter
+from argparse import ArgumentParser
+
+ROOT = dirname(abspath(__file__))
+FIELDS = ["name", "group", "university", "email"]
+GENERATORS = {"p1_1": "gen_task_1_1.py", "p1_2": "gen_task_1_2.py", "p1_3": "gen_task_1_3.py"}
+# Generators asking questions are run in their non-interactive modes
+GENERATOR_ARGS = {"p1_3": ["--headless"]}
+
+
+def read_roster(filename: str):
+    # Roster is streamed user by user, so its size does not matter. Malformed line is yielded with its error instead of the user
+    with open(filename, newline="") as roster:
+        if filename.endswith(".csv"):
+            rows = DictReader(roster)
+            while True:
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                except CSVError as error:
+                    yield rows.line_num, None, error
+                    continue
+                yield rows.line_num, row, None
+        else:
+            for no, line in enumerate(roster, 1):
+                if not line.strip():
+                    continue
+                try:
+                    user = loads(line)
+                except ValueError as error:
+                    yield no, None, error
+                    continue
+                yield no, user, None if isinstance(user, dict) else ValueError("user must be a JSON object")
+
+
+def read_journal(filename: str) -> set:
+    completed = set()
+    if isfile(filename):
+        with open(filename) as journal:
+            for line in journal:
+                record = loads(line)
+                if record["status"] == "ok":
+                    completed.add(record["user"])
+    return completed
+
+
+def issue(user: dict, task: str, outdir: str, generator_args: list):
+    missing = [field for field in FIELDS if not user.get(field)]
+    if len(missing) != 0:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+
+    # Every user gets own directory with user.json, generator is run there as for a single user
+    userdir = join(outdir, "work", f"{user['name']}-{user['group']}")
+    makedirs(userdir, exist_ok=True)
+    with open(join(userdir, "user.json"), "w") as config:
+        dump({field: user[field] for field in FIELDS}, config, indent=4)
+    if not islink(join(userdir, "tasks")):
+        symlink(join(ROOT, "tasks"), join(userdir, "tasks"))
+
+    result = run(["python3", join(ROOT, GENERATORS[task]), *generator_args], cwd=userdir, stdout=DEVNULL, stderr=PIPE, text=True)
+
+    archive = f"{user['name']}-{user['group']}-{task}.zip"
+    workdir_archive = join(userdir, f"{user['name']}-{user['group']}-{task}", archive)
+    if result.returncode != 0 or not isfile(workdir_archive):
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "archive was not generated")
+    # All zips are stored next to each other
+    copy(workdir_archive, join(outdir, archive))
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Issues task hierarchy for every user of the roster")
+    parser.add_argument("roster", help="JSONL or CSV file with name, group, university and email of every user")
+    parser.add_argument("--task", choices=sorted(GENERATORS), default="p1_1")
+    parser.add_argument("--out", default="batch", help="directory for archives and per-user workdirs")
+    parser.add_argument("--workers", type=int, default=cpu_count() or 1, help="users issued at once")
+    parser.add_argument("--backend", choices=["cli", "inprocess"], default="cli")
+    args = parser.parse_args()
+
+    makedirs(args.out, exist_ok=True)
+    # Every generator runs its steps concurrently too, so cores are divided between the users in flight
+    generator_args = ["--backend", args.backend, "--jobs", f"{max(1, (cpu_count() or 1) // args.workers)}", *GENERATOR_ARGS.get(args.task, [])]
+    journal_name = join(args.out, f"journal-{args.task}.jsonl")
+    # Users completed by previous runs are skipped, failed ones are retried
+    completed = read_journal(journal_name)
+
+    journal = open(journal_name, "a")
+    journal_lock = Lock()
+    succeeded, failed, skipped = 0, 0, 0
+    start = perf_counter()
+
+    def finish(user_id: str, error: Exception):
+        global succeeded, failed
+        with journal_lock:
+            if error is None:
+                succeeded += 1
+                journal.write(dumps({"user": user_id, "status": "ok"}) + "\n")
+            else:
+                failed += 1
+                journal.write(dumps({"user": user_id, "status": "failed", "error": str(error)}) + "\n")
+                print(f"\x1b[1;31m{user_id} failed: {error}\x1b[0m")
+            journal.flush()
+            elapsed = perf_counter() - start
+            print(f"[{succeeded + failed} done, {failed} failed, {skipped} skipped] {(succeeded + failed) / elapsed:.2f} users/s")
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        running = {}
+        for line, user, error in read_roster(args.roster):
+            # Malformed line fails only its user, the batch goes on
+            if error is not None:
+                finish(f"{args.roster}:{line}", error)
+                continue
+            user_id = f"{user.get('name')}-{user.get('group')}"
+            if user_id in completed:
+                skipped += 1
+                continue
+
+            # Only a bounded number of users is kept in flight
+            if len(running) >= 2 * args.workers:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finish(running.pop(future), future.exception())
+            running[pool.submit(issue, user, args.task, args.out, generator_args)] = user_id
+
+        for future in list(running):
+            finish(running.pop(future), future.exception())
+
+    journal.close()
+    elapsed = perf_counter() - start
+    print(f"\nIssued {succeeded} users, {failed} failed, {skipped} skipped in {elapsed:.1f} s")
+    if failed != 0:
+        print(f"Run the same command again to retry failed users")
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+from keypool import KeyPool
+from backend import make_backend
+
+from subprocess import run, DEVNULL
+from os import makedirs
+from shutil import copy
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from argparse import ArgumentParser
+from statistics import mean
+
+# Hierarchy of p1_3: CA, Intermediate CA, OCSP Responder and two leaf certificates
+LEAVES = [("ocsp-resp", "OCSP Responder", ["basicConstraints=CA:FALSE", "keyUsage=critical,digitalSignature", "extendedKeyUsage=OCSPSigning"]),
+          ("ocsp-valid", "OCSP Valid", ["basicConstraints=CA:FALSE", "keyUsage=critical,digitalSignature", "extendedKeyUsage=critical,serverAuth,clientAuth",
+                                        "subjectAltName=DNS:ocsp.valid.bench.ru", "authorityInfoAccess=OCSP;URI:http://ocsp.bench.ru:2560/",
+                                        "crlDistributionPoints=URI:http://crl.bench.ru:8080/bench.crl"]),
+          ("ocsp-revoked", "OCSP Revoked", ["basicConstraints=CA:FALSE", "keyUsage=critical,digitalSignature", "extendedKeyUsage=critical,serverAuth,clientAuth",
+                                            "subjectAltName=DNS:ocsp.revoked.bench.ru", "authorityInfoAccess=OCSP;URI:http://ocsp.bench.ru:2560/"])]
+
+
+def subject(name: str) -> str:
+    return f"/C=RU/ST=Moscow/L=Moscow/O=bench/OU=bench P1_3/CN=bench {name}/emailAddress=bench@bench.ru"
+
+
+def build(backend, workdir: str, args):
+    backend.key(f"{workdir}/ca.key", args.ca_keylen, password="bench")
+    backend.self_signed(f"{workdir}/ca.key", subject("CA"), 1095,
+                        ["basicConstraints=critical,CA:TRUE", "keyUsage=critical,digitalSignature,keyCertSign,cRLSign"],
+                        f"{workdir}/ca.crt", password="bench")
+    backend.key(f"{workdir}/intr.key", args.ca_keylen, password="bench")
+    backend.issue(f"{workdir}/intr.key", subject("Intermediate CA"), 365,
+                  ["basicConstraints=critical,pathlen:0,CA:TRUE", "keyUsage=critical,digitalSignature,keyCertSign,cRLSign"],
+                  f"{workdir}/intr.crt", f"{workdir}/ca.crt", f"{workdir}/ca.key", password="bench", ca_password="bench")
+    for name, cn, extensions in LEAVES:
+        backend.key(f"{workdir}/{name}.key", args.basic_keylen)
+        backend.issue(f"{workdir}/{name}.key", subject(cn), 90, extensions,
+                      f"{workdir}/{name}.crt", f"{workdir}/intr.crt", f"{workdir}/intr.key", ca_password="bench")
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Compares openssl CLI and in-process backends on the p1_3 hierarchy")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ca-keylen", type=int, default=4096)
+    parser.add_argument("--basic-keylen", type=int, default=2048)
+    parser.add_argument("--keygen", action="store_true", help="include RSA prime search into measurements instead of using pooled keys")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        # Same pre-generated keys are put into the pool before every run, so only certificate handling is compared
+        keys = {}
+        if not args.keygen:
+            for keylen in {args.ca_keylen, args.basic_keylen}:
+                keys[keylen] = [f"{tmp}/{keylen}-{i}.pem" for i in range(5)]
+                for key in keys[keylen]:
+                    run(["openssl", "genrsa", "-out", key, f"{keylen}"], stdout=DEVNULL, stderr=DEVNULL)
+
+        results = {}
+        for name in ["cli", "inprocess"]:
+            timings = []
+            for iteration in range(args.repeat):
+                workdir = f"{tmp}/{name}-{iteration}"
+                makedirs(workdir)
+                pool = KeyPool(f"{workdir}/pool")
+                for keylen, pems in keys.items():
+                    for i, pem in enumerate(pems):
+                        copy(pem, f"{pool.slot('rsa', keylen)}/{i}.key")
+
+                start = perf_counter()
+                build(make_backend(name, pool), workdir, args)
+                timings.append(perf_counter() - start)
+            results[name] = timings
+
+    for name, timings in results.items():
+        print(f"{name:>10}: mean {mean(timings) * 1000:8.1f} ms, min {min(timings) * 1000:8.1f} ms, max {max(timings) * 1000:8.1f} ms")
+    print(f"In-process backend is {mean(results['cli']) / mean(results['inprocess']):.1f}x faster")
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+from revocation import RevocationDB, TIME_FORMAT, serial_hex
+
+from subprocess import run, Popen, DEVNULL
+from os import wait4, getcwd
+from os.path import getsize, join, dirname, abspath
+from multiprocessing import Process
+from tempfile import TemporaryDirectory
+from datetime import datetime, timezone
+from random import getrandbits
+from time import perf_counter
+from argparse import ArgumentParser
+
+CRL = join(dirname(abspath(__file__)), "crl.py")
+
+
+def measure(command: list) -> tuple:
+    # Wall time and peak memory of a child process
+    start = perf_counter()
+    child = Popen(command, stdout=DEVNULL)
+    _, status, usage = wait4(child.pid, 0)
+    if status != 0:
+        print(f"\x1b[1;31m{' '.join(command)} failed\x1b[0m")
+        exit(1)
+    return perf_counter() - start, usage.ru_maxrss / 1024
+
+
+def isolated(function, *args):
+    # Peak memory of children includes memory of this process at fork, so heavy work is kept out of it
+    worker = Process(target=function, args=args)
+    worker.start()
+    worker.join()
+    if worker.exitcode != 0:
+        exit(1)
+
+
+def populate(database: str, count: int, revoked: str):
+    # Random 159-bit serials as openssl ca generates them, inserted in batches
+    db = RevocationDB(database)
+    db.db.execute("PRAGMA synchronous=OFF")
+    for offset in range(0, count, 100000):
+        rows = [(serial_hex(getrandbits(159) | 1 << 152), "300101000000Z", revoked, None, f"/CN=bench {offset + i}")
+                for i in range(min(100000, count - offset))]
+        with db.db:
+            db.db.executemany("INSERT OR IGNORE INTO certificates VALUES (?, ?, ?, ?, ?, 0)", rows)
+    if revoked is None:
+        db.revoke([row[0] for row in db.db.execute("SELECT serial FROM certificates WHERE revoked IS NULL")])
+    db.close()
+
+
+def export(database: str, index: str):
+    db = RevocationDB(database)
+    db.export_index(index)
+    db.close()
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Measures CRL generation for a large revocation list")
+    parser.add_argument("--count", type=int, default=1000000, help="revoked serials in the full CRL")
+    parser.add_argument("--delta", type=int, default=1000, help="serials revoked after the full CRL")
+    parser.add_argument("--keylen", type=int, default=4096)
+    parser.add_argument("--skip-openssl", action="store_true", help="do not measure openssl ca -gencrl")
+    args = parser.parse_args()
+
+    with TemporaryDirectory(dir=getcwd()) as tmp:
+        run(["openssl", "req", "-x509", "-newkey", f"rsa:{args.keylen}", "-nodes", "-keyout", f"{tmp}/ca.key", "-out", f"{tmp}/ca.crt",
+             "-subj", "/CN=bench CA", "-days", "30", "-addext", "keyUsage=critical,keyCertSign,cRLSign"], stdout=DEVNULL, stderr=DEVNULL, check=True)
+
+        start = perf_counter()
+        isolated(populate, f"{tmp}/revocation.db", args.count, datetime.now(timezone.utc).strftime(TIME_FORMAT))
+        print(f"Revocation database with {args.count} serials filled in {perf_counter() - start:.1f} s")
+
+        results = {}
+        results["full CRL"] = measure(["python3", CRL, f"{tmp}/revocation.db", "--cert", f"{tmp}/ca.crt", "--key", f"{tmp}/ca.key",
+                                       "--out", f"{tmp}/full.crl", "--freshest", "http://crl.bench.ru/delta.crl"]) + (getsize(f"{tmp}/full.crl"),)
+
+        # Delta CRL lists only revocations made after the full one
+        isolated(populate, f"{tmp}/revocation.db", args.delta, None)
+        results["delta CRL"] = measure(["python3", CRL, f"{tmp}/revocation.db", "--delta", "--cert", f"{tmp}/ca.crt", "--key", f"{tmp}/ca.key",
+                                        "--out", f"{tmp}/delta.crl"]) + (getsize(f"{tmp}/delta.crl"),)
+
+        if not args.skip_openssl:
+            isolated(export, f"{tmp}/revocation.db", f"{tmp}/index.txt")
+            with open(f"{tmp}/ca.conf", "w") as conf:
+                conf.write(f"[ ca ]\ndefault_ca = CA_default\n[ CA_default ]\ndatabase = {tmp}/index.txt\ndefault_md = sha256\n")
+            results["openssl ca -gencrl"] = measure(["openssl", "ca", "-config", f"{tmp}/ca.conf", "-gencrl", "-crldays", "30",
+                                                     "-cert", f"{tmp}/ca.crt", "-keyfile", f"{tmp}/ca.key", "-out", f"{tmp}/openssl.crl"]) + (getsize(f"{tmp}/openssl.crl"),)
+
+        # Generated lists must be accepted by openssl
+        for name in ["full", "delta"]:
+            run(["openssl", "crl", "-in", f"{tmp}/{name}.crl", "-CAfile", f"{tmp}/ca.crt", "-noout"], stderr=DEVNULL, check=True)
+
+    for name, (elapsed, memory, size) in results.items():
+        print(f"{name:>18}: {elapsed:7.2f} s, peak memory {memory:7.1f} MB, {size / 1024 / 1024:7.1f} MB")
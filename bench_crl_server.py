@@ -0,0 +1,148 @@
+#!/usr/bin/python
+
+from crl_server import command
+from bench_crl import CRL, isolated, populate
+from bench_ocsp import cpu_time
+from revocation import TIME_FORMAT
+
+from asyncio import open_connection, create_subprocess_exec, run, gather, sleep as async_sleep, wait_for, \
+    IncompleteReadError, TimeoutError as AsyncTimeoutError
+from subprocess import run as run_process, Popen, DEVNULL
+from socket import create_connection
+from tempfile import TemporaryDirectory
+from datetime import datetime, timezone
+from statistics import quantiles
+from resource import getrusage, RUSAGE_SELF
+from hashlib import sha256
+from json import dumps
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+
+# Conditional clients revalidate DER CRL with the tag of the version they already have, as caches of relying parties do
+PATHS = {"full": "/bench.crl", "conditional": "/bench.crl", "pem": "/bench.pem"}
+
+
+def crl_command(tmp: str) -> list:
+    return ["python3", CRL, f"{tmp}/revocation.db", "--cert", f"{tmp}/ca.crt", "--key", f"{tmp}/ca.key", "--out", f"{tmp}/bench.crl"]
+
+
+async def exchange(reader, writer, path: str, etag: str, verify: bool) -> tuple:
+    # Status, entity tag and body length of one keep-alive request, with --verify the body must match its tag
+    condition = f"If-None-Match: {etag}\r\n" if etag else ""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n{condition}\r\n".encode())
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+    headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in head.split("\r\n")[1:] if line)}
+    status = int(head.split()[1])
+    digest = sha256()
+    remaining = int(headers.get("content-length", 0)) if status == 200 else 0
+    while remaining:
+        chunk = await reader.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise IncompleteReadError(b"", remaining)
+        remaining -= len(chunk)
+        if verify:
+            digest.update(chunk)
+    if status not in (200, 304) or (verify and status == 200 and headers["etag"] != f'"{digest.hexdigest()[:32]}"'):
+        raise ConnectionError(f"bad response {status}")
+    return status, headers["etag"], int(headers.get("content-length", 0)) if status == 200 else 0
+
+
+async def client(port: int, path: str, conditional: bool, verify: bool, deadline: float, stats: dict):
+    reader = writer = None
+    etag = None
+    while perf_counter() < deadline:
+        start = perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await open_connection("127.0.0.1", port)
+            # Stuck requests are counted as errors instead of stalling the run
+            status, etag, length = await wait_for(exchange(reader, writer, path, etag if conditional else None, verify), 30)
+            stats["latencies"].append(perf_counter() - start)
+            stats["bytes"] += length
+            stats["not_modified"] += status == 304
+        except (ConnectionError, IncompleteReadError, AsyncTimeoutError, OSError):
+            stats["errors"] += 1
+            if writer is not None: writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def swapper(tmp: str, interval: float, deadline: float, stats: dict):
+    # CRL is generated again during the load, as a CA does after revocations
+    while perf_counter() + interval < deadline:
+        await async_sleep(interval)
+        generator = await create_subprocess_exec(*crl_command(tmp), stdout=DEVNULL)
+        stats["swaps"] += await generator.wait() == 0
+
+
+async def drive(port: int, path: str, args, tmp: str) -> dict:
+    stats = {"latencies": [], "bytes": 0, "not_modified": 0, "errors": 0, "swaps": 0}
+    deadline = perf_counter() + args.duration
+    clients = [client(port, path, args.mode == "conditional", args.verify, deadline, stats) for _ in range(args.concurrency)]
+    if args.swap:
+        clients.append(swapper(tmp, args.swap, deadline, stats))
+    await gather(*clients)
+    return stats
+
+
+def wait_for_server(port: int, server: Popen):
+    while server.poll() is None:
+        try:
+            create_connection(("127.0.0.1", port), timeout=5).close()
+            return
+        except OSError:
+            sleep(0.1)
+    print(f"\x1b[1;31mCRL server exited with code {server.returncode}\x1b[0m")
+    exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Drives CRL distribution server with concurrent keep-alive clients and reports throughput as JSON")
+    parser.add_argument("--entries", type=int, default=100000, help="revoked serials in the CRL")
+    parser.add_argument("--mode", choices=list(PATHS), default="full",
+                        help="full downloads of DER, revalidations with If-None-Match, or full downloads of PEM")
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--verify", action="store_true", help="check every body against its ETag")
+    parser.add_argument("--swap", type=float, metavar="SECONDS", help="generate the CRL again at this interval during the load")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--out", help="append JSON result to this file")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        run_process(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:P-256", "-nodes", "-keyout", f"{tmp}/ca.key",
+                     "-out", f"{tmp}/ca.crt", "-subj", "/CN=bench CA", "-days", "30", "-addext", "keyUsage=critical,keyCertSign,cRLSign"],
+                    stdout=DEVNULL, stderr=DEVNULL, check=True)
+        isolated(populate, f"{tmp}/revocation.db", args.entries, datetime.now(timezone.utc).strftime(TIME_FORMAT))
+        run_process(crl_command(tmp), stdout=DEVNULL, check=True)
+
+        server = Popen([*command([f"{tmp}/bench.crl"], args.port), "--host", "127.0.0.1", "--interval", "0.2"], stdout=DEVNULL)
+        try:
+            wait_for_server(args.port, server)
+            cpu_before, client_before, start = cpu_time(server.pid), getrusage(RUSAGE_SELF), perf_counter()
+            stats = run(drive(args.port, PATHS[args.mode], args, tmp))
+            elapsed = perf_counter() - start
+            cpu_after, client_after = cpu_time(server.pid), getrusage(RUSAGE_SELF)
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies = stats["latencies"]
+    percentiles = quantiles(latencies, n=100) if len(latencies) >= 2 else [0] * 99
+    result = {"mode": args.mode, "entries": args.entries, "concurrency": args.concurrency, "verify": args.verify, "swap": args.swap,
+              "duration_s": round(elapsed, 3), "requests": len(latencies), "not_modified": stats["not_modified"],
+              "errors": stats["errors"], "swaps": stats["swaps"],
+              "throughput_rps": round(len(latencies) / elapsed, 1),
+              "throughput_mb_s": round(stats["bytes"] / elapsed / 1024 / 1024, 1),
+              "latency_ms": {"p50": round(percentiles[49] * 1000, 3), "p95": round(percentiles[94] * 1000, 3),
+                             "p99": round(percentiles[98] * 1000, 3), "max": round(max(latencies, default=0) * 1000, 3)},
+              "server_cpu_ms_per_request": round((cpu_after - cpu_before) * 1000 / max(len(latencies), 1), 3),
+              "client_cpu_ms_per_request": round((client_after.ru_utime + client_after.ru_stime - client_before.ru_utime - client_before.ru_stime)
+                                                 * 1000 / max(len(latencies), 1), 3)}
+    print(dumps(result, indent=4))
+    if args.out is not None:
+        with open(args.out, "a") as out:
+            out.write(dumps(result) + "\n")
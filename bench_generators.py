@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+from standin import install
+from keypool import KeyPool, required_keys
+
+from subprocess import run, DEVNULL, PIPE
+from os import makedirs, symlink, environ, pathsep
+from os.path import join, abspath, dirname, isfile, isdir
+from shutil import copy, copytree, which
+from glob import glob
+from fcntl import flock, LOCK_EX, LOCK_NB
+from tempfile import TemporaryDirectory
+from statistics import median
+from re import sub
+from json import load, dump, dumps
+from time import perf_counter
+from argparse import ArgumentParser
+
+ROOT = dirname(abspath(__file__))
+# p1_3 is run in its headless mode, the interactive one needs root and a person at the keyboard
+GENERATORS = {"p1_1": ["gen_task_1_1.py"], "p1_2": ["gen_task_1_2.py"], "p1_3": ["gen_task_1_3.py", "--headless"]}
+
+
+def hold_pool(directory: str):
+    # Filler lock of the pool is held for the whole benchmark, so background refills started by generators exit at once
+    # instead of generating RSA keys while the next run is measured
+    makedirs(directory, mode=0o700, exist_ok=True)
+    lock = open(join(directory, ".filler.lock"), "w")
+    try:
+        flock(lock, LOCK_EX | LOCK_NB)
+    except BlockingIOError:
+        print(f"\x1b[1;31mKey pool {directory} is being filled by another process\x1b[0m")
+        exit(1)
+    return lock
+
+
+def top_up(pool: KeyPool):
+    # Every run starts with a full pool, the keys are generated outside of the measured time
+    for algorithm, keylen in sorted(required_keys(glob(join(ROOT, "tasks", "*.json")))):
+        pool.fill(algorithm, keylen)
+
+
+def sandbox(tmp: str, user: str, pool: str, standin: bool) -> dict:
+    # Own user.json, build cache and PATH for every run, so runs neither share nor leave anything
+    copy(user, join(tmp, "user.json"))
+    symlink(join(ROOT, "tasks"), join(tmp, "tasks"))
+    env = dict(environ, INSECON_CACHE=join(tmp, "cache"), INSECON_KEYPOOL=pool)
+    if standin:
+        makedirs(join(tmp, "bin"))
+        install(join(tmp, "bin"))
+        env["PATH"] = join(tmp, "bin") + pathsep + env["PATH"]
+        env["INSECON_STANDIN_LOG"] = join(tmp, "standin.jsonl")
+    return env
+
+
+def phases(trace: str) -> dict:
+    # Milliseconds of every step of the generator, steps of the same kind (e.g. leaf keys) are summed
+    with open(trace) as file:
+        events = load(file)["traceEvents"]
+    result = {}
+    for event in events:
+        if event.get("cat") == "step":
+            name = sub(r"^\[\w+\] ", "", event["name"])
+            result[name] = result.get(name, 0) + event["dur"] / 1000
+    return result
+
+
+def run_generator(task: str, pool: KeyPool, args) -> dict:
+    top_up(pool)
+    with TemporaryDirectory() as tmp:
+        env = sandbox(tmp, args.user, pool.directory, args.standin)
+        extra = ["--backend", args.backend] + (["--keys", args.keys] if args.keys else [])
+        start = perf_counter()
+        result = run(["python3", join(ROOT, GENERATORS[task][0]), *GENERATORS[task][1:], *extra, "--profile", join(tmp, "trace.json")],
+                      cwd=tmp, env=env, stdout=DEVNULL, stderr=PIPE, text=True)
+        total = (perf_counter() - start) * 1000
+        if result.returncode != 0 or not isfile(join(tmp, "trace.json")):
+            lines = result.stderr.strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"generator exited with code {result.returncode}")
+        measured = phases(join(tmp, "trace.json"))
+        measured["total"] = total
+        return measured
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta: float) -> list:
+    # Phases whose median is slower than the baseline by the ratio and by the absolute margin, which hides noise of short steps
+    regressions = []
+    for task, measured in results.items():
+        for phase, samples in measured.items():
+            base = baseline.get(task, {}).get(phase)
+            if base is None:
+                continue
+            value = median(samples)
+            if value > base * threshold and value - base > min_delta:
+                regressions.append((task, phase, base, value))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Runs task generators end to end in isolated directories and compares step timings with a baseline")
+    parser.add_argument("--tasks", default=",".join(GENERATORS), help="comma separated subset of: " + ", ".join(GENERATORS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--user", default=join(ROOT, "user.json"), help="user.json of the generated solutions")
+    parser.add_argument("--pool", help="key pool to start from, it is copied and never changed")
+    parser.add_argument("--keys", help="key algorithm passed to generators, e.g. ec:P-256 for fast key generation")
+    parser.add_argument("--backend", choices=["cli", "inprocess"], default="cli", help="backend passed to generators")
+    parser.add_argument("--standin", action="store_true", help="replace nginx, trust, systemctl and firefox with recording stand-ins")
+    parser.add_argument("--baseline", help="JSON with median milliseconds of every phase to compare with")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write medians of this run as a new baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="allowed ratio to the baseline")
+    parser.add_argument("--min-delta", type=float, default=20, metavar="MS", help="slowdowns smaller than this are never reported")
+    parser.add_argument("--out", help="append JSON results to this file")
+    args = parser.parse_args()
+
+    if args.pool is not None and not isdir(args.pool):
+        print(f"\x1b[1;31mKey pool {args.pool} is not found\x1b[0m")
+        exit(1)
+
+    tasks = args.tasks.split(",")
+    if "p1_3" in tasks and not args.standin and which("nginx") is None:
+        print(f"NGINX is not installed, p1_3 is skipped, run with \x1b[1m--standin\x1b[0m to measure it with the stand-in")
+        tasks.remove("p1_3")
+
+    session = TemporaryDirectory()
+    directory = join(session.name, "pool")
+    if args.pool is not None:
+        copytree(args.pool, directory, ignore=lambda path, names: [name for name in names if name.startswith(".")])
+    lock = hold_pool(directory)
+    pool = KeyPool(directory)
+
+    results, failed = {}, 0
+    for task in tasks:
+        for iteration in range(args.repeat):
+            try:
+                measured = run_generator(task, pool, args)
+            except RuntimeError as error:
+                print(f"\x1b[1;31m{task} failed: {error}\x1b[0m")
+                failed += 1
+                break
+            for phase, value in measured.items():
+                results.setdefault(task, {}).setdefault(phase, []).append(value)
+    lock.close()
+    session.cleanup()
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = load(file)
+
+    for task, measured in results.items():
+        print(f"\n{task}: {len(measured['total'])} runs")
+        print(f"{'phase':<48} {'median ms':>10} {'min ms':>9} {'max ms':>9} {'baseline':>9} {'ratio':>6}")
+        for phase, samples in sorted(measured.items(), key=lambda item: -median(item[1])):
+            base = baseline.get(task, {}).get(phase)
+            ratio = f"{median(samples) / base:6.2f}" if base else ""
+            print(f"{phase[:48]:<48} {median(samples):>10.1f} {min(samples):>9.1f} {max(samples):>9.1f} "
+                  f"{f'{base:.1f}' if base is not None else '':>9} {ratio:>6}")
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as file:
+            dump({task: {phase: round(median(samples), 1) for phase, samples in measured.items()} for task, measured in results.items()}, file, indent=4)
+        print(f"\nBaseline saved in {args.save_baseline}")
+
+    if args.out is not None:
+        with open(args.out, "a") as out:
+            for task, measured in results.items():
+                out.write(dumps({"task": task, "standin": args.standin, "backend": args.backend, "keys": args.keys,
+                                 "phases": {phase: round(median(samples), 1) for phase, samples in measured.items()}}) + "\n")
+
+    regressions = compare(results, baseline, args.threshold, args.min_delta)
+    for task, phase, base, value in regressions:
+        print(f"\x1b[1;31m{task}: {phase} takes {value:.1f} ms instead of {base:.1f} ms\x1b[0m")
+    exit(1 if regressions or failed else 0)
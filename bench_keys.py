@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+from keypool import KeyPool
+from backend import make_backend
+from ocsp_responder import load_signer, sign
+
+from subprocess import Popen, DEVNULL
+from socket import create_connection
+from ssl import SSLContext, PROTOCOL_TLS_CLIENT
+from shutil import which
+from hashlib import sha1
+from tempfile import TemporaryDirectory
+from json import dumps
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+
+try:
+    from cryptography import x509
+except ImportError:
+    x509 = None
+
+PROFILES = {"RSA-2048": ("rsa", 2048), "RSA-4096": ("rsa", 4096), "ECDSA P-256": ("ec:P-256", 0),
+            "ECDSA P-384": ("ec:P-384", 0), "Ed25519": ("ed25519", 0)}
+
+
+def keygen(backend, tmp: str, algorithm: str, keylen: int, count: int) -> float:
+    # Mean time of one key, pool of the backend is empty, so RSA primes are searched every time
+    start = perf_counter()
+    for i in range(count):
+        backend.key(f"{tmp}/keygen-{i}.key", keylen, algorithm=algorithm)
+    return (perf_counter() - start) / count
+
+
+def build(backend, tmp: str, algorithm: str, keylen: int):
+    # CA, server certificate of the test site and OCSP responder certificate, all with keys of the profile
+    backend.key(f"{tmp}/ca.key", keylen, algorithm=algorithm)
+    backend.self_signed(f"{tmp}/ca.key", "/CN=bench CA", 30,
+                        ["basicConstraints=critical,CA:TRUE", "keyUsage=critical,digitalSignature,keyCertSign,cRLSign"], f"{tmp}/ca.crt")
+    backend.key(f"{tmp}/server.key", keylen, algorithm=algorithm)
+    backend.issue(f"{tmp}/server.key", "/CN=localhost", 30,
+                  ["basicConstraints=CA:FALSE", "keyUsage=critical,digitalSignature", "extendedKeyUsage=serverAuth", "subjectAltName=DNS:localhost"],
+                  f"{tmp}/server.crt", f"{tmp}/ca.crt", f"{tmp}/ca.key")
+    backend.key(f"{tmp}/resp.key", keylen, algorithm=algorithm)
+    backend.issue(f"{tmp}/resp.key", "/CN=bench OCSP Responder", 30,
+                  ["basicConstraints=CA:FALSE", "keyUsage=critical,digitalSignature", "extendedKeyUsage=OCSPSigning"],
+                  f"{tmp}/resp.crt", f"{tmp}/ca.crt", f"{tmp}/ca.key")
+
+
+def signing_rate(tmp: str, duration: float) -> float:
+    # Responses signed per second by one worker of the native responder
+    load_signer(f"{tmp}/resp.key", None, f"{tmp}/resp.crt")
+    with open(f"{tmp}/ca.crt", "rb") as pem:
+        issuer = x509.load_pem_x509_certificate(pem.read())
+    name_hash = sha1(issuer.subject.public_bytes()).digest()
+    key_hash = x509.SubjectKeyIdentifier.from_public_key(issuer.public_key()).digest
+    count, start = 0, perf_counter()
+    while perf_counter() - start < duration:
+        sign(name_hash, key_hash, count + 1, "SHA1", ("V", None, None), 3600, None)
+        count += 1
+    return count / (perf_counter() - start)
+
+
+def serve(tmp: str, port: int) -> tuple:
+    # Test site as the generator configures it in nginx, openssl s_server when nginx is not installed
+    with open(f"{tmp}/site.crt", "w") as chain:
+        for part in ["server.crt", "ca.crt"]:
+            with open(f"{tmp}/{part}") as certificate:
+                chain.write(certificate.read())
+    if which("nginx") is None:
+        return "openssl s_server", Popen(["openssl", "s_server", "-quiet", "-accept", f"{port}", "-cert", f"{tmp}/site.crt",
+                                          "-key", f"{tmp}/server.key", "-no_cache"], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)
+    with open(f"{tmp}/nginx.conf", "w") as conf:
+        conf.write(f"""daemon off;
+worker_processes 1;
+pid {tmp}/nginx.pid;
+error_log {tmp}/error.log;
+events {{
+    worker_connections 1024;
+}}
+http {{
+    access_log off;
+    server {{
+        listen 127.0.0.1:{port} ssl;
+        server_name localhost;
+        ssl_certificate {tmp}/site.crt;
+        ssl_certificate_key {tmp}/server.key;
+        ssl_session_cache off;
+        ssl_session_tickets off;
+        location / {{
+            return 204;
+        }}
+    }}
+}}
+""")
+    return "nginx", Popen(["nginx", "-p", tmp, "-c", f"{tmp}/nginx.conf"], stdout=DEVNULL, stderr=DEVNULL)
+
+
+def handshake_rate(tmp: str, port: int, duration: float) -> float:
+    # Full handshakes per second, every connection is new and sessions are never resumed
+    context = SSLContext(PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(f"{tmp}/ca.crt")
+    count, start = 0, perf_counter()
+    while perf_counter() - start < duration:
+        with create_connection(("127.0.0.1", port)) as connection:
+            with context.wrap_socket(connection, server_hostname="localhost"):
+                count += 1
+    return count / (perf_counter() - start)
+
+
+def wait_for_server(port: int, server: Popen):
+    while server.poll() is None:
+        try:
+            create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            sleep(0.1)
+    print(f"\x1b[1;31mTLS server exited with code {server.returncode}\x1b[0m")
+    exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Measures key generation, OCSP signing and TLS handshakes for every key profile of task configs")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help=f"comma separated subset of: {', '.join(PROFILES)}")
+    parser.add_argument("--keygen", type=int, default=3, help="keys generated for every profile")
+    parser.add_argument("--duration", type=float, default=3, help="seconds of signing and of handshakes for every profile")
+    parser.add_argument("--port", type=int, default=4443)
+    parser.add_argument("--out", help="append JSON results to this file")
+    args = parser.parse_args()
+
+    if x509 is None:
+        print(f"Python package cryptography is needed for OCSP signing benchmark, install it with pip")
+        print(f"e.g. \x1b[1mpip install cryptography\x1b[0m")
+        exit(1)
+
+    results = []
+    for name in args.profiles.split(","):
+        algorithm, keylen = PROFILES[name]
+        with TemporaryDirectory() as tmp:
+            backend = make_backend("cli", KeyPool(f"{tmp}/pool"))
+            result = {"profile": name, "keygen_ms": round(keygen(backend, tmp, algorithm, keylen, args.keygen) * 1000, 2)}
+            build(backend, tmp, algorithm, keylen)
+            result["ocsp_signatures_per_s"] = round(signing_rate(tmp, args.duration), 1)
+
+            result["server"], server = serve(tmp, args.port)
+            try:
+                wait_for_server(args.port, server)
+                result["handshakes_per_s"] = round(handshake_rate(tmp, args.port, args.duration), 1)
+            finally:
+                server.terminate()
+                server.wait()
+        results.append(result)
+        print(f"{name:>12}: keygen {result['keygen_ms']:9.2f} ms, OCSP {result['ocsp_signatures_per_s']:8.1f} responses/s, "
+              f"TLS {result['handshakes_per_s']:7.1f} handshakes/s ({result['server']})")
+
+    if args.out is not None:
+        with open(args.out, "a") as out:
+            for result in results:
+                out.write(dumps(result) + "\n")
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+from bench_ocsp import make_pki
+from bench_stapling import make_server_certificate
+from nginx_config import PROFILES, render, check, rotate_ticket_keys
+
+from asyncio import open_connection, run, gather
+from subprocess import Popen, DEVNULL
+from socket import create_connection
+from ssl import SSLContext, PROTOCOL_TLS_CLIENT
+from os import makedirs
+from shutil import which
+from tempfile import TemporaryDirectory
+from json import dumps
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+
+REQUEST = b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+
+def client_context(ca: str) -> SSLContext:
+    context = SSLContext(PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(ca)
+    context.set_alpn_protocols(["http/1.1"])
+    return context
+
+
+def fetch(connection):
+    # One request on the connection, the response is small and comes in one piece
+    connection.sendall(REQUEST)
+    connection.recv(65536)
+
+
+def handshakes(context: SSLContext, port: int, duration: float, resume: bool) -> float:
+    # Full handshakes, or abbreviated ones resuming the session of the previous connection
+    session, count, start = None, 0, perf_counter()
+    while perf_counter() - start < duration:
+        with create_connection(("127.0.0.1", port)) as connection:
+            with context.wrap_socket(connection, server_hostname="localhost", session=session if resume else None) as tls:
+                # TLS 1.3 tickets arrive after the handshake, so a request is made before the session is taken
+                fetch(tls)
+                session = tls.session
+                count += 1
+    return count / (perf_counter() - start)
+
+
+async def keep_alive_client(context: SSLContext, port: int, deadline: float, counter: list):
+    reader, writer = await open_connection("127.0.0.1", port, ssl=context, server_hostname="localhost")
+    while perf_counter() < deadline:
+        writer.write(REQUEST)
+        await writer.drain()
+        await reader.readuntil(b"\r\n\r\n")
+        counter[0] += 1
+    writer.close()
+
+
+async def requests(context: SSLContext, port: int, duration: float, concurrency: int) -> float:
+    # Requests per second over long-lived keep-alive connections
+    counter, start = [0], perf_counter()
+    await gather(*[keep_alive_client(context, port, start + duration, counter) for _ in range(concurrency)])
+    return counter[0] / (perf_counter() - start)
+
+
+def wait_for_nginx(port: int, server: Popen, log: str):
+    while server.poll() is None:
+        try:
+            create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            sleep(0.1)
+    print(f"\x1b[1;31mNGINX exited with code {server.returncode}, see {log}\x1b[0m")
+    exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Compares nginx profiles of the test sites by TLS handshakes and requests over loopback")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help=f"comma separated subset of: {', '.join(PROFILES)}")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of every measurement")
+    parser.add_argument("--concurrency", type=int, default=32, help="keep-alive connections sending requests")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--out", help="append JSON results to this file")
+    args = parser.parse_args()
+
+    if which("nginx") is None:
+        print(f"NGINX is needed for this benchmark, install it with your packet manager")
+        exit(1)
+
+    results = []
+    with TemporaryDirectory() as tmp:
+        make_pki(tmp)
+        make_server_certificate(tmp, 2561)
+        with open(f"{tmp}/site.crt", "w") as chain:
+            for part in ["server.crt", "ca.crt"]:
+                with open(f"{tmp}/{part}") as certificate:
+                    chain.write(certificate.read())
+        makedirs(f"{tmp}/www")
+        with open(f"{tmp}/www/index.html", "w") as index:
+            index.write("<Html><Body>bench</Body></Html>")
+        site = {"name": "localhost", "cert": f"{tmp}/site.crt", "key": f"{tmp}/server.key", "root": f"{tmp}/www"}
+        context = client_context(f"{tmp}/ca.crt")
+
+        for name in args.profiles.split(","):
+            tickets = rotate_ticket_keys(f"{tmp}/tickets") if PROFILES[name]["tickets"] else []
+            config = render(name, [site], port=args.port, tickets=tickets, runtime=tmp)
+            accepted, output = check(config, f"{tmp}/nginx.conf")
+            if not accepted:
+                print(f"\x1b[1;31mNGINX rejected {name} profile:\n{output}\x1b[0m")
+                continue
+            with open(f"{tmp}/nginx.conf", "w") as conf:
+                conf.write(config)
+
+            server = Popen(["nginx", "-p", tmp, "-c", f"{tmp}/nginx.conf", "-g", "daemon off;"], stdout=DEVNULL, stderr=DEVNULL)
+            try:
+                wait_for_nginx(args.port, server, f"{tmp}/error.log")
+                result = {"profile": name,
+                          "full_handshakes_per_s": round(handshakes(context, args.port, args.duration, resume=False), 1),
+                          "resumed_handshakes_per_s": round(handshakes(context, args.port, args.duration, resume=True), 1),
+                          "keep_alive_requests_per_s": round(run(requests(context, args.port, args.duration, args.concurrency)), 1)}
+            finally:
+                server.terminate()
+                server.wait()
+            results.append(result)
+            print(f"{name:>12}: {result['full_handshakes_per_s']:8.1f} full handshakes/s, {result['resumed_handshakes_per_s']:8.1f} resumed handshakes/s, "
+                  f"{result['keep_alive_requests_per_s']:9.1f} requests/s")
+
+    if args.out is not None:
+        with open(args.out, "a") as out:
+            for result in results:
+                out.write(dumps(result) + "\n")
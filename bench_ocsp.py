@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+from ocsp_responder import command
+
+from asyncio import open_connection, run, gather, wait_for, IncompleteReadError, TimeoutError as AsyncTimeoutError
+from subprocess import run as run_process, Popen, DEVNULL
+from socket import create_connection
+from os import sysconf, listdir, urandom
+from tempfile import TemporaryDirectory
+from random import Random
+from statistics import quantiles
+from resource import getrusage, RUSAGE_SELF
+from hashlib import sha1
+from json import dumps
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+
+try:
+    from cryptography import x509
+    from cryptography.x509 import ocsp
+    from cryptography.hazmat.primitives import hashes, serialization
+except ImportError:
+    x509 = None
+
+TICKS = sysconf("SC_CLK_TCK")
+
+
+def make_pki(tmp: str):
+    # CA and OCSP responder certificate signed by it
+    run_process(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", f"{tmp}/ca.key", "-out", f"{tmp}/ca.crt",
+                 "-subj", "/CN=bench CA", "-days", "30", "-addext", "keyUsage=critical,keyCertSign,cRLSign"], stdout=DEVNULL, stderr=DEVNULL, check=True)
+    run_process(["openssl", "req", "-new", "-newkey", "rsa:2048", "-keyout", f"{tmp}/resp.key", "-passout", "pass:bench",
+                 "-out", f"{tmp}/resp.csr", "-subj", "/CN=bench OCSP Responder",
+                 "-addext", "keyUsage=critical,digitalSignature", "-addext", "extendedKeyUsage=OCSPSigning"], stdout=DEVNULL, stderr=DEVNULL, check=True)
+    run_process(["openssl", "x509", "-req", "-in", f"{tmp}/resp.csr", "-CA", f"{tmp}/ca.crt", "-CAkey", f"{tmp}/ca.key",
+                 "-copy_extensions", "copy", "-days", "30", "-out", f"{tmp}/resp.crt"], stdout=DEVNULL, stderr=DEVNULL, check=True)
+
+
+def make_index(filename: str, count: int, revoked: float, random: Random) -> tuple:
+    # Synthetic openssl ca database, returns some of its good and revoked serials
+    good, bad = [], []
+    with open(filename, "w") as index:
+        for i in range(count):
+            serial = random.getrandbits(159) | 1 << 152
+            if random.random() < revoked:
+                index.write(f"R\t300101000000Z\t250101000000Z,keyCompromise\t{serial:040X}\tunknown\t/CN=bench {i}\n")
+                if len(bad) < 1000: bad.append(serial)
+            else:
+                index.write(f"V\t300101000000Z\t\t{serial:040X}\tunknown\t/CN=bench {i}\n")
+                if len(good) < 1000: good.append(serial)
+    return good, bad
+
+
+def make_requests(ca: str, serials: list, nonce: bool) -> list:
+    with open(ca, "rb") as pem:
+        issuer = x509.load_pem_x509_certificate(pem.read())
+    name_hash = sha1(issuer.subject.public_bytes()).digest()
+    key_hash = x509.SubjectKeyIdentifier.from_public_key(issuer.public_key()).digest
+    requests = []
+    for serial in serials:
+        builder = ocsp.OCSPRequestBuilder().add_certificate_by_hash(name_hash, key_hash, serial, hashes.SHA1())
+        if nonce:
+            builder = builder.add_extension(x509.OCSPNonce(urandom(16)), critical=False)
+        requests.append(builder.build().public_bytes(serialization.Encoding.DER))
+    return requests
+
+
+def cpu_time(pid: int) -> float:
+    # User and system time of the responder and its worker processes
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+            for task in listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as children:
+                    pids += [int(child) for child in children.read().split()]
+        except (FileNotFoundError, ProcessLookupError):
+            pass
+    return total / TICKS
+
+
+async def exchange(reader, writer, request: bytes, keep_alive: bool) -> str:
+    writer.write(f"POST / HTTP/{'1.1' if keep_alive else '1.0'}\r\nHost: 127.0.0.1\r\n"
+                 f"Content-Type: application/ocsp-request\r\nContent-Length: {len(request)}\r\n\r\n".encode() + request)
+    await writer.drain()
+    headers = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+    length = [line for line in headers.split("\r\n") if line.startswith("content-length:")]
+    body = await reader.readexactly(int(length[0].split(":")[1])) if length else await reader.read()
+    if not headers.startswith(("http/1.0 200", "http/1.1 200")) or len(body) == 0:
+        raise ConnectionError("bad response")
+    return headers
+
+
+async def client(port: int, requests: list, deadline: float, keep_alive: bool, stats: dict, random: Random):
+    reader = writer = None
+    while perf_counter() < deadline:
+        request = requests[random.randrange(len(requests))]
+        start = perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await open_connection("127.0.0.1", port)
+            # Stuck requests are counted as errors instead of stalling the run
+            headers = await wait_for(exchange(reader, writer, request, keep_alive), 10)
+            stats["latencies"].append(perf_counter() - start)
+            if not keep_alive or "connection: close" in headers:
+                writer.close()
+                writer = None
+        except (ConnectionError, IncompleteReadError, AsyncTimeoutError, OSError):
+            stats["errors"] += 1
+            if writer is not None: writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def drive(port: int, requests: list, concurrency: int, duration: float, keep_alive: bool, seed: int) -> dict:
+    stats = {"latencies": [], "errors": 0}
+    deadline = perf_counter() + duration
+    await gather(*[client(port, requests, deadline, keep_alive, stats, Random(seed + i)) for i in range(concurrency)])
+    return stats
+
+
+def wait_for_responder(port: int, responder: Popen, request: bytes):
+    # Complete request is sent, openssl ocsp serves one connection at a time and waits for empty ones forever
+    while responder.poll() is None:
+        try:
+            with create_connection(("127.0.0.1", port), timeout=5) as connection:
+                connection.sendall(f"POST / HTTP/1.0\r\nContent-Type: application/ocsp-request\r\nContent-Length: {len(request)}\r\n\r\n".encode() + request)
+                while connection.recv(65536): pass
+            return
+        except OSError:
+            sleep(0.1)
+    print(f"\x1b[1;31mOCSP responder exited with code {responder.returncode}\x1b[0m")
+    exit(1)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Drives OCSP responder with concurrent clients and reports throughput and latency as JSON")
+    parser.add_argument("--serials", type=int, default=10000, help="certificates in synthetic index.txt")
+    parser.add_argument("--revoked", type=float, default=0.1, help="share of revoked certificates in index.txt")
+    parser.add_argument("--mix", default="70:20:10", help="good:revoked:unknown ratio of requested serials")
+    parser.add_argument("--concurrency", type=int, default=32, help="simultaneous clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--nonce", action="store_true", help="send nonces, so every response has to be signed")
+    parser.add_argument("--responder", choices=["native", "openssl"], default="native")
+    parser.add_argument("--port", type=int, default=2561)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="append JSON result to this file")
+    args = parser.parse_args()
+
+    if x509 is None:
+        print(f"Python package cryptography is needed for OCSP benchmark, install it with pip")
+        print(f"e.g. \x1b[1mpip install cryptography\x1b[0m")
+        exit(1)
+
+    random = Random(args.seed)
+    with TemporaryDirectory() as tmp:
+        make_pki(tmp)
+        good, bad = make_index(f"{tmp}/index.txt", args.serials, args.revoked, random)
+        unknown = [random.getrandbits(159) | 1 << 152 for _ in range(1000)]
+        ratios = [int(part) for part in args.mix.split(":")]
+        serials = good[:ratios[0] * 10] + bad[:ratios[1] * 10] + unknown[:ratios[2] * 10]
+        requests = make_requests(f"{tmp}/ca.crt", serials, args.nonce)
+
+        argv = command(args.port, f"{tmp}/index.txt", f"{tmp}/ca.crt", f"{tmp}/resp.key", f"{tmp}/resp.crt", "bench")
+        if args.responder == "openssl":
+            argv = ["openssl", "ocsp", *argv[argv.index("-port"):]]
+        responder = Popen(argv, stdout=DEVNULL, stderr=DEVNULL)
+        try:
+            wait_for_responder(args.port, responder, requests[0])
+            # One request of every kind warms up the responder before measurements
+            run(drive(args.port, requests[:1] + requests[-1:], 1, 0.5, args.responder == "native", args.seed))
+
+            cpu_before, client_before, start = cpu_time(responder.pid), getrusage(RUSAGE_SELF), perf_counter()
+            stats = run(drive(args.port, requests, args.concurrency, args.duration, args.responder == "native", args.seed))
+            elapsed = perf_counter() - start
+            cpu_after, client_after = cpu_time(responder.pid), getrusage(RUSAGE_SELF)
+        finally:
+            responder.terminate()
+            responder.wait()
+
+    latencies = stats["latencies"]
+    percentiles = quantiles(latencies, n=100) if len(latencies) >= 2 else [0] * 99
+    result = {"responder": args.responder, "serials": args.serials, "mix": args.mix, "nonce": args.nonce,
+              "concurrency": args.concurrency, "duration_s": round(elapsed, 3),
+              "requests": len(latencies), "errors": stats["errors"],
+              "throughput_rps": round(len(latencies) / elapsed, 1),
+              "latency_ms": {"p50": round(percentiles[49] * 1000, 3), "p95": round(percentiles[94] * 1000, 3),
+                             "p99": round(percentiles[98] * 1000, 3), "max": round(max(latencies, default=0) * 1000, 3)},
+              "responder_cpu_ms_per_request": round((cpu_after - cpu_before) * 1000 / max(len(latencies), 1), 3),
+              "client_cpu_ms_per_request": round((client_after.ru_utime + client_after.ru_stime - client_before.ru_utime - client_before.ru_stime)
+                                                 * 1000 / max(len(latencies), 1), 3)}
+    print(dumps(result, indent=4))
+    if args.out is not None:
+        with open(args.out, "a") as out:
+            out.write(dumps(result) + "\n")
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+from bench_ocsp import make_pki, make_requests, wait_for_responder
+from ocsp_responder import command
+from stapling import Stapler
+
+from subprocess import run, Popen, DEVNULL
+from socket import create_connection
+from ssl import SSLContext, PROTOCOL_TLS_CLIENT
+from os.path import getsize
+from tempfile import TemporaryDirectory
+from statistics import quantiles
+from json import dumps
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+
+
+def make_server_certificate(tmp: str, ocsp_port: int):
+    run(["openssl", "req", "-new", "-newkey", "rsa:2048", "-nodes", "-keyout", f"{tmp}/server.key", "-out", f"{tmp}/server.csr",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+         "-addext", f"authorityInfoAccess=OCSP;URI:http://127.0.0.1:{ocsp_port}/"], stdout=DEVNULL, stderr=DEVNULL, check=True)
+    run(["openssl", "x509", "-req", "-in", f"{tmp}/server.csr", "-CA", f"{tmp}/ca.crt", "-CAkey", f"{tmp}/ca.key", "-set_serial", "0x1001",
+         "-copy_extensions", "copy", "-days", "30", "-out", f"{tmp}/server.crt"], stdout=DEVNULL, stderr=DEVNULL, check=True)
+    with open(f"{tmp}/index.txt", "w") as index:
+        index.write("V\t300101000000Z\t\t1001\tunknown\t/CN=localhost\n")
+
+
+def handshake(context: SSLContext, port: int):
+    with create_connection(("127.0.0.1", port)) as connection:
+        with context.wrap_socket(connection, server_hostname="localhost"):
+            pass
+
+
+def ocsp_lookup(port: int, request: bytes):
+    # Client without stapled response asks the responder on a new connection, as browsers do
+    with create_connection(("127.0.0.1", port)) as connection:
+        connection.sendall(f"POST / HTTP/1.0\r\nContent-Type: application/ocsp-request\r\nContent-Length: {len(request)}\r\n\r\n".encode() + request)
+        while connection.recv(65536): pass
+
+
+def summary(timings: list) -> dict:
+    percentiles = quantiles(timings, n=100)
+    return {"p50_ms": round(percentiles[49] * 1000, 3), "p95_ms": round(percentiles[94] * 1000, 3), "p99_ms": round(percentiles[98] * 1000, 3)}
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Compares TLS connection setup with stapled OCSP response and with OCSP lookup by client")
+    parser.add_argument("--handshakes", type=int, default=500)
+    parser.add_argument("--tls-port", type=int, default=4433)
+    parser.add_argument("--ocsp-port", type=int, default=2562)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        make_pki(tmp)
+        make_server_certificate(tmp, args.ocsp_port)
+        stapler = Stapler(f"{tmp}/index.txt", f"{tmp}/ca.crt", f"{tmp}/ca.crt", f"{tmp}/resp.crt", f"{tmp}/resp.key", "bench")
+        stapler.add(f"{tmp}/server.crt", f"{tmp}/server.staple")
+        stapler.refresh(force=True)
+        [request] = make_requests(f"{tmp}/ca.crt", [0x1001], nonce=False)
+
+        responder = Popen(command(args.ocsp_port, f"{tmp}/index.txt", f"{tmp}/ca.crt", f"{tmp}/resp.key", f"{tmp}/resp.crt", "bench"),
+                          stdout=DEVNULL, stderr=DEVNULL)
+        servers = {"stapled": Popen(["openssl", "s_server", "-quiet", "-accept", f"{args.tls_port}", "-cert", f"{tmp}/server.crt",
+                                     "-key", f"{tmp}/server.key", "-status_file", f"{tmp}/server.staple"], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL),
+                   "ocsp lookup": Popen(["openssl", "s_server", "-quiet", "-accept", f"{args.tls_port + 1}", "-cert", f"{tmp}/server.crt",
+                                         "-key", f"{tmp}/server.key"], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)}
+        try:
+            wait_for_responder(args.ocsp_port, responder, request)
+            sleep(0.5)
+            context = SSLContext(PROTOCOL_TLS_CLIENT)
+            context.load_verify_locations(f"{tmp}/ca.crt")
+
+            results = {}
+            for offset, name in enumerate(servers):
+                timings = []
+                for _ in range(args.handshakes):
+                    start = perf_counter()
+                    handshake(context, args.tls_port + offset)
+                    if name == "ocsp lookup":
+                        ocsp_lookup(args.ocsp_port, request)
+                    timings.append(perf_counter() - start)
+                results[name] = summary(timings)
+            results["staple_bytes"] = getsize(f"{tmp}/server.staple")
+        finally:
+            for process in [responder, *servers.values()]:
+                process.terminate()
+                process.wait()
+
+    print(dumps(results, indent=4))
@@ -0,0 +1,129 @@
+from truststore import entries, BEGIN
+from workspace import SCRATCH_ROOT
+
+from os import makedirs, listdir, utime, environ, getpid
+from os.path import expanduser, join, isfile, isdir, getsize, getmtime, basename, abspath
+from shutil import copyfile, rmtree, move
+from hashlib import sha256
+from functools import partial
+from threading import Lock
+from json import dumps
+from datetime import datetime, timedelta, timezone
+
+CACHE_DIR = environ.get("INSECON_CACHE", expanduser("~/.cache/insecon-build"))
+CACHE_SIZE = 256 * 1024 * 1024      # Least recently used entries are evicted above this size
+RENEWAL_MARGIN = timedelta(days=30) # Certificates expiring sooner are issued again instead of being restored
+
+
+def describe(action) -> str:
+    # Stable description of step action, object addresses must not get into it
+    if isinstance(action, list):
+        return dumps(action)
+    if isinstance(action, partial):
+        return dumps([action.func.__qualname__, [str(arg) for arg in action.args],
+                      {name: str(value) for name, value in sorted(action.keywords.items())}])
+    return dumps([action.__qualname__, [str(arg) for arg in action.__defaults__ or []]])
+
+
+def expiring(filename: str, now: datetime) -> bool:
+    # Dates are not part of the key, so certificates of the entry are checked on restore. Short-lived ones get a third of their lifetime
+    with open(filename, "rb") as file:
+        data = file.read()
+    if data.find(BEGIN) == -1:
+        return False
+    try:
+        return any(entry.not_after - min(RENEWAL_MARGIN, (entry.not_after - entry.not_before) / 3) <= now for entry in entries(data))
+    except (ValueError, IndexError):
+        return True
+
+
+def holds_keys(paths: list) -> bool:
+    # Private keys of any kind, encrypted ones included
+    for path in paths:
+        with open(path, "rb") as file:
+            if file.read().find(b"PRIVATE KEY") != -1:
+                return True
+    return False
+
+
+class BuildCache:
+    def __init__(self, directory: str = CACHE_DIR, limit: int = CACHE_SIZE, force: bool = False):
+        self.directory = directory
+        self.limit = limit
+        self.force = force              # Rebuilding every step, results are still stored
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        # Entries with private keys are kept in memory (tmpfs) only, they are lost on reboot and the keys are generated again
+        self.secret = join(SCRATCH_ROOT, "cache", sha256(abspath(directory).encode()).hexdigest()[:16])
+        makedirs(directory, mode=0o700, exist_ok=True)
+        makedirs(SCRATCH_ROOT, mode=0o700, exist_ok=True)
+        makedirs(self.secret, mode=0o700, exist_ok=True)
+
+    def key(self, step) -> str:
+        digest = sha256()
+        digest.update(describe(step.action).encode())
+        digest.update(dumps([basename(path) for path in step.outputs]).encode())
+        # Content of parent keys, certificates and other inputs
+        for path in step.inputs:
+            digest.update(path.encode())
+            if isfile(path):
+                with open(path, "rb") as file:
+                    digest.update(sha256(file.read()).digest())
+            else:
+                digest.update(b"missing")
+        return digest.hexdigest()
+
+    def locate(self, key: str) -> str:
+        # Entries with keys stored on disk by older versions are moved to memory on first use
+        entry, secret = join(self.directory, key), join(self.secret, key)
+        if isdir(entry) and holds_keys([join(entry, file) for file in listdir(entry)]):
+            if isdir(secret): rmtree(secret)
+            move(entry, secret)
+        return secret if isdir(secret) else entry
+
+    def restore(self, key: str, step) -> bool:
+        entry = self.locate(key)
+        now = datetime.now(timezone.utc)
+        if self.force or not isdir(entry) or any(expiring(join(entry, f"{index}"), now) for index in range(len(step.outputs))):
+            with self.lock: self.misses += 1
+            return False
+        for index, path in enumerate(step.outputs):
+            copyfile(join(entry, f"{index}"), path)
+        # Modification time of the entry is its last use
+        utime(entry)
+        with self.lock: self.hits += 1
+        return True
+
+    def store(self, key: str, step):
+        if not all(isfile(path) for path in step.outputs):
+            return
+        directory = self.secret if holds_keys(step.outputs) else self.directory
+        # Entry is assembled under temporary name, so concurrent runs never see half of it
+        temp = join(directory, f".{key}.{getpid()}.tmp")
+        makedirs(temp, exist_ok=True)
+        for index, path in enumerate(step.outputs):
+            copyfile(path, join(temp, f"{index}"))
+        if isdir(join(directory, key)):
+            rmtree(join(directory, key))
+        move(temp, join(directory, key))
+
+    def size(self, entry: str) -> int:
+        return sum(getsize(join(entry, file)) for file in listdir(entry))
+
+    def evict(self):
+        entries = [join(directory, entry) for directory in [self.directory, self.secret] for entry in listdir(directory) if not entry.startswith(".")]
+        entries.sort(key=getmtime)
+        total = sum(self.size(entry) for entry in entries)
+        while total > self.limit and len(entries) != 0:
+            entry = entries.pop(0)
+            total -= self.size(entry)
+            rmtree(entry)
+
+    def clean(self):
+        for directory in [self.directory, self.secret]:
+            rmtree(directory)
+            makedirs(directory, mode=0o700, exist_ok=True)
+
+    def report(self):
+        print(f"Build cache: {self.hits} steps reused, {self.misses} steps rebuilt")
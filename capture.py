@@ -0,0 +1,253 @@
+#!/usr/bin/python
+
+from tracing import run
+
+from subprocess import PIPE
+from ssl import SSLContext, PROTOCOL_TLS_CLIENT, MemoryBIO, SSLWantReadError, SSLZeroReturnError, SSLEOFError, DER_cert_to_PEM_cert
+from socket import create_connection, socket, gethostbyname, inet_aton
+from struct import pack, unpack
+from random import getrandbits
+from os import replace, remove
+from os.path import isfile, join
+from tempfile import TemporaryDirectory
+from time import time, sleep
+from re import search
+from argparse import ArgumentParser
+
+LINKTYPE_RAW = 101      # packets start with IPv4 header
+TLS_KEY_LOG = 0x544C534B
+MSS = 65483             # loopback MTU without IPv4 and TCP headers
+FIN, SYN, PSH, ACK = 0x01, 0x02, 0x08, 0x10
+
+
+def checksum(data: bytes) -> int:
+    data += b"\0" * (len(data) % 2)
+    total = sum(unpack(f"!{len(data) // 2}H", data))
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def block(kind: int, body: bytes) -> bytes:
+    body += b"\0" * (-len(body) % 4)
+    return pack("<II", kind, len(body) + 12) + body + pack("<I", len(body) + 12)
+
+
+class Capture:
+    def __init__(self):
+        self.packets = []               # (microseconds, IPv4 packet)
+        self.ident = 0
+
+    def packet(self, source: tuple, destination: tuple, seq: int, ack: int, flags: int, payload: bytes = b""):
+        pseudo = inet_aton(source[0]) + inet_aton(destination[0])
+        tcp = pack("!HHIIBBHHH", source[1], destination[1], seq & 0xFFFFFFFF, ack & 0xFFFFFFFF, 5 << 4, flags, 65535, 0, 0) + payload
+        tcp = tcp[:16] + pack("!H", checksum(pseudo + pack("!BBH", 0, 6, len(tcp)) + tcp)) + tcp[18:]
+        self.ident = (self.ident + 1) & 0xFFFF
+        ip = pack("!BBHHHBBH", 0x45, 0, 20 + len(tcp), self.ident, 0x4000, 64, 6, 0) + pseudo
+        ip = ip[:10] + pack("!H", checksum(ip)) + ip[12:]
+        self.packets.append((int(time() * 1000000), ip + tcp))
+
+    def save(self, filename: str, keylog: str = None):
+        # Keys go to a decryption secrets block as well, so Wireshark decrypts the trace without the separate log
+        with open(f"{filename}.tmp", "wb") as pcapng:
+            pcapng.write(block(0x0A0D0D0A, pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)))
+            if keylog is not None and isfile(keylog):
+                with open(keylog, "rb") as log:
+                    secrets = log.read()
+                pcapng.write(block(0x0000000A, pack("<II", TLS_KEY_LOG, len(secrets)) + secrets))
+            pcapng.write(block(0x00000001, pack("<HHI", LINKTYPE_RAW, 0, 0)))
+            for timestamp, data in self.packets:
+                pcapng.write(block(0x00000006, pack("<IIIII", 0, timestamp >> 32, timestamp & 0xFFFFFFFF, len(data), len(data)) + data))
+        replace(f"{filename}.tmp", filename)
+
+
+class Stream:
+    # TCP connection whose segments are recorded as they would be seen on the loopback interface
+    def __init__(self, capture: Capture, name: str, port: int, records: dict = {}, routes: dict = {}):
+        self.capture = capture
+        # Packets show the address of the name, while the connection may be routed to another port, e.g. of a private nginx
+        self.server = (records[name] if name in records else gethostbyname(name), port)
+        self.socket = create_connection(routes.get((name, port), self.server), timeout=10)
+        self.client = self.socket.getsockname()
+        self.client_seq, self.server_seq = getrandbits(32), getrandbits(32)
+        self.closed = False
+        self.segment(True, SYN)
+        self.segment(False, SYN | ACK)
+        self.segment(True, ACK)
+
+    def segment(self, from_client: bool, flags: int, payload: bytes = b""):
+        if from_client:
+            self.capture.packet(self.client, self.server, self.client_seq, self.server_seq, flags, payload)
+            self.client_seq += len(payload) + (1 if flags & (SYN | FIN) else 0)
+        else:
+            self.capture.packet(self.server, self.client, self.server_seq, self.client_seq, flags, payload)
+            self.server_seq += len(payload) + (1 if flags & (SYN | FIN) else 0)
+
+    def send(self, data: bytes):
+        self.socket.sendall(data)
+        for start in range(0, len(data), MSS):
+            self.segment(True, PSH | ACK, data[start:start + MSS])
+
+    def recv(self) -> bytes:
+        data = self.socket.recv(65536)
+        for start in range(0, len(data), MSS):
+            self.segment(False, PSH | ACK, data[start:start + MSS])
+        if not data and not self.closed:
+            self.closed = True
+            self.segment(False, FIN | ACK)
+        return data
+
+    def close(self):
+        self.socket.close()
+        self.segment(True, FIN | ACK)
+        if not self.closed:
+            self.closed = True
+            self.segment(False, FIN | ACK)
+        self.segment(True, ACK)
+
+
+class TLSStream:
+    # TLS runs over memory buffers, so every record is sent and recorded by the underlying stream
+    def __init__(self, stream: Stream, context: SSLContext, hostname: str):
+        self.stream = stream
+        self.incoming, self.outgoing = MemoryBIO(), MemoryBIO()
+        self.tls = context.wrap_bio(self.incoming, self.outgoing, server_hostname=hostname)
+        self.call(self.tls.do_handshake)
+
+    def flush(self):
+        data = self.outgoing.read()
+        if data:
+            self.stream.send(data)
+
+    def call(self, function, *args):
+        while True:
+            try:
+                result = function(*args)
+                self.flush()
+                return result
+            except SSLWantReadError:
+                self.flush()
+                data = self.stream.recv()
+                if data:
+                    self.incoming.write(data)
+                else:
+                    self.incoming.write_eof()
+
+    def send(self, data: bytes):
+        self.call(self.tls.write, data)
+
+    def recv(self) -> bytes:
+        try:
+            return self.call(self.tls.read, 65536)
+        except (SSLZeroReturnError, SSLEOFError):
+            return b""
+
+    def close(self):
+        # close_notify is sent without waiting for the one of the server
+        try:
+            self.tls.unwrap()
+        except SSLWantReadError:
+            pass
+        self.flush()
+        self.stream.close()
+
+
+def exchange(stream, request: bytes) -> tuple:
+    # One HTTP request with Connection: close, the response is read until the server closes the connection
+    stream.send(request)
+    response = b""
+    while chunk := stream.recv():
+        response += chunk
+    head, _, body = response.partition(b"\r\n\r\n")
+    return head.decode("latin-1"), body
+
+
+def split_url(url: str) -> tuple:
+    scheme, rest = url.split("://", 1)
+    authority, _, path = rest.partition("/")
+    name, _, port = authority.partition(":")
+    return name, int(port) if port else (443 if scheme == "https" else 80), f"/{path}"
+
+
+def check_status(capture: Capture, leaf: bytes, issuer: str, ca: str, records: dict, routes: dict) -> str:
+    # OCSP request to the responder from authorityInfoAccess of the certificate, as a browser does before showing the page
+    with TemporaryDirectory() as tmp:
+        certificate = join(tmp, "leaf.crt")
+        with open(certificate, "w") as pem:
+            pem.write(DER_cert_to_PEM_cert(leaf))
+        url = run(["openssl", "x509", "-in", certificate, "-noout", "-ocsp_uri"], stdout=PIPE, text=True, check=True).stdout.strip()
+        if not url:
+            return "unknown"
+        request = run(["openssl", "ocsp", "-issuer", issuer, "-cert", certificate, "-no_nonce", "-reqout", "/dev/stdout"],
+                      stdout=PIPE, check=True).stdout
+
+        name, port, path = split_url(url)
+        stream = Stream(capture, name, port, records, routes)
+        _, response = exchange(stream, f"POST {path} HTTP/1.1\r\nHost: {name}:{port}\r\nContent-Type: application/ocsp-request\r\n"
+                                       f"Content-Length: {len(request)}\r\nConnection: close\r\n\r\n".encode() + request)
+        stream.close()
+
+        result = run(["openssl", "ocsp", "-respin", "/dev/stdin", "-issuer", issuer, "-cert", certificate, "-CAfile", ca],
+                     input=response, stdout=PIPE, stderr=PIPE, warn=False)
+    found = search(rb": (good|revoked|unknown)", result.stdout)
+    return found.group(1).decode() if found and result.returncode == 0 else "unknown"
+
+
+def visit(url: str, ca: str, issuer: str, pcapng: str, keylog: str, records: dict = {}, routes: dict = {}) -> str:
+    # Handshake, OCSP check of the server certificate and the page request if it is not revoked, returns OCSP status
+    if isfile(keylog):
+        remove(keylog)
+    context = SSLContext(PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(ca)
+    context.set_alpn_protocols(["http/1.1"])
+    context.keylog_filename = keylog
+
+    capture = Capture()
+    name, port, path = split_url(url)
+    tls = TLSStream(Stream(capture, name, port, records, routes), context, name)
+    status = check_status(capture, tls.tls.getpeercert(True), issuer, ca, records, routes)
+    if status == "good":
+        exchange(tls, f"GET {path} HTTP/1.1\r\nHost: {name}\r\nConnection: close\r\n\r\n".encode())
+    tls.close()
+    capture.save(pcapng, keylog)
+    return status
+
+
+def free_port() -> int:
+    with socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_for_port(port: int, process, timeout: float = 10) -> bool:
+    deadline = time() + timeout
+    while process.poll() is None and time() < deadline:
+        try:
+            create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            sleep(0.02)
+    return False
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Opens HTTPS page with OCSP check of the server certificate and saves the traffic as pcapng with NSS key log")
+    parser.add_argument("url")
+    parser.add_argument("--CAfile", required=True, dest="ca", help="trusted certificates")
+    parser.add_argument("--issuer", required=True, help="issuer of the server certificate")
+    parser.add_argument("--pcapng", required=True)
+    parser.add_argument("--keylog", required=True)
+    parser.add_argument("--resolve", nargs="*", default=[], metavar="NAME=ADDRESS", help="addresses of names, the system resolver is used for others")
+    parser.add_argument("--route", nargs="*", default=[], metavar="NAME:PORT=HOST:PORT", help="connect elsewhere while the trace shows the name")
+    args = parser.parse_args()
+
+    records = dict(record.split("=", 1) for record in args.resolve)
+    routes = {}
+    for route in args.route:
+        source, target = route.split("=", 1)
+        name, port = source.rsplit(":", 1)
+        host, target_port = target.rsplit(":", 1)
+        routes[(name, int(port))] = (host, int(target_port))
+    status = visit(args.url, args.ca, args.issuer, args.pcapng, args.keylog, records, routes)
+    print(f"{args.url}: {status}")
@@ -0,0 +1,576 @@
+#!/usr/bin/python
+
+from capture import LINKTYPE_RAW, TLS_KEY_LOG, FIN, SYN, ACK
+from crl import read
+
+from struct import unpack
+from socket import inet_ntop, AF_INET, AF_INET6
+from hashlib import sha256, sha384
+from hmac import new as hmac
+from base64 import b64decode
+from urllib.parse import unquote
+from json import dumps
+from argparse import ArgumentParser
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.exceptions import InvalidTag
+except ImportError:
+    AESGCM = None
+
+SECTION, INTERFACE, SIMPLE_PACKET, ENHANCED_PACKET, SECRETS = 0x0A0D0D0A, 0x00000001, 0x00000003, 0x00000006, 0x0000000A
+MAX_BLOCK = 16 * 1024 * 1024        # larger blocks mean a broken file, they are never read into memory
+LIMIT = 256 * 1024                  # payload kept of every direction, handshakes and OCSP exchanges are far shorter
+HELLO_RETRY = bytes.fromhex("CF21AD74E59A6111BE1D8C021E65B891C2A211167ABB8C5E079E09E2C8A8339C")
+STATUSES = {0x80: "good", 0xA1: "revoked", 0x82: "unknown"}
+VERSIONS = {0x0304: "1.3", 0x0303: "1.2", 0x0302: "1.1", 0x0301: "1.0", None: ""}
+
+# AEAD, key length and hash of cipher suites whose records are decrypted to check the secrets
+TLS13_SUITES = {0x1301: ("AESGCM", 16, sha256), 0x1302: ("AESGCM", 32, sha384), 0x1303: ("ChaCha20Poly1305", 32, sha256)}
+TLS12_SUITES = {0xC02B: ("AESGCM", 16, sha256), 0xC02F: ("AESGCM", 16, sha256), 0x009E: ("AESGCM", 16, sha256),
+                0xC02C: ("AESGCM", 32, sha384), 0xC030: ("AESGCM", 32, sha384), 0x009F: ("AESGCM", 32, sha384),
+                0xCCA8: ("ChaCha20Poly1305", 32, sha256), 0xCCA9: ("ChaCha20Poly1305", 32, sha256), 0xCCAA: ("ChaCha20Poly1305", 32, sha256)}
+
+
+########## pcapng ##########
+
+def blocks(file):
+    # (type, byte order, body) of every block, one block in memory at a time. Byte order is set by each section header
+    order = None
+    while header := file.read(8):
+        if order is None and header[:4] in (b"\xd4\xc3\xb2\xa1", b"\xa1\xb2\xc3\xd4", b"\x4d\x3c\xb2\xa1"):
+            raise ValueError("classic pcap file, save the capture in pcapng format")
+        if order is None and header[:4] != b"\x0a\x0d\x0d\x0a":
+            raise ValueError("not a pcapng file")
+        if len(header) < 8:
+            raise ValueError("file ends inside a block header")
+        kind, length = unpack(f"{order or '<'}II", header)
+        if kind == SECTION:
+            magic = file.read(4)
+            if magic not in (b"\x4d\x3c\x2b\x1a", b"\x1a\x2b\x3c\x4d"):
+                raise ValueError("bad byte-order magic of section header")
+            order = "<" if magic == b"\x4d\x3c\x2b\x1a" else ">"
+            length = unpack(f"{order}I", header[4:])[0]
+            body = magic
+        else:
+            body = b""
+        if length < 12 or length % 4 or length > MAX_BLOCK:
+            raise ValueError(f"bad length {length} of block {kind:#x}")
+        body += file.read(length - 12 - len(body))
+        trailer = file.read(4)
+        if len(trailer) < 4 or unpack(f"{order}I", trailer)[0] != length:
+            raise ValueError(f"block {kind:#x} is truncated or its lengths differ")
+        yield kind, order, body
+
+
+def network(linktype: int, frame: bytes) -> bytes:
+    # IP packet of the frame for link types Wireshark and capture.py save for loopback, None for other protocols
+    if linktype in (LINKTYPE_RAW, 228, 229):
+        return frame
+    if linktype == 0:                               # BSD loopback
+        return frame[4:]
+    if linktype == 1:                               # Ethernet, Linux lo has zero addresses
+        offset = 12
+        while frame[offset:offset + 2] in (b"\x81\x00", b"\x88\xa8"):
+            offset += 4
+        return frame[offset + 2:] if frame[offset:offset + 2] in (b"\x08\x00", b"\x86\xdd") else None
+    if linktype == 113:                             # Linux cooked capture
+        return frame[16:] if frame[14:16] in (b"\x08\x00", b"\x86\xdd") else None
+    if linktype == 276:                             # Linux cooked capture v2
+        return frame[20:] if frame[0:2] in (b"\x08\x00", b"\x86\xdd") else None
+    return None
+
+
+def tcp_segment(packet: bytes) -> tuple:
+    # (source, destination, seq, flags, payload) of TCP over IPv4 or IPv6, None for anything else
+    if len(packet) >= 20 and packet[0] >> 4 == 4:
+        header, total = (packet[0] & 0x0F) * 4, unpack("!H", packet[2:4])[0]
+        if packet[9] != 6 or unpack("!H", packet[6:8])[0] & 0x1FFF:      # fragments are not reassembled
+            return None
+        source, destination, tcp = inet_ntop(AF_INET, packet[12:16]), inet_ntop(AF_INET, packet[16:20]), packet[header:total]
+    elif len(packet) >= 40 and packet[0] >> 4 == 6:
+        if packet[6] != 6:
+            return None
+        source, destination = inet_ntop(AF_INET6, packet[8:24]), inet_ntop(AF_INET6, packet[24:40])
+        tcp = packet[40:40 + unpack("!H", packet[4:6])[0]]
+    else:
+        return None
+    if len(tcp) < 20:
+        return None
+    source_port, destination_port, seq, _, offset, flags = unpack("!HHIIBB", tcp[:14])
+    return (source, source_port), (destination, destination_port), seq, flags, tcp[(offset >> 4) * 4:]
+
+
+########## TCP ##########
+
+class Direction:
+    # Payload of one direction of a connection in sequence order, only its beginning is kept
+    def __init__(self):
+        self.base = None            # sequence number of the first payload byte
+        self.data = bytearray()
+        self.size = 0               # bytes in order, including those not kept
+        self.pending = {}           # segments which arrived before the ones preceding them
+        self.limit = LIMIT
+        self.fin = False
+
+    def add(self, seq: int, flags: int, payload: bytes):
+        if flags & SYN:
+            self.base = (seq + 1) & 0xFFFFFFFF
+            return
+        if self.base is None:       # connection started before the capture
+            self.base = seq
+        self.fin = self.fin or bool(flags & FIN)
+        if not payload:
+            return
+        offset = (seq - self.base) & 0xFFFFFFFF
+        if offset >= 1 << 31:       # retransmission of bytes before the first kept one
+            offset -= 1 << 32
+        if offset > self.size:
+            if len(self.pending) < 256:
+                self.pending[offset] = payload
+            return
+        self.append(offset, payload)
+        while ready := [start for start in self.pending if start <= self.size]:
+            for start in sorted(ready):
+                self.append(start, self.pending.pop(start))
+
+    def append(self, offset: int, payload: bytes):
+        payload = payload[self.size - offset:]          # retransmitted bytes are dropped
+        if len(self.data) < self.limit:
+            self.data += payload[:self.limit - len(self.data)]
+        self.size += len(payload)
+
+    def drop(self):
+        self.limit, self.data, self.pending = 0, bytearray(), {}
+
+
+class Connection:
+    def __init__(self, client: tuple, server: tuple):
+        self.client, self.server = client, server
+        self.sent, self.received = Direction(), Direction()
+        self.kind = None            # "ocsp", "tls" or "other" once the first client bytes are seen
+
+    def add(self, source: tuple, seq: int, flags: int, payload: bytes):
+        (self.sent if source == self.client else self.received).add(seq, flags, payload)
+
+
+########## TLS ##########
+
+def records(data: bytes):
+    # (content type, header, fragment) of complete TLS records
+    offset = 0
+    while offset + 5 <= len(data):
+        length = unpack("!H", data[offset + 3:offset + 5])[0]
+        if offset + 5 + length > len(data):
+            break
+        yield data[offset], bytes(data[offset:offset + 5]), bytes(data[offset + 5:offset + 5 + length])
+        offset += 5 + length
+
+
+def handshake_messages(data: bytes):
+    # (type, body) of handshake messages in plaintext records before encryption starts, a message may span records
+    stream = b""
+    for kind, _, fragment in records(data):
+        if kind != 22:
+            break
+        stream += fragment
+    offset = 0
+    while offset + 4 <= len(stream):
+        length = int.from_bytes(stream[offset + 1:offset + 4], "big")
+        if offset + 4 + length > len(stream):
+            break
+        yield stream[offset], stream[offset + 4:offset + 4 + length]
+        offset += 4 + length
+
+
+def extensions(body: bytes, offset: int) -> dict:
+    found = {}
+    if offset + 2 > len(body):
+        return found
+    end = offset + 2 + unpack("!H", body[offset:offset + 2])[0]
+    offset += 2
+    while offset + 4 <= end:
+        kind, length = unpack("!HH", body[offset:offset + 4])
+        found[kind] = body[offset + 4:offset + 4 + length]
+        offset += 4 + length
+    return found
+
+
+def client_hello(body: bytes) -> tuple:
+    # Client random and server name
+    offset = 34
+    offset += 1 + body[offset]                                      # session id
+    offset += 2 + unpack("!H", body[offset:offset + 2])[0]          # cipher suites
+    offset += 1 + body[offset]                                      # compression methods
+    sni = extensions(body, offset).get(0)
+    return body[2:34], sni[5:5 + unpack("!H", sni[3:5])[0]].decode("ascii", "replace") if sni else None
+
+
+def server_hello(body: bytes) -> tuple:
+    # Server random, negotiated version and cipher suite
+    offset = 35 + body[34]
+    suite = unpack("!H", body[offset:offset + 2])[0]
+    supported = extensions(body, offset + 3).get(43)
+    version = unpack("!H", supported)[0] if supported else unpack("!H", body[:2])[0]
+    return body[2:34], version, suite
+
+
+def expand(secret: bytes, info: bytes, length: int, digest) -> bytes:
+    # HKDF-Expand
+    output, block, counter = b"", b"", 1
+    while len(output) < length:
+        block = hmac(secret, block + info + bytes([counter]), digest).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+
+def expand_label(secret: bytes, label: bytes, length: int, digest) -> bytes:
+    full = b"tls13 " + label
+    return expand(secret, length.to_bytes(2, "big") + bytes([len(full)]) + full + b"\x00", length, digest)
+
+
+def p_hash(secret: bytes, seed: bytes, length: int, digest) -> bytes:
+    # PRF of TLS 1.2
+    output, a = b"", seed
+    while len(output) < length:
+        a = hmac(secret, a, digest).digest()
+        output += hmac(secret, a + seed, digest).digest()
+    return output[:length]
+
+
+def xor_nonce(iv: bytes, seq: int) -> bytes:
+    return bytes(a ^ b for a, b in zip(iv, seq.to_bytes(len(iv), "big")))
+
+
+def aead(name: str, key: bytes):
+    return AESGCM(key) if name == "AESGCM" else ChaCha20Poly1305(key)
+
+
+def opens(cipher, nonce: bytes, data: bytes, aad: bytes) -> bool:
+    try:
+        cipher.decrypt(nonce, data, aad)
+        return True
+    except InvalidTag:
+        return False
+
+
+def encrypted(data: bytes, tls13: bool) -> list:
+    # Records protected by traffic keys: in TLS 1.3 all application_data ones, in TLS 1.2 everything after ChangeCipherSpec
+    found, started = [], False
+    for kind, header, fragment in records(data):
+        if tls13 and kind == 23 or started:
+            found.append((kind, header, fragment))
+        started = started or (not tls13 and kind == 20)
+    return found
+
+
+def check_tls13(side: str, data: bytes, suite: int, client_random: bytes, secrets: dict) -> tuple:
+    # Records of one side are opened with its handshake secret and then with its first application secret.
+    # Returns labels of the secrets which opened records and problems found
+    name, length, digest = TLS13_SUITES[suite]
+    keys = []
+    for label in [f"{side}_HANDSHAKE_TRAFFIC_SECRET", f"{side}_TRAFFIC_SECRET_0"]:
+        secret = secrets.get((label, client_random))
+        if secret is None:
+            break
+        keys.append((label, aead(name, expand_label(secret, b"key", length, digest)), expand_label(secret, b"iv", 12, digest)))
+    if not keys:
+        return [], [f"{side}_HANDSHAKE_TRAFFIC_SECRET is not in the key log"]
+    verified, current, seq = [], 0, 0
+    for number, (_, header, fragment) in enumerate(encrypted(data, True)):
+        while current < len(keys) and not opens(keys[current][1], xor_nonce(keys[current][2], seq), fragment, header):
+            current, seq = current + 1, 0
+        if current == len(keys):
+            return verified, [f"{side.lower()} record {number} is not decrypted with {' or '.join(label for label, _, _ in keys)}"]
+        if keys[current][0] not in verified:
+            verified.append(keys[current][0])
+        seq += 1
+    return verified, []
+
+
+def check_tls12(side: str, data: bytes, suite: int, client_random: bytes, server_random: bytes, secrets: dict) -> tuple:
+    # Finished and following records of one side are opened with keys derived from the master secret
+    name, length, digest = TLS12_SUITES[suite]
+    master = secrets.get(("CLIENT_RANDOM", client_random))
+    if master is None:
+        return [], ["CLIENT_RANDOM is not in the key log"]
+    iv_length = 4 if name == "AESGCM" else 12
+    block = p_hash(master, b"key expansion" + server_random + client_random, 2 * length + 2 * iv_length, digest)
+    index = 0 if side == "CLIENT" else 1
+    key = block[index * length:(index + 1) * length]
+    iv = block[2 * length + index * iv_length:2 * length + (index + 1) * iv_length]
+    cipher = aead(name, key)
+    for seq, (kind, header, fragment) in enumerate(encrypted(data, False)):
+        if name == "AESGCM":
+            nonce, fragment = iv + fragment[:8], fragment[8:]
+        else:
+            nonce = xor_nonce(iv, seq)
+        aad = seq.to_bytes(8, "big") + header[:3] + (len(fragment) - 16).to_bytes(2, "big")
+        if not opens(cipher, nonce, fragment, aad):
+            return [], [f"{side.lower()} record {seq} is not decrypted with CLIENT_RANDOM"]
+    return ["CLIENT_RANDOM"], []
+
+
+def load_keylog(lines) -> dict:
+    # NSS key log: label, client random and secret in hex
+    secrets = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and not parts[0].startswith("#"):
+            try:
+                secrets[(parts[0], bytes.fromhex(parts[1]))] = bytes.fromhex(parts[2])
+            except ValueError:
+                pass
+    return secrets
+
+
+########## OCSP ##########
+
+def http_message(data: bytes) -> tuple:
+    # Start line, headers and body of the first HTTP/1.x message, body is None while incomplete
+    head, separator, rest = bytes(data).partition(b"\r\n\r\n")
+    if not separator:
+        return None, {}, None
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:])}
+    if "content-length" in headers:
+        length = int(headers["content-length"])
+        return lines[0], headers, rest[:length] if len(rest) >= length else None
+    return lines[0], headers, rest
+
+
+def elements(data: bytes, start: int = 0, end: int = None):
+    # (tag, content) of DER elements between start and end
+    end = len(data) if end is None else end
+    while start < end:
+        tag, content, start = read(data, start)
+        yield tag, data[content:start]
+
+
+def request_serials(der: bytes) -> list:
+    # OCSPRequest -> tbsRequest -> requestList -> Request -> CertID -> serialNumber
+    _, request = next(elements(der))
+    _, tbs = next(elements(request))
+    request_list = [content for tag, content in elements(tbs) if tag == 0x30][0]
+    serials = []
+    for _, single in elements(request_list):
+        _, cert_id = next(elements(single))
+        serials.append(int.from_bytes(list(elements(cert_id))[3][1], "big"))
+    return serials
+
+
+def response_statuses(der: bytes) -> list:
+    # OCSPResponse -> responseBytes -> BasicOCSPResponse -> tbsResponseData -> responses -> (serial, certStatus)
+    _, response = next(elements(der))
+    items = list(elements(response))
+    if items[0][1] != b"\x00":
+        raise ValueError(f"responseStatus is {items[0][1][0]}, not successful")
+    _, response_bytes = next(elements(items[1][1]))
+    _, basic = list(elements(response_bytes))[1]
+    _, signed = next(elements(basic))
+    _, tbs = next(elements(signed))
+    responses = [content for tag, content in elements(tbs) if tag == 0x30][0]
+    statuses = []
+    for _, single in elements(responses):
+        parts = list(elements(single))
+        statuses.append((int.from_bytes(list(elements(parts[0][1]))[3][1], "big"), STATUSES.get(parts[1][0], "unknown")))
+    return statuses
+
+
+def ocsp_exchange(connection: Connection) -> tuple:
+    # Requested serials and statuses of the response, POST and GET requests are both accepted
+    line, headers, body = http_message(connection.sent.data)
+    if line is None:
+        raise ValueError("no complete HTTP request")
+    method, path, _ = line.split(" ", 2)
+    der = body if method == "POST" else b64decode(unquote(path.rsplit("/", 1)[1]))
+    serials = request_serials(der)
+    line, headers, body = http_message(connection.received.data)
+    if line is None or body is None:
+        raise ValueError("no complete HTTP response")
+    if line.split()[1] != "200":
+        raise ValueError(f"responder answered {line}")
+    return serials, response_statuses(body)
+
+
+########## Validation ##########
+
+class Validator:
+    # Reads the capture once and keeps only the beginnings of connections to the task sites and the responder
+    def __init__(self, hosts: list, ocsp_port: int = 2560):
+        self.hosts, self.ocsp_port = hosts, ocsp_port
+        self.connections = {}
+        self.secrets = {}           # from decryption secrets blocks
+        self.packets, self.truncated, self.skipped = 0, 0, 0
+        self.linktypes = set()
+
+    def feed(self, filename: str):
+        interfaces = []
+        with open(filename, "rb") as file:
+            for kind, order, body in blocks(file):
+                if kind == SECTION:
+                    interfaces = []
+                elif kind == INTERFACE:
+                    interfaces.append(unpack(f"{order}H", body[:2])[0])
+                elif kind == ENHANCED_PACKET:
+                    interface, _, _, captured, original = unpack(f"{order}IIIII", body[:20])
+                    self.packet(interfaces[interface], body[20:20 + captured], captured < original)
+                elif kind == SIMPLE_PACKET:
+                    original = unpack(f"{order}I", body[:4])[0]
+                    self.packet(interfaces[0], body[4:4 + original], len(body) - 4 < original)
+                elif kind == SECRETS:
+                    secrets_type, length = unpack(f"{order}II", body[:8])
+                    if secrets_type == TLS_KEY_LOG:
+                        self.secrets.update(load_keylog(body[8:8 + length].decode("ascii", "replace").splitlines()))
+
+    def packet(self, linktype: int, frame: bytes, truncated: bool):
+        self.packets += 1
+        self.linktypes.add(linktype)
+        ip = network(linktype, frame)
+        segment = tcp_segment(ip) if ip else None
+        if segment is None:
+            self.skipped += 1
+            return
+        self.truncated += truncated
+        source, destination, seq, flags, payload = segment
+        key = (min(source, destination), max(source, destination))
+        connection = self.connections.get(key)
+        if connection is None or flags & SYN and not flags & ACK and connection.sent.size + connection.received.size:
+            # Client is the side opening the connection, or the one not on a server port if the opening was not captured
+            client_side = flags & SYN and not flags & ACK or destination[1] == self.ocsp_port or source[1] > destination[1]
+            connection = self.connections[key] = Connection(source, destination) if client_side else Connection(destination, source)
+        connection.add(source, seq, flags, payload)
+        if connection.kind is None:
+            self.classify(connection)
+
+    def classify(self, connection: Connection):
+        # Only connections to the responder and TLS connections to the task sites keep their payload
+        data = connection.sent.data
+        if connection.server[1] == self.ocsp_port:
+            connection.kind = "ocsp"
+        elif data and data[0] != 22:
+            connection.kind = "other"
+        elif data:
+            for kind, body in handshake_messages(data):
+                if kind == 1:
+                    connection.kind = "tls" if client_hello(body)[1] in self.hosts else "other"
+            if len(data) >= 16 * 1024 + 5:
+                connection.kind = "other"
+        if connection.kind == "other":
+            connection.sent.drop()
+            connection.received.drop()
+
+    def handshakes(self, keylog: dict) -> list:
+        # (server name, version, suite, client random, verified secrets or problems) of every TLS connection to the sites
+        found = []
+        for connection in self.connections.values():
+            if connection.kind != "tls":
+                continue
+            hellos = [client_hello(body) for kind, body in handshake_messages(connection.sent.data) if kind == 1]
+            servers = [server_hello(body) for kind, body in handshake_messages(connection.received.data) if kind == 2]
+            servers = [hello for hello in servers if hello[0] != HELLO_RETRY]
+            if not servers:
+                found.append((hellos[-1][1], None, None, hellos[-1][0], "no ServerHello"))
+                continue
+            (client_random, name), (server_random, version, suite) = hellos[-1], servers[-1]
+            secrets = keylog
+            if AESGCM is None:
+                checked = None
+            elif version == 0x0304 and suite in TLS13_SUITES:
+                checked = [check_tls13(side, data, suite, client_random, secrets)
+                           for side, data in [("CLIENT", connection.sent.data), ("SERVER", connection.received.data)]]
+            elif version == 0x0303 and suite in TLS12_SUITES:
+                checked = [check_tls12(side, data, suite, client_random, server_random, secrets)
+                           for side, data in [("CLIENT", connection.sent.data), ("SERVER", connection.received.data)]]
+            else:
+                checked = None
+            found.append((name, version, suite, client_random, checked))
+        return found
+
+
+def check_capture(pcapng: str, keylog: str, host: str, expected: str, ocsp_port: int = 2560) -> list:
+    # (passed, message) of every check, None as passed marks what could not be checked
+    results = []
+    validator = Validator([host], ocsp_port)
+    try:
+        validator.feed(pcapng)
+    except (OSError, ValueError, IndexError) as error:
+        return [(False, f"{pcapng} can not be read: {error}")]
+    results.append((validator.packets > 0, f"{validator.packets} packets, link types {', '.join(map(str, sorted(validator.linktypes))) or 'none'}"))
+    if validator.truncated:
+        results.append((False, f"{validator.truncated} TCP packets are cut by the snapshot length"))
+
+    try:
+        with open(keylog) as log:
+            secrets = load_keylog(log)
+    except OSError as error:
+        secrets = {}
+        results.append((False, f"key log can not be read: {error}"))
+
+    # Status of the site certificate as the responder gave it
+    exchanges = [connection for connection in validator.connections.values() if connection.kind == "ocsp"]
+    statuses = []
+    for connection in exchanges:
+        try:
+            serials, answered = ocsp_exchange(connection)
+            statuses += answered
+            results.append((any(status == expected for _, status in answered) and {serial for serial, _ in answered} <= set(serials),
+                            f"OCSP {', '.join(f'{serial:X}: {status}' for serial, status in answered)}, expected {expected}"))
+        except (ValueError, IndexError, StopIteration) as error:
+            results.append((False, f"OCSP exchange {connection.client[0]}:{connection.client[1]} -> port {ocsp_port} is broken: {error}"))
+    if not exchanges:
+        results.append((False, f"no OCSP exchange on port {ocsp_port}"))
+
+    # Secrets embedded in the capture are only a copy, the key log alone has to decrypt the sessions
+    differing = [label for (label, random), secret in validator.secrets.items() if secrets.get((label, random), secret) != secret]
+    if differing:
+        results.append((False, f"secrets embedded in the capture differ from the key log: {', '.join(sorted(set(differing)))}"))
+
+    handshakes = validator.handshakes(secrets)
+    if not handshakes:
+        results.append((False, f"no TLS handshake with {host}"))
+    for name, version, suite, client_random, checked in handshakes:
+        title = f"TLS {VERSIONS.get(version, version)} with {name}" + (f", suite {suite:#06x}" if suite is not None else "")
+        if isinstance(checked, str):
+            # Browsers open connections they never use, only completed handshakes are required
+            results.append((None, f"{title}: {checked}"))
+        elif checked is None:
+            # Secrets are only looked up when records can not be decrypted here
+            in_log = any(random == client_random for _, random in secrets)
+            reason = "install cryptography to decrypt records" if AESGCM is None else "records of the suite are not decrypted"
+            results.append((None if in_log else False, f"{title}: secrets {'are' if in_log else 'are not'} in the key log, {reason}"))
+        else:
+            verified = list(dict.fromkeys(label for labels, _ in checked for label in labels))
+            problems = [problem for _, found in checked for problem in found]
+            results.append((not problems, f"{title}: {'; '.join(problems) if problems else 'decrypted with ' + ', '.join(verified)}"))
+    if handshakes and all(isinstance(checked, str) for *_, checked in handshakes):
+        results.append((False, f"no completed TLS handshake with {host}"))
+    return results
+
+
+def report(title: str, results: list) -> bool:
+    print(f"{title}")
+    for passed, message in results:
+        mark = "\x1b[1;32mPASS\x1b[0m" if passed else "\x1b[1;33mSKIP\x1b[0m" if passed is None else "\x1b[1;31mFAIL\x1b[0m"
+        print(f"  {mark} {message}")
+    return all(passed is not False for passed, _ in results)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Checks pcapng capture of a site visit: OCSP status given by the responder and TLS secrets of the key log")
+    parser.add_argument("pcapng")
+    parser.add_argument("--keylog", required=True, help="NSS key log written while capturing")
+    parser.add_argument("--host", required=True, help="server name of the site, e.g. ocsp.valid.NAME.ru")
+    parser.add_argument("--status", choices=["good", "revoked", "unknown"], required=True, help="expected OCSP status of the site certificate")
+    parser.add_argument("--ocsp-port", type=int, default=2560)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = check_capture(args.pcapng, args.keylog, args.host, args.status, args.ocsp_port)
+    if args.json:
+        print(dumps({"pcapng": args.pcapng, "passed": all(passed is not False for passed, _ in results),
+                     "checks": [{"passed": passed, "message": message} for passed, message in results]}, indent=4))
+        exit(0 if all(passed is not False for passed, _ in results) else 1)
+    exit(0 if report(args.pcapng, results) else 1)
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+
+from revocation import RevocationDB, TIME_FORMAT
+from tracing import run
+
+from subprocess import DEVNULL
+from datetime import datetime, timedelta, timezone
+from tempfile import TemporaryDirectory
+from shutil import copyfileobj
+from hashlib import sha1
+from base64 import b64decode, b64encode
+from os import replace
+from os.path import dirname, abspath
+from argparse import ArgumentParser
+
+CHUNK = 4096                        # Revoked entries encoded and written at once
+
+REASON_CODES = {"unspecified": 0, "keyCompromise": 1, "CACompromise": 2, "affiliationChanged": 3, "superseded": 4,
+                "cessationOfOperation": 5, "certificateHold": 6, "removeFromCRL": 8, "privilegeWithdrawn": 9, "AACompromise": 10}
+
+# Signature algorithm identifiers by algorithm of issuer key
+SIGNATURES = {"1.2.840.113549.1.1.1": "1.2.840.113549.1.1.11",     # rsaEncryption -> sha256WithRSAEncryption
+              "1.2.840.10045.2.1": "1.2.840.10045.4.3.2",          # id-ecPublicKey -> ecdsa-with-SHA256
+              "1.3.101.112": "1.3.101.112"}                        # Ed25519
+
+
+########## DER encoding ##########
+
+def header(tag: int, length: int) -> bytes:
+    if length < 0x80:
+        return bytes([tag, length])
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big")
+
+
+def tlv(tag: int, content: bytes) -> bytes:
+    return header(tag, len(content)) + content
+
+
+def integer(value: int) -> bytes:
+    return tlv(0x02, value.to_bytes(value.bit_length() // 8 + 1, "big"))
+
+
+def oid(dotted: str) -> bytes:
+    numbers = [int(number) for number in dotted.split(".")]
+    content = bytes([numbers[0] * 40 + numbers[1]])
+    for number in numbers[2:]:
+        encoded = [number & 0x7f]
+        while number > 0x7f:
+            number >>= 7
+            encoded.append(0x80 | (number & 0x7f))
+        content += bytes(reversed(encoded))
+    return tlv(0x06, content)
+
+
+def decode_oid(content: bytes) -> str:
+    numbers, value = [content[0] // 40, content[0] % 40], 0
+    for byte in content[1:]:
+        value = (value << 7) | (byte & 0x7f)
+        if byte & 0x80 == 0:
+            numbers.append(value)
+            value = 0
+    return ".".join(str(number) for number in numbers)
+
+
+def time(moment: datetime) -> bytes:
+    # UTCTime until 2050, GeneralizedTime after
+    if moment.year < 2050:
+        return tlv(0x17, moment.strftime(TIME_FORMAT).encode())
+    return tlv(0x18, moment.strftime("%Y%m%d%H%M%SZ").encode())
+
+
+def extension(name: str, value: bytes, critical: bool = False) -> bytes:
+    return tlv(0x30, oid(name) + (b"\x01\x01\xff" if critical else b"") + tlv(0x04, value))
+
+
+def read(data: bytes, offset: int) -> tuple:
+    # Tag, start and end of content of DER element at offset
+    length = data[offset + 1]
+    if length & 0x80 == 0:
+        return data[offset], offset + 2, offset + 2 + length
+    size = length & 0x7f
+    start = offset + 2 + size
+    return data[offset], start, start + int.from_bytes(data[offset + 2:start], "big")
+
+
+def parse_time(tag: int, value: bytes) -> datetime:
+    # UTCTime or GeneralizedTime
+    return datetime.strptime(value.decode(), "%y%m%d%H%M%SZ" if tag == 0x17 else "%Y%m%d%H%M%SZ").replace(tzinfo=timezone.utc)
+
+
+def crl_header(filename: str, size: int = 64 * 1024) -> bytes:
+    # Beginning of DER encoding of PEM or DER CRL, enough for its header without reading the entries
+    with open(filename, "rb") as file:
+        data = file.read(size)
+    if data.startswith(b"-----BEGIN"):
+        lines = data.split(b"\n")[1:-1]                # last line may be cut
+        data = b64decode(b"".join(line for line in lines if not line.startswith(b"-----")))
+    return data
+
+
+def crl_dates(data: bytes) -> tuple:
+    # thisUpdate and nextUpdate (None when absent) of DER CRL
+    _, tbs, _ = read(data, 0)
+    _, offset, _ = read(data, tbs)
+    if data[offset] == 0x02:                    # version is present in v2 CRLs
+        _, _, offset = read(data, offset)
+    _, _, offset = read(data, offset)           # signature algorithm
+    _, _, offset = read(data, offset)           # issuer
+    tag, start, offset = read(data, offset)
+    this_update = parse_time(tag, data[start:offset])
+    tag, start, end = read(data, offset)
+    return this_update, parse_time(tag, data[start:end]) if tag in (0x17, 0x18) else None
+
+
+def issuer_info(certificate: str) -> tuple:
+    # Encoded subject, key identifier and key algorithm of issuer certificate
+    with open(certificate) as pem:
+        der = b64decode("".join(line for line in pem.read().split("-----END")[0].splitlines() if not line.startswith("-----")))
+    _, tbs, _ = read(der, 0)
+    _, offset, _ = read(der, tbs)
+    fields = []
+    while offset < len(der) and len(fields) < 10:
+        tag, start, end = read(der, offset)
+        fields.append((tag, offset, start, end))
+        offset = end
+    if fields[0][0] == 0xa0:                    # explicit version is present in v3 certificates
+        fields = fields[1:]
+    _, subject_offset, _, subject_end = fields[4]
+    _, _, spki, _ = fields[5]
+
+    _, algorithm, algorithm_end = read(der, spki)
+    _, oid_start, oid_end = read(der, algorithm)
+    _, key_start, key_end = read(der, algorithm_end)
+    key_id = sha1(der[key_start + 1:key_end]).digest()       # first byte of BIT STRING is number of unused bits
+
+    # Key identifier of the certificate itself is preferred, as openssl does
+    for tag, _, start, end in fields[6:]:
+        if tag != 0xa3:
+            continue
+        _, offset, extensions_end = read(der, start)
+        while offset < extensions_end:
+            _, ext_start, ext_end = read(der, offset)
+            _, name_start, name_end = read(der, ext_start)
+            if decode_oid(der[name_start:name_end]) == "2.5.29.14":
+                tag, value_start, value_end = read(der, name_end)
+                if tag == 0x01:                 # critical flag
+                    tag, value_start, value_end = read(der, value_end)
+                _, id_start, id_end = read(der, value_start)
+                key_id = der[id_start:id_end]
+            offset = ext_end
+    return der[subject_offset:subject_end], key_id, decode_oid(der[oid_start:oid_end])
+
+
+# crlEntryExtensions with reason code of every reason, the same for all entries
+REASON_EXTENSIONS = {reason: tlv(0x30, extension("2.5.29.21", tlv(0x0a, bytes([code])))) for reason, code in REASON_CODES.items()}
+
+
+def encode_entries(rows: list, removed_at: bytes) -> bytes:
+    # revokedCertificates entries: serial, revocation date and reason code
+    entries = []
+    for serial, revoked, reason in rows:
+        serial = bytes.fromhex(serial)
+        if serial[0] & 0x80:
+            serial = b"\x00" + serial
+        if revoked is None:                     # revocation was cancelled after the base CRL
+            content = tlv(0x02, serial) + removed_at + REASON_EXTENSIONS["removeFromCRL"]
+        else:
+            content = tlv(0x02, serial) + tlv(0x17, revoked.encode()) + REASON_EXTENSIONS.get(reason, b"")
+        entries.append(tlv(0x30, content))
+    return b"".join(entries)
+
+
+def sign(tbs: str, key: str, password: str, algorithm: str, out: str):
+    passin = ["-passin", f"pass:{password}"] if password is not None else []
+    if algorithm == "1.3.101.112":
+        # Ed25519 signs the message itself, not its digest
+        command = ["openssl", "pkeyutl", "-sign", "-rawin", "-inkey", key, *passin, "-in", tbs, "-out", out]
+    else:
+        command = ["openssl", "dgst", "-sha256", "-sign", key, *passin, "-out", out, tbs]
+    run(command, stdout=DEVNULL, check=True)
+
+
+def build_crl(database: str, certificate: str, key: str, password: str, out: str, days: int,
+              base: int = None, freshest: str = None, der: bool = False) -> int:
+    # Full CRL or delta CRL over base, revoked entries are streamed from the database through temporary files
+    subject, key_id, key_algorithm = issuer_info(certificate)
+    signature_algorithm = tlv(0x30, oid(SIGNATURES[key_algorithm]) + (b"\x05\x00" if key_algorithm == "1.2.840.113549.1.1.1" else b""))
+
+    db = RevocationDB(database)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    number = db.reserve_crl(now.strftime(TIME_FORMAT), base)
+
+    extensions = [extension("2.5.29.35", tlv(0x30, tlv(0x80, key_id))),
+                  extension("2.5.29.20", integer(number))]
+    if base is not None:
+        extensions.append(extension("2.5.29.27", integer(base), critical=True))
+    if freshest is not None:
+        # Clients find delta CRLs by this pointer, syntax is the same as of crlDistributionPoints
+        extensions.append(extension("2.5.29.46", tlv(0x30, tlv(0x30, tlv(0xa0, tlv(0xa0, tlv(0x86, freshest.encode())))))))
+    extensions = tlv(0xa0, tlv(0x30, b"".join(extensions)))
+
+    with TemporaryDirectory(dir=dirname(abspath(out))) as tmp:
+        entries_length = 0
+        with open(f"{tmp}/entries", "wb") as entries:
+            chunk = []
+            for row in db.changes(base):
+                chunk.append(row)
+                if len(chunk) == CHUNK:
+                    entries_length += entries.write(encode_entries(chunk, time(now)))
+                    chunk = []
+            entries_length += entries.write(encode_entries(chunk, time(now)))
+        db.close()
+
+        prefix = (b"\x02\x01\x01" + signature_algorithm + subject + time(now) + time(now + timedelta(days=days))
+                  + (header(0x30, entries_length) if entries_length else b""))
+        tbs_length = len(prefix) + entries_length + len(extensions)
+        with open(f"{tmp}/tbs", "wb") as tbs, open(f"{tmp}/entries", "rb") as entries:
+            tbs.write(header(0x30, tbs_length) + prefix)
+            copyfileobj(entries, tbs, 1024 * 1024)
+            tbs.write(extensions)
+
+        sign(f"{tmp}/tbs", key, password, key_algorithm, f"{tmp}/signature")
+        with open(f"{tmp}/signature", "rb") as signature:
+            signature = tlv(0x03, b"\x00" + signature.read())
+
+        # CertificateList is written under temporary name and atomically replaces the previous one
+        tbs_size = len(header(0x30, tbs_length)) + tbs_length
+        with open(f"{tmp}/crl", "wb") as crl, open(f"{tmp}/tbs", "rb") as tbs:
+            crl.write(header(0x30, tbs_size + len(signature_algorithm) + len(signature)))
+            copyfileobj(tbs, crl, 1024 * 1024)
+            crl.write(signature_algorithm + signature)
+
+        if not der:
+            with open(f"{tmp}/crl", "rb") as crl, open(f"{tmp}/pem", "w") as pem:
+                pem.write("-----BEGIN X509 CRL-----\n")
+                while chunk := crl.read(48 * 1024):
+                    encoded = b64encode(chunk).decode()
+                    pem.write("".join(f"{encoded[i:i + 64]}\n" for i in range(0, len(encoded), 64)))
+                pem.write("-----END X509 CRL-----\n")
+        replace(f"{tmp}/crl" if der else f"{tmp}/pem", out)
+
+    print(f"Generated {'delta ' if base is not None else ''}CRL number {number}: {out}")
+    return number
+
+
+def build_delta(database: str, certificate: str, key: str, password: str, out: str, days: int, der: bool = False) -> int:
+    # Delta CRL over the last full CRL of the database
+    db = RevocationDB(database)
+    base = db.last_crl()
+    db.close()
+    if base is None:
+        raise ValueError("there is no full CRL to issue delta CRL for")
+    return build_crl(database, certificate, key, password, out, days, base, der=der)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Generates full and delta CRLs from the revocation database")
+    parser.add_argument("database", help="revocation database created by revocation.py")
+    parser.add_argument("--cert", required=True, help="issuer certificate")
+    parser.add_argument("--key", required=True, help="issuer key")
+    parser.add_argument("--passin", help="password for issuer key")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--days", type=int, default=30, help="days until the next update")
+    parser.add_argument("--delta", action="store_true", help="list only changes since the last full CRL")
+    parser.add_argument("--freshest", metavar="URI", help="location of delta CRLs, put into full CRLs")
+    parser.add_argument("--der", action="store_true", help="write DER instead of PEM")
+    args = parser.parse_args()
+
+    if not args.delta:
+        build_crl(args.database, args.cert, args.key, args.passin, args.out, args.days, freshest=args.freshest, der=args.der)
+    else:
+        try:
+            build_delta(args.database, args.cert, args.key, args.passin, args.out, args.days, args.der)
+        except ValueError as error:
+            print(f"\x1b[1;31m{error}\x1b[0m")
+            exit(1)
@@ -0,0 +1,252 @@
+#!/usr/bin/python
+
+from crl import crl_header, crl_dates
+
+from asyncio import start_server, run, sleep, get_running_loop, wait_for, IncompleteReadError, TimeoutError as AsyncTimeoutError
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import datetime, timezone
+from hashlib import sha256
+from base64 import b64decode, b64encode
+from tempfile import TemporaryDirectory
+from os import fstat, remove, makedirs
+from os.path import basename, splitext, join, isfile, dirname, abspath
+from signal import SIGINT, SIGTERM
+from argparse import ArgumentParser
+
+SMALL = 64 * 1024           # CRLs up to this size are sent from memory, larger ones from files with sendfile
+BLOCK = 48 * 1024           # DER bytes encoded to PEM at once, multiple of 3 so lines never break inside a block
+TYPES = {"crl": "application/pkix-crl", "pem": "application/x-pem-file"}
+
+
+class Form:
+    # One representation of a CRL: immutable file of the cache directory, its entity tag and, for small ones, its content
+    __slots__ = ["path", "size", "etag", "data"]
+
+    def __init__(self, path: str, size: int, digest: str):
+        self.path, self.size, self.etag = path, size, f'"{digest[:32]}"'
+        self.data = None
+        if size <= SMALL:
+            with open(path, "rb") as file:
+                self.data = file.read()
+
+
+def convert(source, der, pem) -> tuple:
+    # Writes both forms of the source CRL chunk by chunk, so memory does not depend on its size. Returns their digests
+    der_hash, pem_hash = sha256(), sha256()
+
+    def output(file, digest, data: bytes):
+        file.write(data)
+        digest.update(data)
+
+    if source.read(10).startswith(b"-----BEGIN"):
+        # Text around the armour (e.g. output of openssl crl -text) is not published
+        source.seek(0)
+        lines, inside = [], False
+        for line in source:
+            if line.startswith(b"-----BEGIN"):
+                inside = True
+            if inside:
+                output(pem, pem_hash, line)
+                if not line.startswith(b"-----"):
+                    lines.append(line.strip())
+            if line.startswith(b"-----END"):
+                break
+            if len(lines) == 1024:
+                # Only whole groups of four characters are decoded, the rest waits for the next lines
+                encoded = b"".join(lines)
+                cut = len(encoded) - len(encoded) % 4
+                output(der, der_hash, b64decode(encoded[:cut], validate=True))
+                lines = [encoded[cut:]]
+        output(der, der_hash, b64decode(b"".join(lines), validate=True))
+    else:
+        source.seek(0)
+        output(pem, pem_hash, b"-----BEGIN X509 CRL-----\n")
+        while chunk := source.read(BLOCK):
+            output(der, der_hash, chunk)
+            encoded = b64encode(chunk)
+            output(pem, pem_hash, b"".join(encoded[i:i + 64] + b"\n" for i in range(0, len(encoded), 64)))
+        output(pem, pem_hash, b"-----END X509 CRL-----\n")
+    return der_hash.hexdigest(), pem_hash.hexdigest()
+
+
+class Publication:
+    # CRL written by the generator (PEM or DER), published as DER at the advertised .crl path and as PEM at .pem
+    def __init__(self, source: str, cache: str):
+        self.source = source
+        self.stem = splitext(basename(source))[0]
+        self.cache = cache
+        self.version = None         # (inode, mtime, size) of the published source
+        self.rejected = None        # and of the last invalid one, reported once
+        self.generation = 0
+        self.forms = {}
+        self.this_update, self.next_update = None, None
+
+    def changed(self) -> bool:
+        with open(self.source, "rb") as source:
+            status = fstat(source.fileno())
+        return (status.st_ino, status.st_mtime_ns, status.st_size) not in (self.version, self.rejected)
+
+    def load(self) -> tuple:
+        # Every version is converted into new files of the cache, requests being sent keep reading the previous ones
+        generation = self.generation + 1
+        paths = {kind: join(self.cache, f"{self.stem}-{generation}.{kind}") for kind in TYPES}
+        status = None
+        try:
+            with open(self.source, "rb") as source:
+                status = fstat(source.fileno())
+                with open(paths["crl"], "wb") as der, open(paths["pem"], "wb") as pem:
+                    digests = convert(source, der, pem)
+                    sizes = {"crl": der.tell(), "pem": pem.tell()}
+            dates = crl_dates(crl_header(paths["crl"]))
+        except (OSError, ValueError, IndexError):
+            # Invalid or half written CRL is not published, the previous version stays
+            if status is not None:
+                self.rejected = (status.st_ino, status.st_mtime_ns, status.st_size)
+            for path in paths.values():
+                if isfile(path):
+                    remove(path)
+            raise
+        forms = {kind: Form(paths[kind], sizes[kind], digest) for kind, digest in zip(["crl", "pem"], digests)}
+        return (status.st_ino, status.st_mtime_ns, status.st_size), generation, forms, dates
+
+    def swap(self, loaded: tuple):
+        # New version is published by replacing references in the event loop, so every request sees one complete version
+        old = self.forms
+        self.version, self.generation, self.forms, (self.this_update, self.next_update) = loaded
+        for form in old.values():
+            remove(form.path)
+        print(f"Published {self.source}: {self.forms['crl'].size} bytes, next update {self.next_update}")
+
+    def headers(self, form: Form) -> str:
+        # Responses may be cached until the next update of the CRL, not longer
+        now = datetime.now(timezone.utc)
+        lines = f"ETag: {form.etag}\r\nLast-Modified: {format_datetime(self.this_update, usegmt=True)}\r\n"
+        if self.next_update is None:
+            return lines + "Cache-Control: no-cache\r\n"
+        max_age = max(0, int((self.next_update - now).total_seconds()))
+        return lines + f"Cache-Control: public, max-age={max_age}\r\nExpires: {format_datetime(self.next_update, usegmt=True)}\r\n"
+
+    def not_modified(self, form: Form, headers: dict) -> bool:
+        # If-None-Match takes precedence, weak comparison as RFC 9110 requires for it
+        if "if-none-match" in headers:
+            tags = [tag.strip().removeprefix("W/") for tag in headers["if-none-match"].split(",")]
+            return "*" in tags or form.etag in tags
+        if "if-modified-since" in headers:
+            try:
+                return self.this_update <= parsedate_to_datetime(headers["if-modified-since"])
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class Server:
+    def __init__(self, publications: list):
+        self.paths = {}
+        for publication in publications:
+            for kind in TYPES:
+                self.paths[f"/{publication.stem}.{kind}"] = (publication, kind)
+        self.requests, self.not_modified, self.sent = 0, 0, 0
+
+    async def watch(self, interval: float):
+        # Generators replace CRLs atomically, a changed file is converted in a thread and published when complete
+        loop = get_running_loop()
+        while True:
+            await sleep(interval)
+            for publication, _ in set(self.paths.values()):
+                try:
+                    if publication.changed():
+                        publication.swap(await loop.run_in_executor(None, publication.load))
+                except (OSError, ValueError, IndexError) as error:
+                    print(f"\x1b[1;31mFailed to publish {publication.source}: {error}\x1b[0m")
+
+    async def handle(self, reader, writer):
+        loop = get_running_loop()
+        try:
+            while True:
+                line = await wait_for(reader.readline(), 30)
+                if not line:
+                    break
+                method, path, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                connection = f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+
+                publication, kind = self.paths.get(path.split("?")[0], (None, None))
+                if method not in ("GET", "HEAD"):
+                    writer.write(f"HTTP/1.1 405 Method Not Allowed\r\nAllow: GET, HEAD\r\nContent-Length: 0\r\n{connection}\r\n".encode())
+                elif publication is None or not publication.forms:
+                    writer.write(f"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n{connection}\r\n".encode())
+                else:
+                    # Form is taken once, a swap while the body is being sent does not change what this response contains
+                    form = publication.forms[kind]
+                    if publication.not_modified(form, headers):
+                        self.not_modified += 1
+                        writer.write(f"HTTP/1.1 304 Not Modified\r\n{publication.headers(form)}{connection}\r\n".encode())
+                    else:
+                        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {TYPES[kind]}\r\nContent-Length: {form.size}\r\n"
+                                     f"{publication.headers(form)}{connection}\r\n".encode())
+                        if method == "GET" and form.data is not None:
+                            writer.write(form.data)
+                        elif method == "GET":
+                            # File of the form is opened before the next await, so it can not be removed by a swap first
+                            with open(form.path, "rb") as file:
+                                await writer.drain()
+                                await loop.sendfile(writer.transport, file, 0, form.size)
+                        if method == "GET":
+                            self.sent += form.size
+                await writer.drain()
+                self.requests += 1
+                if not keep_alive:
+                    break
+        except (ConnectionError, IncompleteReadError, AsyncTimeoutError, ValueError, OSError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(server: Server, host: str, port: int, interval: float):
+    listener = await start_server(server.handle, host, port)
+    loop = get_running_loop()
+    for signal in [SIGINT, SIGTERM]:
+        loop.add_signal_handler(signal, listener.close)
+    watcher = loop.create_task(server.watch(interval))
+    try:
+        await listener.serve_forever()
+    except BaseException:
+        pass
+    watcher.cancel()
+    print(f"Served {server.requests} requests, {server.not_modified} not modified, {server.sent / 1024 / 1024:.1f} MB")
+
+
+def command(crls: list, port: int = 8080) -> list:
+    return ["python3", join(dirname(abspath(__file__)), "crl_server.py"), *crls, "--port", f"{port}"]
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Publishes CRLs over HTTP in DER (.crl) and PEM (.pem) with caching headers")
+    parser.add_argument("crls", nargs="+", help="CRL files (PEM or DER), NAME.crl is served at /NAME.crl and /NAME.pem")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache", help="directory for published forms of CRLs, temporary one by default")
+    parser.add_argument("--interval", type=float, default=1, help="seconds between checks of CRL files for changes")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        cache = args.cache or tmp
+        makedirs(cache, exist_ok=True)
+        publications = [Publication(crl, cache) for crl in args.crls]
+        for publication in publications:
+            try:
+                publication.swap(publication.load())
+            except (OSError, ValueError, IndexError) as error:
+                print(f"\x1b[1;31mFailed to publish {publication.source}: {error}\x1b[0m")
+                exit(1)
+        print(f"Serving {len(publications)} CRLs on {args.host}:{args.port}")
+        run(serve(Server(publications), args.host, args.port, args.interval))
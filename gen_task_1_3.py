@@ -1,340 +1,250 @@
 #!/usr/bin/python
 
-from base import Config
-
-from subprocess import run, Popen, DEVNULL, check_call
-from os import mkdir, walk, geteuid, remove, listdir, environ, system as simple_run
+from base import Config, arguments
+from planner import Task, generate, make_archive
+from ocsp_responder import command as responder_command
+from stapling import Stapler, stapling_config
+from nginx_config import PROFILES, render, check, rotate_ticket_keys, rotation_command
+from resolver import command as resolver_command, wait_until_ready, nginx_directive, ocsp_client, firefox_profile
+from capture import visit, free_port, wait_for_port, split_url
+from capture_check import check_capture, report
+from tracing import run, tracer
+
+from subprocess import Popen, DEVNULL
+from os import makedirs, geteuid, remove, listdir, system as simple_run
 from os.path import isdir, isfile, abspath
 from shutil import rmtree, which, copy, move
-from zipfile import ZipFile
 
-def reboot_ifaces():
-    for iface in listdir('/sys/class/net'):
-        run(['ifconfig', iface, 'down'])
-        run(['ifconfig', iface, 'up'])
-        print(f'{iface} rebooted')
+def desktop_user():
+    path_list = __file__.split('/')
+    return path_list[path_list.index('home') + 1]
 
 def run_without_sudo(prompt):
-    path_list = __file__.split('/')
-    username = path_list[path_list.index('home') + 1]
-    simple_run(f"sudo -u {username} {prompt}")
+    simple_run(f"sudo -u {desktop_user()} {prompt}")
+
+def write_sites(root, file_prefix, email):
+    valid_site_path, revoked_site_path = f"{root}/{file_prefix}-valid", f"{root}/{file_prefix}-revoked"
+    makedirs(valid_site_path, exist_ok=True)
+    with open(f"{valid_site_path}/index.html", "w") as index:
+        index.write(f'<Html><Head><title>Вопрос интимного характера</title></Head><Body><center><h1> Пить пиво </h1><h2> В среду </h2><h3> В 3 часа дня </h3></center>Это лучший способ показать миру свою независимость от предубеждений. <a href="mailto:{email}">Присоединяйтесь</a>! <br></Body></Html>')
+    makedirs(revoked_site_path, exist_ok=True)
+    with open(f"{revoked_site_path}/index.html", "w") as index:
+        index.write(f'<Html><Head><title>АНТИВОДКА</title></Head><Body><center><h1> Запретим пить водку! </h1></center>Проголосуйте за запрет водки на физтехе по <a href="https://natribu.org/">ссылке</a>! <br></Body></Html>')
+    return valid_site_path, revoked_site_path
+
+def make_sites(task, user, valid_site_path, revoked_site_path, staple):
+    workdir, file_prefix = task.workdir, task.prefix
+    chain_path = abspath(f"{workdir}/{file_prefix}-chain.crt")
+
+    valid_key_path = abspath(f"{workdir}/{file_prefix}-ocsp-valid.key")
+    valid_cert_path = abspath(f"{workdir}/{file_prefix}-ocsp-valid-chain.crt")
+
+    revoked_key_path = abspath(f"{workdir}/{file_prefix}-ocsp-revoked.key")
+    revoked_cert_path = abspath(f"{workdir}/{file_prefix}-ocsp-revoked-chain.crt")
+
+    # Stapled responses are signed in advance, so handshakes do not wait for the responder
+    valid_stapling = f"# ssl_stapling on;\n        # ssl_stapling_verify on;\n        # ssl_trusted_certificate {chain_path};"
+    revoked_stapling = valid_stapling
+    stapler = None
+    if staple:
+        stapler = Stapler(abspath(f"{workdir}/index.txt"), chain_path, abspath(f"{workdir}/{file_prefix}-intr.crt"),
+                          abspath(f"{workdir}/{file_prefix}-ocsp-resp.crt"), abspath(f"{workdir}/{file_prefix}-ocsp-resp.key"), user.name)
+        stapler.add(abspath(f"{workdir}/{file_prefix}-ocsp-valid.crt"), abspath(f"{workdir}/{file_prefix}-ocsp-valid.staple"))
+        stapler.add(abspath(f"{workdir}/{file_prefix}-ocsp-revoked.crt"), abspath(f"{workdir}/{file_prefix}-ocsp-revoked.staple"))
+        stapler.refresh(force=True)
+        valid_stapling = stapling_config(abspath(f"{workdir}/{file_prefix}-ocsp-valid.staple"), chain_path)
+        revoked_stapling = stapling_config(abspath(f"{workdir}/{file_prefix}-ocsp-revoked.staple"), chain_path)
+
+    sites = [{"name": f"ocsp.valid.{user.name}.ru", "cert": valid_cert_path, "key": valid_key_path,
+              "root": valid_site_path, "stapling": valid_stapling},
+             {"name": f"ocsp.revoked.{user.name}.ru", "cert": revoked_cert_path, "key": revoked_key_path,
+              "root": revoked_site_path, "stapling": revoked_stapling}]
+    return sites, stapler
+
+def capture_headless(task, user, args):
+    # Private nginx and responder listen on free ports, clients are routed to them while traces show the task addresses.
+    # Nothing of the system is changed, so it runs without root and several users can be captured in parallel
+    workdir, file_prefix = task.workdir, task.prefix
+    runtime = abspath(task.file("nginx"))
+    makedirs(runtime, exist_ok=True)
+    valid_site_path, revoked_site_path = write_sites(runtime, file_prefix, user.email)
+    sites, _ = make_sites(task, user, valid_site_path, revoked_site_path, args.staple)
+    site_port, responder_port = free_port(), free_port()
+
+    tickets = rotate_ticket_keys(f"{runtime}/tickets") if PROFILES[args.nginx_profile]["tickets"] else []
+    nginx_config = render(args.nginx_profile, sites, port=site_port, tickets=tickets, runtime=runtime)
+    accepted, output = check(nginx_config, f"{runtime}/nginx.conf")
+    if not accepted and args.nginx_profile != "minimal":
+        print(f"\x1b[1;31mNGINX rejected {args.nginx_profile} profile, minimal one is used instead:\n{output}\x1b[0m")
+        nginx_config = render("minimal", sites, port=site_port, runtime=runtime)
+    with open(f"{runtime}/nginx.conf", "w") as nginx_conf:
+        nginx_conf.write(nginx_config)
+
+    records = {name: task.config.local_adress for name in [f"ocsp.{user.name}.ru", f"ocsp.valid.{user.name}.ru", f"ocsp.revoked.{user.name}.ru"]}
+    routes = {(f"ocsp.valid.{user.name}.ru", 443): ("127.0.0.1", site_port), (f"ocsp.revoked.{user.name}.ru", 443): ("127.0.0.1", site_port),
+              (f"ocsp.{user.name}.ru", 2560): ("127.0.0.1", responder_port)}
+    nginx = Popen(["nginx", "-p", runtime, "-c", f"{runtime}/nginx.conf", "-g", "daemon off;"], stdout=DEVNULL, stderr=DEVNULL)
+    responder = Popen(responder_command(responder_port, f"{workdir}/index.txt", f"{workdir}/{file_prefix}-chain.crt",
+                                        f"{workdir}/{file_prefix}-ocsp-resp.key", f"{workdir}/{file_prefix}-ocsp-resp.crt", user.name,
+                                        f"{workdir}/revocation.db"),
+                      stdout=DEVNULL, stderr=DEVNULL)
+    try:
+        with tracer.span(f"[{task.no}] Starting NGINX and OCSP responder"):
+            started = wait_for_port(site_port, nginx) and wait_for_port(responder_port, responder)
+        if not started:
+            print(f"\x1b[1;31mNGINX or OCSP responder did not start, see {runtime}/error.log\x1b[0m")
+            return
+        for kind, expected in [("valid", "good"), ("revoked", "revoked")]:
+            print(f"\n------- Capturing connection with {kind.upper()} site -------")
+            with tracer.span(f"[{task.no}] Capturing {kind} site"):
+                status = visit(f"https://ocsp.{kind}.{user.name}.ru/", f"{workdir}/{file_prefix}-chain.crt", f"{workdir}/{file_prefix}-intr.crt",
+                               task.file(f"{file_prefix}-ocsp-{kind}.pcapng"), task.file(f"{file_prefix}-ocsp-{kind}.log"), records, routes)
+            print(f"OCSP status: {status}" if status == expected else f"\x1b[1;31mOCSP status: {status}, expected {expected}\x1b[0m")
+    finally:
+        # Responder shuts its signing workers down on SIGTERM, SIGKILL would leave them running
+        nginx.terminate()
+        responder.terminate()
+        nginx.wait()
+        responder.wait()
+        rmtree(runtime, ignore_errors=True)
+
+def check_captures(task, user):
+    # Captures are validated before they are archived, broken ones would otherwise be found only at grading
+    print(f"\n------- Checking captures -------")
+    port = split_url(task.format(task.config.ocsp["url"]))[1]
+    passed = True
+    with tracer.span(f"[{task.no}] Checking captures"):
+        for kind, expected in [("valid", "good"), ("revoked", "revoked")]:
+            pcapng = task.file(f"{task.prefix}-ocsp-{kind}.pcapng")
+            if isfile(pcapng):
+                results = check_capture(pcapng, task.file(f"{task.prefix}-ocsp-{kind}.log"), f"ocsp.{kind}.{user.name}.ru", expected, port)
+                passed = report(pcapng, results) and passed
+    return passed
+
+def export(task, user, args):
+    if not args.skip_capture_check and not check_captures(task, user):
+        print(f"\x1b[1;31mCaptures are not accepted, capture them again or run with --skip-capture-check to archive them anyway\x1b[0m")
+        exit(1)
+
+    # Generating archive with solution
+    print("\n\n------- Exporting results -------")
+    try:
+        with tracer.span(f"[{task.no}] Generating archive"):
+            make_archive(task)
+    except FileNotFoundError as error:
+        print(f"\x1b[1;31mArchive is not generated: {error}\x1b[0m")
+        print(f"Maybe you forgot to save trace from wireshark?")
+        exit(1)
+    print(f"Results saved in \x1b[1;4m{task.archive_name}\x1b[0m. To pass HW, send this archive to \x1b[1;4minsecon@ispras.ru\x1b[0m with topic \x1b[1;4m{task.email_topic}\x1b[0m.")
 
 if __name__ == "__main__":
 
+    parser = arguments("Generates solution for task p1_3")
+    parser.add_argument("--staple", action="store_true", help="staple prepared OCSP responses in nginx instead of letting clients ask the responder")
+    parser.add_argument("--nginx-profile", choices=PROFILES, default="minimal",
+                        help="nginx tuning of the test sites, throughput one adds bigger session caches, rotated session tickets and HTTP/2")
+    parser.add_argument("--headless", action="store_true",
+                        help="capture both sites with built-in client on private nginx instead of Firefox and Wireshark, root is not needed")
+    parser.add_argument("--skip-capture-check", action="store_true", help="archive captures without checking their OCSP exchanges and TLS secrets")
+    parser.add_argument("--reuse", action="store_true",
+                        help="capture with certificates already in the workdir (e.g. renewed by renew.py) instead of generating them")
+    args = parser.parse_args()
+
     if which("nginx") == None:
         print(f"NGINX is needed for this task, install it with your packet manager")
         print(f"e.g. \x1b[1mpacman -S nginx\x1b[0m for Arch")
         print(f"e.g. \x1b[1mapt-get install nginx\x1b[0m for Debian")
         exit(1)
 
-    if geteuid() != 0:
+    if geteuid() != 0 and not args.headless:
         print("You must run this script as sudoer, exiting...")
         exit(1)
     
     user = Config("user.json")
-    task = Config("tasks/p1_3.json")
+    if args.reuse:
+        # Certificates renewed in place are not in the build cache, generating would bring back the old ones
+        task = Task(user, "p1_3", args.keys)
+        if not isdir(task.workdir):
+            print(f"\x1b[1;31m{task.workdir} does not exist, run the generator without --reuse first\x1b[0m")
+            exit(1)
+    else:
+        # Certificates of the task are described in tasks/p1_3.json
+        print(f"\n------- Generating certificates -------")
+        [task], succeeded = generate(user, ["p1_3"], args)
+        if not succeeded:
+            print("\x1b[1;31mSomething gone wrong!\x1b[0m")
+            exit(1)
+
+    workdir = task.workdir
+    file_prefix = task.prefix
+
+    if args.headless:
+        capture_headless(task, user, args)
+        export(task, user, args)
+        exit(0)
+
+    ################## Resolving task names #######################
+    print(f"\n------- Starting name resolver -------")
+    # Task names are answered by a DNS stub on loopback and by per-process overrides, /etc/hosts is never touched
+    records = {name: task.config.local_adress for name in [f"ocsp.{user.name}.ru", f"ocsp.valid.{user.name}.ru", f"ocsp.revoked.{user.name}.ru"]}
+    resolver = Popen(resolver_command(records), stdout=DEVNULL, stderr=DEVNULL)
+    if wait_until_ready(f"ocsp.{user.name}.ru") is None:
+        print("\x1b[1;31mName resolver is not answering, OCSP responder of stapled certificates will not be found by NGINX\x1b[0m")
+    profile = firefox_profile(task.config.local_adress, desktop_user())
+    firefox = f"SSLKEYLOGFILE=temp.log firefox -no-remote -profile {profile}"
     
-    workdir = f"{user.name}-{user.group}-{task.no}"
-    file_prefix = f"{user.name}-{user.group}"
-    archive_name = f"{workdir}/{file_prefix}-{task.no}.zip"
-    email_topic = f"{user.university}-{user.group}-{task.no}"
-
-    keeplist = [f"{file_prefix}-ocsp-valid.key", f"{file_prefix}-ocsp-valid.crt",
-                f"{file_prefix}-ocsp-revoked.key", f"{file_prefix}-ocsp-revoked.crt",
-                f"{file_prefix}-ocsp-resp.key", f"{file_prefix}-ocsp-resp.crt", 
-                f"{file_prefix}-chain.crt",
-                f"{file_prefix}-ocsp-valid.pcapng", f"{file_prefix}-ocsp-valid.log",
-                f"{file_prefix}-ocsp-revoked.pcapng", f"{file_prefix}-ocsp-revoked.log"]
-
-    if isdir(workdir): rmtree(workdir)
-    mkdir(workdir)
-
-    ################## Configuration for Certificate revoking ################
-    with open(f"{workdir}/ocsp.conf", "w") as conf:
-        conf.write(f"[ basic_cert ]\n")
-        conf.write(f"authorityInfoAccess = OCSP;URI:http://ocsp.{user.name}.ru:2560\n")
-        conf.write(f"[ req ]\n")
-        conf.write(f"database = {workdir}/index.txt\n")
-        conf.write(f"[ ca ]\n")
-        conf.write(f"default_ca=CA_default\n")
-        conf.write(f"[ CA_default ]\n")
-        conf.write(f"database = {workdir}/index.txt\n")
-        conf.write(f"default_md = sha256\n")
-        conf.write(f"default_crl_days = 30\n")
-        conf.write(f"crl_extensions = crl_ext\n")
-        conf.write(f"[ crl_ext ]\n")
-        conf.write(f"authorityKeyIdentifier=keyid:always\n")
-
-    with open(f"{workdir}/index.txt", "w"): pass
-
-    #################### CA Certificate ##########################
-    print(f"\n------- Generating CA Certificate -------")
-    # Generating RSA-key with aes256 encryption and specified length
-    run(["openssl", "genrsa", "-aes256", "-passout", f"pass:{user.name}", "-out", f"{workdir}/{file_prefix}-ca.key", f"{task.ca_keylen}"])
-    # Generating self-signed certificate with specified RSA key
-    run(["openssl", "req", "-x509", "-new", 
-         "-key", f"{workdir}/{file_prefix}-ca.key", "-passin", f"pass:{user.name}",                                          # Passing encrypted RSA key and password
-         "-days", f"{task.ca_time}",                                                                                         # Setting time limit for certificate
-         "-subj", f"/C=RU/ST=Moscow/L=Moscow/O={user.name}/OU={user.name} P1_3/CN={user.name} CA/emailAddress={user.email}", # Setting certificate parameters in format /param1=value1/param2=value2/...
-         "-addext", "basicConstraints=critical,CA:TRUE",                                                                     # Adding x509v3 extensions
-         "-addext", "keyUsage=critical,digitalSignature,keyCertSign,cRLSign",                                                # Adding x509v3 extensions
-         "-out", f"{workdir}/{file_prefix}-ca.crt"])                                                                         # Setting up output file
-
-    #################### Intermediate CA Certificate #################
-    print(f"\n------- Generating Intermediate Certificate -------")
-    # Generating RSA-key with aes256 encryption and specified length
-    run(["openssl", "genrsa", "-aes256", "-passout", f"pass:{user.name}", "-out", f"{workdir}/{file_prefix}-intr.key", f"{task.intr_keylen}"])
-    # Generating certificate signing request
-    run(["openssl", "req", "-new", 
-         "-key", f"{workdir}/{file_prefix}-intr.key", "-passin", f"pass:{user.name}",                                                      # Passing encrypted RSA key and password
-         "-subj", f"/C=RU/ST=Moscow/L=Moscow/O={user.name}/OU={user.name} P1_3/CN={user.name} Intermediate CA/emailAddress={user.email}",  # Setting certificate parameters in format /param1=value1/param2=value2/...
-         "-addext", "basicConstraints=critical,pathlen:0,CA:TRUE",                                                                         # Adding x509v3 extensions
-         "-addext", "keyUsage=critical,digitalSignature,keyCertSign,cRLSign",                                                              # Adding x509v3 extensions 
-         "-out", f"{workdir}/{file_prefix}-intr.csr"])                                                                                     # Setting up output file
-    # Generating certificate from request
-    run(["openssl", "x509", "-req", "-days", f"{task.intr_time}",
-         "-CA", f"{workdir}/{file_prefix}-ca.crt", "-CAkey", f"{workdir}/{file_prefix}-ca.key", "-passin", f"pass:{user.name}", # Passing ca cerificate with key and password
-         #"-CAcreateserial", "-CAserial", f"{workdir}/serial",
-         "-copy_extensions", "copy",                                                                                            # Copying x509v3 extensions from request to certificate
-         "-in", f"{workdir}/{file_prefix}-intr.csr",                                                                            # Passing request
-         "-out", f"{workdir}/{file_prefix}-intr.crt"])                                                                          # Specifying output path
-
     ################### Installing certificate #####################
     if isdir("/etc/ca-certificates/trust-source/anchors"):
         copy(f"{workdir}/{file_prefix}-intr.crt", f"/etc/ca-certificates/trust-source/anchors/{file_prefix}-intr.crt")
         run(["trust", "extract-compat"])
     else:
-        _ = input(f"\x1b[1;31mSounds like your OS has no centralized certificate db. Open Firefox, import \x1b[4;31m{file_prefix}-ca.crt\x1b[0m\x1b[1;31m and press Enter to continue...\x1b[0m")
-
-    ################### Generating CA Chain #########################
-    print(f"\n------- Generating certificate chain -------")
-    with open(f"{workdir}/{file_prefix}-chain.crt", "w") as chain:
-        with open(f"{workdir}/{file_prefix}-ca.crt", "r") as ca:
-            chain.write(ca.read())
-        with open(f"{workdir}/{file_prefix}-intr.crt", "r") as intr:
-            chain.write(intr.read())
-    if isfile(f"{workdir}/{file_prefix}-chain.crt"):
-        print(f"Generated certificate chain: {workdir}/{file_prefix}-chain.crt")
-
-    ################ OCSP Responder Certificate #####################
-    print(f"\n------- Generating OCSP Responder Certificate -------")
-    # Generating RSA-key without encryption and with specified length
-    run(["openssl", "genrsa", "-aes256", "-passout", f"pass:{user.name}", "-out", f"{workdir}/{file_prefix}-ocsp-resp.key", f"{task.intr_keylen}"])
-    # Generating certificate signing request
-    run(["openssl", "req", "-new",
-         "-key", f"{workdir}/{file_prefix}-ocsp-resp.key", "-passin", f"pass:{user.name}",                                          # Passing RSA key
-         "-subj", f"/C=RU/ST=Moscow/L=Moscow/O={user.name}/OU={user.name} P1_3/CN={user.name} OCSP Responder/emailAddress={user.email}", # Setting certificate parameters in format /param1=value1/param2=value2/...
-         "-addext", "basicConstraints=CA:FALSE",                                                                                # Adding x509v3 extensions
-         "-addext", "keyUsage=critical,digitalSignature",                                                                       # Adding x509v3 extensions
-         "-addext", "extendedKeyUsage=OCSPSigning",                                                                             # Adding x509v3 extensions
-         "-out", f"{workdir}/{file_prefix}-ocsp-resp.csr"])                                                                         # Setting up output file
-    # Generating certificate from request
-    run(["openssl", "x509", "-req", "-days", f"{task.intr_time}",
-         "-CA", f"{workdir}/{file_prefix}-intr.crt", "-CAkey", f"{workdir}/{file_prefix}-intr.key", "-passin", f"pass:{user.name}", # Passing intr cerificate with key and password
-         #"-CAcreateserial", "-CAserial", f"{workdir}/serial",
-         "-copy_extensions", "copy",                                                                                                # Copying x509v3 extensions from request to certificate
-         "-in", f"{workdir}/{file_prefix}-ocsp-resp.csr",                                                                               # Passing request
-         "-out", f"{workdir}/{file_prefix}-ocsp-resp.crt"])                                                                             # Specifying output path
-    
-    #################### Revoked Certificate ##########################
-    print(f"\n------- Generating Revoked Certificate -------")
-    # Generating RSA-key without encryption and with specified length
-    run(["openssl", "genrsa", "-out", f"{workdir}/{file_prefix}-ocsp-revoked.key", f"{task.basic_keylen}"])
-    # Generating certificate signing request
-    run(["openssl", "req", "-new",
-         "-key", f"{workdir}/{file_prefix}-ocsp-revoked.key",                                                                          # Passing RSA key
-         "-subj", f"/C=RU/ST=Moscow/L=Moscow/O={user.name}/OU={user.name} P1_3/CN={user.name} OCSP Revoked/emailAddress={user.email}", # Setting certificate parameters in format /param1=value1/param2=value2/...
-         "-addext", "basicConstraints=CA:FALSE",                                                                                      # Adding x509v3 extensions
-         "-addext", "keyUsage=critical,digitalSignature",                                                                             # Adding x509v3 extensions
-         "-addext", "extendedKeyUsage=critical,serverAuth,clientAuth",                                                                # Adding x509v3 extensions
-         "-addext", f"subjectAltName=DNS:ocsp.revoked.{user.name}.ru",                                                                 # Adding Alternative Name
-         "-addext", f"authorityInfoAccess=OCSP;URI:http://ocsp.{user.name}.ru:2560/",
-         "-out", f"{workdir}/{file_prefix}-ocsp-revoked.csr"])                                                                         # Setting up output file
-    # Generating certificate from request
-    run(["openssl", "x509", "-req", "-days", f"{task.basic_time}",
-         "-CA", f"{workdir}/{file_prefix}-intr.crt", "-CAkey", f"{workdir}/{file_prefix}-intr.key", "-passin", f"pass:{user.name}", # Passing intr cerificate with key and password
-         #"-CAcreateserial", "-CAserial", f"{workdir}/serial",
-         "-copy_extensions", "copy",                                                                                                # Copying x509v3 extensions from request to certificate
-         "-in", f"{workdir}/{file_prefix}-ocsp-revoked.csr",                                                                           # Passing request
-         "-out", f"{workdir}/{file_prefix}-ocsp-revoked.crt"])                                                                         # Specifying output path
-
-    ##################### Revoking Certificate ######################
-    print(f"\n------- Revoking one of certificates -------")
-    run(["openssl", "ca", 
-         "-config", f"{workdir}/ocsp.conf", 
-         "-cert", f"{workdir}/{file_prefix}-intr.crt", "-keyfile", f"{workdir}/{file_prefix}-intr.key", "-passin", f"pass:{user.name}",
-         "-revoke", f"{workdir}/{file_prefix}-ocsp-revoked.crt"])
-    
-    ######################## Valid Certificate #####################
-    print(f"\n------- Generating Valid Certificate -------")
-    # Generating RSA-key without encryption and with specified length
-    run(["openssl", "genrsa", "-out", f"{workdir}/{file_prefix}-ocsp-valid.key", f"{task.basic_keylen}"])
-    # Generating certificate signing request
-    run(["openssl", "req", "-new",
-         "-key", f"{workdir}/{file_prefix}-ocsp-valid.key",                                                                          # Passing RSA key
-         "-subj", f"/C=RU/ST=Moscow/L=Moscow/O={user.name}/OU={user.name} P1_3/CN={user.name} OCSP Valid/emailAddress={user.email}", # Setting certificate parameters in format /param1=value1/param2=value2/...
-         "-addext", "basicConstraints=CA:FALSE",                                                                                    # Adding x509v3 extensions
-         "-addext", "keyUsage=critical,digitalSignature",                                                                           # Adding x509v3 extensions
-         "-addext", "extendedKeyUsage=critical,serverAuth,clientAuth",                                                              # Adding x509v3 extensions
-         "-addext", f"subjectAltName=DNS:ocsp.valid.{user.name}.ru",                                                                 # Adding Alternative Name
-         "-addext", f"authorityInfoAccess=OCSP;URI:http://ocsp.{user.name}.ru:2560/",
-         "-out", f"{workdir}/{file_prefix}-ocsp-valid.csr"])                                                                         # Setting up output file
-    # Generating certificate from request
-    run(["openssl", "x509", "-req", "-days", f"{task.basic_time}",
-         "-CA", f"{workdir}/{file_prefix}-intr.crt", "-CAkey", f"{workdir}/{file_prefix}-intr.key", "-passin", f"pass:{user.name}", # Passing intr cerificate with key and password
-         #"-CAcreateserial", "-CAserial", f"{workdir}/serial",
-         "-copy_extensions", "copy",                                                                                                # Copying x509v3 extensions from request to certificate
-         "-in", f"{workdir}/{file_prefix}-ocsp-valid.csr",                                                                           # Passing request
-         "-out", f"{workdir}/{file_prefix}-ocsp-valid.crt"])                                                                         # Specifying output path
-
-    ##################### Validing Certificate ######################
-    print(f"\n------- Validing one of certificates -------")
-    run(["openssl", "ca", 
-         "-config", f"{workdir}/ocsp.conf", 
-         "-cert", f"{workdir}/{file_prefix}-intr.crt", "-keyfile", f"{workdir}/{file_prefix}-intr.key", "-passin", f"pass:{user.name}",
-         "-valid", f"{workdir}/{file_prefix}-ocsp-valid.crt"])
-    
-    ################### Generating Valid Chain #########################
-    print(f"\n------- Generating Valid chain -------")
-    with open(f"{workdir}/{file_prefix}-ocsp-valid-chain.crt", "w") as valid_chain:
-        with open(f"{workdir}/{file_prefix}-ocsp-valid.crt", "r") as ocsp_valid:
-            valid_chain.write(ocsp_valid.read())
-        with open(f"{workdir}/{file_prefix}-chain.crt", "r") as chain:
-            valid_chain.write(chain.read())
-    if isfile(f"{workdir}/{file_prefix}-ocsp-valid-chain.crt"):
-        print(f"Generated certificate chain: {workdir}/{file_prefix}-ocsp-valid-chain.crt")
-
-    ################### Generating Revoked Chain #########################
-    print(f"\n------- Generating Revoked chain -------")
-    with open(f"{workdir}/{file_prefix}-ocsp-revoked-chain.crt", "w") as revoked_chain:
-        with open(f"{workdir}/{file_prefix}-ocsp-revoked.crt", "r") as ocsp_revoked:
-            revoked_chain.write(ocsp_revoked.read())
-        with open(f"{workdir}/{file_prefix}-chain.crt", "r") as chain:
-            revoked_chain.write(chain.read())
-    if isfile(f"{workdir}/{file_prefix}-ocsp-revoked-chain.crt"):
-        print(f"Generated certificate chain: {workdir}/{file_prefix}-ocsp-revoked-chain.crt")
+        # Firefox of the task runs with its own profile, so the certificate is imported there
+        _ = input(f"\x1b[1;31mSounds like your OS has no centralized certificate db. Press Enter to open Firefox, import \x1b[4;31m{file_prefix}-ca.crt\x1b[0m\x1b[1;31m and close it to continue...\x1b[0m")
+        run_without_sudo(f"firefox -no-remote -profile {profile} about:preferences#privacy")
 
     ################# Creating test sites for valid and revoked certs ################
-    try: mkdir("/var/www")
-    except: pass
-    
-    try: mkdir(f"/var/www/{file_prefix}-valid")
-    except: pass
-    with open(f"/var/www/{file_prefix}-valid/index.html", "w") as index:
-        index.write(f'<Html><Head><title>Вопрос интимного характера</title></Head><Body><center><h1> Пить пиво </h1><h2> В среду </h2><h3> В 3 часа дня </h3></center>Это лучший способ показать миру свою независимость от предубеждений. <a href="mailto:{user.email}">Присоединяйтесь</a>! <br></Body></Html>')
-    
-    try: mkdir(f"/var/www/{file_prefix}-revoked")
-    except: pass
-    with open(f"/var/www/{file_prefix}-revoked/index.html", "w") as index:
-        index.write(f'<Html><Head><title>АНТИВОДКА</title></Head><Body><center><h1> Запретим пить водку! </h1></center>Проголосуйте за запрет водки на физтехе по <a href="https://natribu.org/">ссылке</a>! <br></Body></Html>')\
-        
-    ################## Adding all links to hosts #######################
-    print(f"\n------- Adding all links to hosts -------")
-    copy('/etc/hosts', '/etc/hosts_backup')
-    with open('/etc/hosts', 'a') as hosts:
-        hosts.write(f"{task.local_adress} ocsp.{user.name}.ru\n")
-        hosts.write(f"{task.local_adress} ocsp.valid.{user.name}.ru\n")
-        hosts.write(f"{task.local_adress} ocsp.revoked.{user.name}.ru\n")
-    reboot_ifaces()
-    
+    valid_site_path, revoked_site_path = write_sites("/var/www", file_prefix, user.email)
+
     ################## Configurating NGINX ###################
     print(f"\n------- Adding sites configuration -------")
     copy('/etc/nginx/nginx.conf', '/etc/nginx/nginx.conf.backup')
 
-    chain_path = abspath(f"{workdir}/{file_prefix}-chain.crt")
-
-    valid_site_path = f"/var/www/{file_prefix}-valid"
-    valid_key_path = abspath(f"{workdir}/{file_prefix}-ocsp-valid.key")
-    valid_cert_path = abspath(f"{workdir}/{file_prefix}-ocsp-valid-chain.crt")
-
-    revoked_site_path = f"/var/www/{file_prefix}-revoked"
-    revoked_key_path = abspath(f"{workdir}/{file_prefix}-ocsp-revoked.key")
-    revoked_cert_path = abspath(f"{workdir}/{file_prefix}-ocsp-revoked-chain.crt")
-
-    with open(f"/etc/nginx/nginx.conf", "w") as nginx_conf:
-        nginx_conf.write(f"""
-worker_processes  1;
-events {{
-    worker_connections  1024;
-}}
-http {{
-    include       mime.types;
-    default_type  application/octet-stream;
-    sendfile        on;
-    keepalive_timeout  65;
-    server {{
-        listen       80;
-        server_name  localhost;
-        location / {{
-            root   /usr/share/nginx/html;
-            index  index.html index.htm;
-        }}
-        error_page   500 502 503 504  /50x.html;
-        location = /50x.html {{
-            root   /usr/share/nginx/html;
-        }}
-    }}
-    server {{
-        listen       443 ssl;
-        server_name  ocsp.valid.{user.name}.ru;
-        ssl_certificate      {valid_cert_path};
-        ssl_certificate_key  {valid_key_path};
-        ssl_session_cache    shared:SSL:1m;
-        ssl_session_timeout  5m;
-        ssl_ciphers  HIGH:!aNULL:!MD5;
-        ssl_prefer_server_ciphers  on;
-        # ssl_stapling on;
-        # ssl_stapling_verify on;
-        # ssl_trusted_certificate {chain_path};
-        ssl_ocsp on;
-        charset UTF-8;
-        location / {{
-            root   {valid_site_path};
-            index  index.html;
-            charset UTF-8;
-        }}
-    }}
-    server {{
-        listen       443 ssl;
-        server_name  ocsp.revoked.{user.name}.ru;
-        ssl_certificate      {revoked_cert_path};
-        ssl_certificate_key  {revoked_key_path};
-        ssl_session_cache    shared:SSL:1m;
-        ssl_session_timeout  5m;
-        ssl_ciphers  HIGH:!aNULL:!MD5;
-        ssl_prefer_server_ciphers  on;
-        # ssl_stapling on;
-        # ssl_stapling_verify on;
-        # ssl_trusted_certificate {chain_path};
-        ssl_ocsp on;
-        charset UTF-8;
-        location / {{
-            root   {revoked_site_path};
-            index  index.html;
-            charset UTF-8;
-        }}
-    }}
-}}""")
+    sites, stapler = make_sites(task, user, valid_site_path, revoked_site_path, args.staple)
+    # Session tickets are encrypted with keys which are rotated while the sites are served
+    tickets = rotate_ticket_keys(abspath(f"{workdir}/tickets")) if PROFILES[args.nginx_profile]["tickets"] else []
+    nginx_config = render(args.nginx_profile, sites, tickets=tickets, resolver=nginx_directive())
+    accepted, output = check(nginx_config, "/etc/nginx/nginx.conf")
+    if not accepted and args.nginx_profile != "minimal":
+        print(f"\x1b[1;31mNGINX rejected {args.nginx_profile} profile, minimal one is used instead:\n{output}\x1b[0m")
+        tickets = []
+        nginx_config = render("minimal", sites, resolver=nginx_directive())
+    with open("/etc/nginx/nginx.conf", "w") as nginx_conf:
+        nginx_conf.write(nginx_config)
     run(["systemctl", "start", "nginx"])
     run(["nginx", "-s", "reload"])
 
+    # Stapled responses are refreshed before their nextUpdate while the task is running
+    refresher = None
+    if stapler is not None:
+        stapler.reload = ["nginx", "-s", "reload"]
+        refresher = Popen(stapler.command())
+    rotator = Popen(rotation_command(abspath(f"{workdir}/tickets"), 3600)) if tickets else None
+
     ################## Starting OCSP Responder ######################
     print(f"\n------- Starting OCSP Responder -------")
-    responder = Popen(["openssl", "ocsp", 
-                       "-port", "2560", 
-                       "-index", f"{workdir}/index.txt",
-                       "-CA", f"{workdir}/{file_prefix}-chain.crt",
-                       "-rkey", f"{workdir}/{file_prefix}-ocsp-resp.key", "-passin", f"pass:{user.name}",
-                       "-rsigner", f"{workdir}/{file_prefix}-ocsp-resp.crt"], 
-                       stdout=DEVNULL, stderr=DEVNULL)
+    # Native asyncio responder signs each status once per validity window instead of on every request
+    responder = Popen(responder_command(2560, f"{workdir}/index.txt", f"{workdir}/{file_prefix}-chain.crt",
+                                        f"{workdir}/{file_prefix}-ocsp-resp.key", f"{workdir}/{file_prefix}-ocsp-resp.crt", user.name,
+                                        f"{workdir}/revocation.db"),
+                      stdout=DEVNULL, stderr=DEVNULL)
 
     ################## Testing Valid and Revoked Certificate ######################
     print(f"\n------- Testing valid and revoked certificates -------")
-    run(["openssl", "ocsp", "-url", f"http://ocsp.{user.name}.ru:2560/", 
+    run(["openssl", "ocsp", *ocsp_client(f"http://ocsp.{user.name}.ru:2560/", records),
          "-CAfile", f"{workdir}/{file_prefix}-chain.crt",
          "-issuer", f"{workdir}/{file_prefix}-intr.crt", 
          "-cert", f"{workdir}/{file_prefix}-ocsp-valid.crt"])
-    run(["openssl", "ocsp", "-url", f"http://ocsp.{user.name}.ru:2560/", 
+    run(["openssl", "ocsp", *ocsp_client(f"http://ocsp.{user.name}.ru:2560/", records),
          "-CAfile", f"{workdir}/{file_prefix}-chain.crt",
          "-issuer", f"{workdir}/{file_prefix}-intr.crt", 
          "-cert", f"{workdir}/{file_prefix}-ocsp-revoked.crt"])
@@ -345,7 +255,7 @@ Open Wireshark, start recording of lo:loopback iface, then press Enter to start
 When site will be loaded, close Firefox.
 Save recorded trace as {workdir}/{file_prefix}-ocsp-valid.pcapng then close Wireshark
 Log file will be saved automatically...\x1b[0m""")
-    run_without_sudo(f"SSLKEYLOGFILE=temp.log firefox \"https://ocsp.valid.{user.name}.ru\"")
+    run_without_sudo(f"{firefox} \"https://ocsp.valid.{user.name}.ru\"")
     _ = input(f"\n\x1b[1;33mPress Enter if you closed Firefox and saved {workdir}/{file_prefix}-ocsp-valid.pcapng...\x1b[0m")
     move("temp.log", f"{workdir}/{file_prefix}-ocsp-valid.log")
 
@@ -354,13 +264,18 @@ Open Wireshark, start recording of lo:loopback iface, then press Enter to start
 When site will be loaded, close Firefox.
 Save recorded trace as {workdir}/{file_prefix}-ocsp-revoked.pcapng then close Wireshark
 Log file will be saved automatically...\x1b[0m""")
-    run_without_sudo(f"SSLKEYLOGFILE=temp.log firefox \"https://ocsp.revoked.{user.name}.ru\"")
+    run_without_sudo(f"{firefox} \"https://ocsp.revoked.{user.name}.ru\"")
     _ = input(f"\n\x1b[1;33mPress Enter if you closed Firefox and saved {workdir}/{file_prefix}-ocsp-revoked.pcapng\nScript will restore all settings...\x1b[0m")
     move("temp.log", f"{workdir}/{file_prefix}-ocsp-revoked.log")
     
     print(f"\n------- Killing OCSP Responder -------")
-    responder.kill()
+    responder.terminate()
+    responder.wait()
     print("OCSP Responder killed")
+    if refresher is not None:
+        refresher.kill()
+    if rotator is not None:
+        rotator.kill()
 
     print(f"\n------- Removing generated sites -------")
     rmtree(f"/var/www/{file_prefix}-valid")
@@ -369,10 +284,10 @@ Log file will be saved automatically...\x1b[0m""")
         rmtree("/var/www")
     print("Sites are removed")
 
-    print(f"\n------- Restoring hosts file -------")
-    move('/etc/hosts_backup', '/etc/hosts')
-    reboot_ifaces()
-    print("Restored hosts file")
+    print(f"\n------- Stopping name resolver -------")
+    resolver.kill()
+    rmtree(profile, ignore_errors=True)
+    print("Name resolver stopped")
 
     print(f"\n------- Restoring NGINX config file -------")
     move('/etc/nginx/nginx.conf.backup', '/etc/nginx/nginx.conf')
@@ -386,21 +301,4 @@ Log file will be saved automatically...\x1b[0m""")
         run(["trust", "extract-compat"])
         print(f"Certificate removed")
 
-    # Generating archive with solution
-    with ZipFile(archive_name, "w") as archive:
-        checklist = keeplist.copy()
-        for directory, _, files in walk(workdir):
-            for file in files:
-                if file in keeplist:
-                    checklist.remove(file)
-                    archive.write(f"{directory}/{file}", arcname=file)
-
-    print("\n\n------- Exporting results -------")
-    if isfile(archive_name) and len(checklist) == 0:
-        print(f"Results saved in \x1b[1;4m{archive_name}\x1b[0m. To pass HW, send this archive to \x1b[1;4minsecon@ispras.ru\x1b[0m with topic \x1b[1;4m{email_topic}\x1b[0m.")
-    elif len(checklist) != 0:
-        print(f"\x1b[1;31mSome files are not found: {', '.join(checklist)}\x1b[0m")
-        print(f"Maybe you forgot to save trace from wireshark?")
-    else:
-        print("\x1b[1;31mSomething gone wrong!\x1b[0m")
-          
+    export(task, user, args)
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+from base import Config
+
+from tracing import run
+
+from subprocess import Popen, DEVNULL
+from os import makedirs, listdir, remove, rename, getpid, environ, chmod, kill, utime
+from os.path import expanduser, getmtime, isfile, join, abspath, dirname
+from shutil import move
+from glob import glob
+from time import time, sleep
+from argparse import ArgumentParser
+from threading import Lock
+from fcntl import flock, LOCK_EX, LOCK_NB
+
+POOL_DIR = environ.get("INSECON_KEYPOOL", expanduser("~/.cache/insecon-keypool"))
+DEFAULT_DEPTH = 4
+MAX_AGE = 30 * 24 * 3600          # Pooled keys older than 30 days are never handed out
+
+
+def alive(pid: int) -> bool:
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass                        # process of another user
+    return True
+
+
+class KeyPool:
+    def __init__(self, directory: str = POOL_DIR, max_age: int = MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def slot(self, algorithm: str, keylen: int) -> str:
+        path = join(self.directory, f"{algorithm}-{keylen}")
+        makedirs(path, mode=0o700, exist_ok=True)
+        return path
+
+    def available(self, algorithm: str, keylen: int) -> list:
+        slot = self.slot(algorithm, keylen)
+        keys = []
+        for file in sorted(listdir(slot)):
+            if ".claimed-" in file:
+                # Keys claimed by crashed runs are swept, as are claims older than keys may live
+                pid = file.rsplit(".claimed-", 1)[1]
+                if not pid.isdigit() or not alive(int(pid)) or time() - getmtime(join(slot, file)) > self.max_age:
+                    try: remove(join(slot, file))
+                    except FileNotFoundError: pass
+                continue
+            if not file.endswith(".key"):
+                continue
+            # Expired keys are evicted instead of being handed out
+            if time() - getmtime(join(slot, file)) > self.max_age:
+                try: remove(join(slot, file))
+                except FileNotFoundError: pass
+                continue
+            keys.append(join(slot, file))
+        return keys
+
+    def claim(self, algorithm: str, keylen: int):
+        # Renaming is atomic, so concurrent runs can never get the same key
+        for key in self.available(algorithm, keylen):
+            claimed = f"{key}.claimed-{getpid()}"
+            try:
+                rename(key, claimed)
+                # Age of a claimed key counts from its claim, so a live run never loses it to the sweep
+                utime(claimed)
+                with self.lock: self.hits += 1
+                return claimed
+            except FileNotFoundError:
+                continue
+        with self.lock: self.misses += 1
+        return None
+
+    def take(self, algorithm: str, keylen: int, out: str, password: str = None):
+        claimed = self.claim(algorithm, keylen)
+
+        if claimed is None:
+            # Pool is empty, generating key inline
+            if password is None:
+                run(["openssl", "genrsa", "-out", out, f"{keylen}"], check=True)
+            else:
+                run(["openssl", "genrsa", "-aes256", "-passout", f"pass:{password}", "-out", out, f"{keylen}"], check=True)
+        elif password is None:
+            move(claimed, out)
+        else:
+            # Encrypting pooled key with aes256 and specified password
+            run(["openssl", "pkey", "-in", claimed, "-aes256", "-passout", f"pass:{password}", "-out", out], check=True)
+            remove(claimed)
+
+    def fill(self, algorithm: str, keylen: int, depth: int = DEFAULT_DEPTH):
+        slot = self.slot(algorithm, keylen)
+        while len(self.available(algorithm, keylen)) < depth:
+            # Key is written under temporary name, so half-written keys are never claimed
+            temp = join(slot, f".{getpid()}-{time()}.tmp")
+            run(["openssl", "genrsa", "-out", temp, f"{keylen}"], stdout=DEVNULL, stderr=DEVNULL, warn=False)
+            if not isfile(temp):
+                break
+            chmod(temp, 0o600)
+            rename(temp, join(slot, f"{time():.6f}-{getpid()}.key"))
+
+    def refill(self, depth: int = DEFAULT_DEPTH):
+        # Topping up the pool in background, so the next run takes keys from it
+        Popen(["python3", abspath(__file__), "--depth", f"{depth}", "--dir", self.directory],
+              cwd=dirname(abspath(__file__)), stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+
+    def report(self):
+        print(f"Key pool: {self.hits} hits, {self.misses} misses")
+
+
+def required_keys(task_files: list) -> set:
+    # Every *_keylen field of the task configs is a pool slot, unless its tier uses elliptic curve keys
+    slots = set()
+    for filename in task_files:
+        task = Config(filename)
+        for field, value in task.__dict__.items():
+            if field.endswith("_keylen") and task.__dict__.get(field.replace("_keylen", "_key"), "rsa") == "rsa":
+                slots.add(("rsa", value))
+    return slots
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Fills pool of pre-generated RSA keys")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="number of keys kept for every algorithm and key length")
+    parser.add_argument("--dir", default=POOL_DIR, help="pool directory")
+    parser.add_argument("--daemon", type=int, metavar="SECONDS", help="keep refilling the pool with the given period")
+    args = parser.parse_args()
+
+    pool = KeyPool(args.dir)
+
+    # Only one filler works with the pool at the same time
+    makedirs(args.dir, mode=0o700, exist_ok=True)
+    lock = open(join(args.dir, ".filler.lock"), "w")
+    try:
+        flock(lock, LOCK_EX | LOCK_NB)
+    except BlockingIOError:
+        exit(0)
+
+    slots = required_keys(glob(join(dirname(abspath(__file__)), "tasks", "*.json")))
+
+    while True:
+        for algorithm, keylen in sorted(slots):
+            pool.fill(algorithm, keylen, args.depth)
+        if args.daemon is None:
+            break
+        sleep(args.daemon)
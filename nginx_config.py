@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+from tracing import run
+
+from subprocess import PIPE, STDOUT
+from os import makedirs, replace, remove, urandom, open as open_fd, O_WRONLY, O_CREAT, O_TRUNC
+from os.path import join, dirname, basename, abspath, isfile
+from shutil import which
+from re import search
+from time import sleep
+from argparse import ArgumentParser
+
+TICKET_KEYS = 2         # current key encrypts new tickets, previous one still decrypts tickets issued before rotation
+
+# Directives of every profile, "minimal" is the configuration the task always had
+PROFILES = {
+    "minimal": {
+        "main": ["worker_processes  1;"],
+        "events": ["worker_connections  1024;"],
+        "http": ["sendfile        on;", "keepalive_timeout  65;"],
+        "server": ["ssl_session_cache    shared:SSL:1m;", "ssl_session_timeout  5m;"],
+        "http2": False,
+        "tickets": False,
+    },
+    "throughput": {
+        "main": ["worker_processes  auto;", "worker_rlimit_nofile  65535;"],
+        "events": ["worker_connections  16384;", "multi_accept  on;"],
+        "http": ["sendfile        on;", "tcp_nopush      on;", "tcp_nodelay     on;",
+                 "keepalive_timeout  65;", "keepalive_requests  10000;",
+                 # Session cache of one zone is shared by all workers and sites, about 4000 sessions per megabyte
+                 "ssl_session_cache    shared:SSL:20m;", "ssl_session_timeout  4h;",
+                 "ssl_protocols  TLSv1.2 TLSv1.3;", "ssl_buffer_size  4k;",
+                 # Responses of the OCSP responder for client certificates are cached instead of being asked every handshake
+                 "ssl_ocsp_cache  shared:OCSP:10m;"],
+        "server": [],
+        "http2": True,
+        "tickets": True,
+    },
+}
+
+
+def nginx_version() -> tuple:
+    if which("nginx") is None:
+        return (0, 0, 0)
+    output = run(["nginx", "-v"], stdout=PIPE, stderr=STDOUT, text=True, warn=False).stdout
+    found = search(r"nginx/(\d+)\.(\d+)\.(\d+)", output)
+    return tuple(int(part) for part in found.groups()) if found else (0, 0, 0)
+
+
+def site_block(profile: dict, site: dict, port: int, tickets: list, version: tuple) -> str:
+    # HTTP/2 is a separate directive since nginx 1.25.1, older versions take it as listen parameter
+    listen = f"listen       {port} ssl{' http2' if profile['http2'] and version < (1, 25, 1) else ''};"
+    directives = [listen, f"server_name  {site['name']};"]
+    if profile["http2"] and version >= (1, 25, 1):
+        directives.append("http2 on;")
+    directives += [f"ssl_certificate      {site['cert']};", f"ssl_certificate_key  {site['key']};", *profile["server"],
+                   "ssl_ciphers  HIGH:!aNULL:!MD5;", "ssl_prefer_server_ciphers  on;"]
+    if tickets:
+        directives += ["ssl_session_tickets  on;", *[f"ssl_session_ticket_key  {key};" for key in tickets]]
+    directives += [site.get("stapling", ""), "ssl_ocsp on;", "charset UTF-8;"]
+    body = "\n        ".join(directive for directive in directives if directive)
+    return f"""    server {{
+        {body}
+        location / {{
+            root   {site['root']};
+            index  index.html;
+            charset UTF-8;
+        }}
+    }}
+"""
+
+
+def render(profile_name: str, sites: list, port: int = 443, tickets: list = [], runtime: str = None, resolver: str = None) -> str:
+    # Sites are dicts with name, cert, key, root and optional stapling directives.
+    # Runtime directory keeps pid, logs and temporary files when nginx is started by a user, e.g. by the benchmark
+    profile = PROFILES[profile_name]
+    version = nginx_version()
+    main, http = list(profile["main"]), list(profile["http"])
+    if resolver is not None:
+        http.append(resolver)
+    if runtime is not None:
+        main += [f"pid  {runtime}/nginx.pid;", f"error_log  {runtime}/error.log;"]
+        http = ["access_log  off;", *[f"{kind}_temp_path  {runtime}/{kind};" for kind in ["client_body", "proxy", "fastcgi", "uwsgi", "scgi"]], *http]
+    else:
+        http = ["include       mime.types;", "default_type  application/octet-stream;", *http]
+
+    config = "\n" + "\n".join(main) + "\nevents {\n    " + "\n    ".join(profile["events"]) + "\n}\n"
+    config += "http {\n    " + "\n    ".join(http) + "\n"
+    if runtime is None:
+        # Default site of the distribution is kept
+        config += """    server {
+        listen       80;
+        server_name  localhost;
+        location / {
+            root   /usr/share/nginx/html;
+            index  index.html index.htm;
+        }
+        error_page   500 502 503 504  /50x.html;
+        location = /50x.html {
+            root   /usr/share/nginx/html;
+        }
+    }
+"""
+    for site in sites:
+        config += site_block(profile, site, port, tickets if profile["tickets"] else [], version)
+    return config + "}"
+
+
+def check(config: str, target: str) -> tuple:
+    # Config is tested next to the target, so relative includes (mime.types) resolve the same way
+    test = join(dirname(target), f".{basename(target)}.test")
+    with open(test, "w") as file:
+        file.write(config)
+    try:
+        result = run(["nginx", "-t", "-c", test], stdout=PIPE, stderr=STDOUT, text=True, warn=False)
+    finally:
+        remove(test)
+    return result.returncode == 0, result.stdout
+
+
+def rotate_ticket_keys(directory: str, count: int = TICKET_KEYS) -> list:
+    # New 80-byte key becomes the first one, the oldest one is dropped
+    makedirs(directory, mode=0o700, exist_ok=True)
+    keys = [join(directory, f"ticket-{i}.key") for i in range(count)]
+    for older, newer in reversed(list(zip(keys[1:], keys[:-1]))):
+        if isfile(newer):
+            replace(newer, older)
+    with open(open_fd(f"{keys[0]}.tmp", O_WRONLY | O_CREAT | O_TRUNC, 0o600), "wb") as key:
+        key.write(urandom(80))
+    replace(f"{keys[0]}.tmp", keys[0])
+    # nginx refuses missing key files, so absent previous keys are filled with fresh random ones
+    for path in keys[1:]:
+        if not isfile(path):
+            with open(open_fd(path, O_WRONLY | O_CREAT | O_TRUNC, 0o600), "wb") as key:
+                key.write(urandom(80))
+    return keys
+
+
+def rotation_command(directory: str, period: int) -> list:
+    # Arguments for running rotation as a separate process while the sites are served
+    return ["python3", join(dirname(abspath(__file__)), "nginx_config.py"), directory, "--period", f"{period}", "--reload"]
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Rotates TLS session ticket keys of nginx")
+    parser.add_argument("directory", help="directory with ticket-N.key files referenced by nginx config")
+    parser.add_argument("--keys", type=int, default=TICKET_KEYS, help="number of kept keys")
+    parser.add_argument("--period", type=int, default=0, metavar="SECONDS",
+                        help="rotate every period starting one period later, 0 to rotate once right now")
+    parser.add_argument("--reload", action="store_true", help="run nginx -s reload after every rotation")
+    args = parser.parse_args()
+
+    while True:
+        sleep(args.period)
+        rotate_ticket_keys(args.directory, args.keys)
+        if args.reload:
+            run(["nginx", "-s", "reload"])
+        if args.period == 0:
+            break
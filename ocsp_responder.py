@@ -0,0 +1,299 @@
+#!/usr/bin/python
+
+from asyncio import start_server, run, sleep, get_running_loop, wait_for, IncompleteReadError, TimeoutError as AsyncTimeoutError
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, stat
+from os.path import abspath, dirname, join, isfile
+from datetime import datetime, timedelta, timezone
+from base64 import b64decode
+from urllib.parse import unquote
+from collections import deque
+from statistics import quantiles
+from time import perf_counter, monotonic
+from argparse import ArgumentParser
+from signal import SIGINT, SIGTERM
+from sqlite3 import DatabaseError
+
+from revocation import RevocationDB
+from crl import read
+
+try:
+    from cryptography import x509
+    from cryptography.x509 import ocsp
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+except ImportError:
+    x509 = None
+
+HASHES = ["SHA1", "SHA224", "SHA256", "SHA384", "SHA512"]     # CertID hash algorithms the responder answers for
+CACHE_SIZE = 65536                  # Signed responses kept for reuse, the oldest ones are dropped above it
+
+REASONS = {"unspecified": "unspecified", "keyCompromise": "key_compromise", "CACompromise": "ca_compromise",
+           "affiliationChanged": "affiliation_changed", "superseded": "superseded",
+           "cessationOfOperation": "cessation_of_operation", "certificateHold": "certificate_hold",
+           "removeFromCRL": "remove_from_crl", "privilegeWithdrawn": "privilege_withdrawn", "AACompromise": "aa_compromise"}
+
+
+def command(port: int, index: str, ca: str, rkey: str, rsigner: str, password: str, database: str = None) -> list:
+    # Native responder when cryptography package is installed, openssl ocsp otherwise
+    if x509 is None:
+        return ["openssl", "ocsp", "-port", f"{port}", "-index", index, "-CA", ca,
+                "-rkey", rkey, "-passin", f"pass:{password}", "-rsigner", rsigner]
+    # Statuses are looked up in the revocation database when it exists
+    source = ["-db", database] if database is not None and isfile(database) else ["-index", index]
+    return ["python3", join(dirname(abspath(__file__)), "ocsp_responder.py"), "-port", f"{port}", *source, "-CA", ca,
+            "-rkey", rkey, "-passin", f"pass:{password}", "-rsigner", rsigner]
+
+
+def parse_time(value: str) -> datetime:
+    # index.txt keeps times as YYMMDDHHMMSSZ
+    return datetime.strptime(value, "%y%m%d%H%M%SZ").replace(tzinfo=timezone.utc)
+
+
+def load_index(filename: str) -> dict:
+    statuses = {}
+    with open(filename) as index:
+        for line in index:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4:
+                continue
+            status, _, revocation, serial = fields[:4]
+            if status == "R":
+                revoked_at, _, reason = revocation.partition(",")
+                statuses[int(serial, 16)] = ("R", parse_time(revoked_at), REASONS.get(reason))
+            else:
+                statuses[int(serial, 16)] = ("V", None, None)
+    return statuses
+
+
+########## Signing worker, every process decrypts responder key only once ##########
+
+signer = {}
+
+
+def load_signer(rkey: str, password: str, rsigner: str):
+    with open(rkey, "rb") as pem:
+        signer["key"] = serialization.load_pem_private_key(pem.read(), password=password.encode() if password else None,
+                                                           unsafe_skip_rsa_key_validation=True)
+    with open(rsigner, "rb") as pem:
+        signer["cert"] = x509.load_pem_x509_certificate(pem.read())
+    # Ed25519 responder key signs the response itself instead of its digest
+    signer["hash"] = None if isinstance(signer["key"], ed25519.Ed25519PrivateKey) else hashes.SHA256()
+
+
+def issuer_hashes(cert) -> set:
+    # (algorithm, name hash, key hash) of CertIDs naming the issuer, key hash covers subjectPublicKey bits only
+    spki = cert.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    _, start, _ = read(spki, 0)
+    _, _, algorithm_end = read(spki, start)
+    _, bits, bits_end = read(spki, algorithm_end)
+    name, key = cert.subject.public_bytes(), spki[bits + 1:bits_end]
+    hashed = set()
+    for algorithm in HASHES:
+        digests = [hashes.Hash(getattr(hashes, algorithm)()) for _ in range(2)]
+        digests[0].update(name)
+        digests[1].update(key)
+        hashed.add((algorithm.lower(), digests[0].finalize(), digests[1].finalize()))
+    return hashed
+
+
+def sign(name_hash: bytes, key_hash: bytes, serial: int, algorithm: str, status: tuple, validity: int, nonce: bytes) -> bytes:
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    state, revoked_at, reason = status
+    if state == "R":
+        cert_status = ocsp.OCSPCertStatus.REVOKED
+        reason = getattr(x509.ReasonFlags, reason) if reason else None
+    elif state == "V":
+        cert_status, revoked_at, reason = ocsp.OCSPCertStatus.GOOD, None, None
+    else:
+        cert_status, revoked_at, reason = ocsp.OCSPCertStatus.UNKNOWN, None, None
+
+    builder = (ocsp.OCSPResponseBuilder()
+               .add_response_by_hash(name_hash, key_hash, serial, getattr(hashes, algorithm)(), cert_status,
+                                     now, now + timedelta(seconds=validity), revoked_at, reason)
+               .responder_id(ocsp.OCSPResponderEncoding.HASH, signer["cert"])
+               .certificates([signer["cert"]]))
+    if nonce is not None:
+        builder = builder.add_extension(x509.OCSPNonce(nonce), critical=False)
+    return builder.sign(signer["key"], signer["hash"]).public_bytes(serialization.Encoding.DER)
+
+
+class Responder:
+    def __init__(self, index: str, ca: str, rkey: str, password: str, rsigner: str, workers: int, validity: int, database: str = None):
+        self.index = index
+        self.validity = validity
+        self.statuses = {}
+        self.mtime = None
+        self.db = RevocationDB(database) if database is not None else None
+        self.cache = {}             # (issuer key hash, serial) -> (response, expiration)
+        self.pool = ProcessPoolExecutor(workers, initializer=load_signer, initargs=(rkey, password, rsigner))
+        # Workers are started before the first connection, a worker forked later inherits the accepted socket
+        # and keeps it open after the responder closes it, so clients reading until close never finish
+        self.pool.submit(int).result()
+
+        # Issuers are recognized by hashes of their name and public key, precomputed for every supported algorithm
+        self.issuers = set()
+        with open(ca, "rb") as pem:
+            for cert in x509.load_pem_x509_certificates(pem.read()):
+                self.issuers |= issuer_hashes(cert)
+
+        self.requests = 0
+        self.latencies = deque(maxlen=100000)
+        self.reload()
+
+    def reload(self):
+        if self.db is not None:
+            # Database is queried on every request, only signed responses become stale
+            version = self.db.version()
+            if version != self.mtime:
+                self.mtime = version
+                self.cache.clear()
+            return
+        mtime = stat(self.index).st_mtime_ns
+        if mtime != self.mtime:
+            self.statuses = load_index(self.index)
+            self.mtime = mtime
+            self.cache.clear()
+            print(f"Loaded {len(self.statuses)} certificates from {self.index}")
+
+    def lookup(self, serial: int) -> tuple:
+        if self.db is None:
+            return self.statuses.get(serial, ("U", None, None))
+        status, revoked_at, reason = self.db.status(serial)
+        return status, revoked_at, REASONS.get(reason)
+
+    async def watch(self):
+        while True:
+            await sleep(1)
+            try: self.reload()
+            except (OSError, ValueError, DatabaseError) as error: print(f"Failed to reload statuses: {error}")
+
+    async def respond(self, body: bytes) -> bytes:
+        try:
+            request = ocsp.load_der_ocsp_request(body)
+        except ValueError:
+            return ocsp.OCSPResponseBuilder.build_unsuccessful(ocsp.OCSPResponseStatus.MALFORMED_REQUEST).public_bytes(serialization.Encoding.DER)
+        # Statuses are signed only for certificates of the known issuers, whatever hash the client used
+        if (request.hash_algorithm.name, request.issuer_name_hash, request.issuer_key_hash) not in self.issuers:
+            return ocsp.OCSPResponseBuilder.build_unsuccessful(ocsp.OCSPResponseStatus.UNAUTHORIZED).public_bytes(serialization.Encoding.DER)
+
+        try:
+            nonce = request.extensions.get_extension_for_class(x509.OCSPNonce).value.nonce
+        except x509.ExtensionNotFound:
+            nonce = None
+
+        # Responses without nonce are the same for all clients, so they are signed once per validity window
+        key = (request.issuer_key_hash, request.serial_number)
+        if nonce is None and key in self.cache and self.cache[key][1] > monotonic():
+            return self.cache[key][0]
+
+        status = self.lookup(request.serial_number)
+        response = await get_running_loop().run_in_executor(self.pool, sign, request.issuer_name_hash, request.issuer_key_hash,
+                                                            request.serial_number, request.hash_algorithm.name.upper(),
+                                                            status, self.validity, nonce)
+        if nonce is None:
+            if len(self.cache) >= CACHE_SIZE:
+                # Dict keeps insertion order, so the oldest response is dropped
+                del self.cache[next(iter(self.cache))]
+            self.cache[key] = (response, monotonic() + self.validity / 2)
+        return response
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await wait_for(reader.readline(), 30)
+                if not line:
+                    break
+                start = perf_counter()
+                method, path, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                if method == "POST":
+                    body = await reader.readexactly(int(headers.get("content-length", 0)))
+                else:
+                    body = b64decode(unquote(path.split("/", 1)[1]))
+                response = await self.respond(body)
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(f"{'HTTP/1.1' if version == 'HTTP/1.1' else 'HTTP/1.0'} 200 OK\r\n"
+                             f"Content-Type: application/ocsp-response\r\n"
+                             f"Content-Length: {len(response)}\r\n"
+                             f"Cache-Control: max-age={self.validity // 2}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + response)
+                await writer.drain()
+
+                self.requests += 1
+                self.latencies.append(perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, IncompleteReadError, AsyncTimeoutError, ValueError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def report(self, period: int):
+        last_requests, last_time = 0, perf_counter()
+        while True:
+            await sleep(period)
+            self.print_stats(self.requests - last_requests, perf_counter() - last_time)
+            last_requests, last_time = self.requests, perf_counter()
+
+    def print_stats(self, requests: int, elapsed: float):
+        if len(self.latencies) < 2:
+            return
+        percentiles = quantiles(self.latencies, n=100)
+        print(f"{requests / elapsed:.1f} requests/s, latency p50 {percentiles[49] * 1000:.2f} ms, p99 {percentiles[98] * 1000:.2f} ms")
+
+
+async def serve(responder: Responder, host: str, port: int, period: int):
+    server = await start_server(responder.handle, host, port)
+    loop = get_running_loop()
+    for signal in [SIGINT, SIGTERM]:
+        loop.add_signal_handler(signal, server.close)
+    watcher = loop.create_task(responder.watch())
+    reporter = loop.create_task(responder.report(period)) if period else None
+
+    start = perf_counter()
+    try:
+        await server.serve_forever()
+    except BaseException:
+        pass
+    watcher.cancel()
+    if reporter is not None: reporter.cancel()
+    print(f"Served {responder.requests} requests")
+    responder.print_stats(responder.requests, perf_counter() - start)
+    responder.pool.shutdown()
+
+
+if __name__ == "__main__":
+
+    # Options follow openssl ocsp, so the responder can replace it as is
+    parser = ArgumentParser(description="OCSP responder serving statuses from openssl ca index.txt")
+    parser.add_argument("-port", type=int, default=2560)
+    parser.add_argument("-host", default="0.0.0.0")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-index", help="openssl ca database")
+    source.add_argument("-db", help="revocation database created by revocation.py")
+    parser.add_argument("-CA", required=True, dest="ca", help="certificates of issuers")
+    parser.add_argument("-rkey", required=True, help="responder key")
+    parser.add_argument("-rsigner", required=True, help="responder certificate")
+    parser.add_argument("-passin", default="", help="password for responder key in openssl format pass:password")
+    parser.add_argument("-validity", type=int, default=300, help="seconds of validity of every response")
+    parser.add_argument("-workers", type=int, default=cpu_count() or 1, help="signing processes")
+    parser.add_argument("-stats", type=int, default=0, metavar="SECONDS", help="period of throughput reports")
+    args = parser.parse_args()
+
+    if x509 is None:
+        print(f"Python package cryptography is needed for OCSP responder, install it with pip")
+        print(f"e.g. \x1b[1mpip install cryptography\x1b[0m")
+        exit(1)
+
+    responder = Responder(args.index, args.ca, args.rkey, args.passin.removeprefix("pass:"), args.rsigner, args.workers, args.validity, args.db)
+    print(f"Serving OCSP on {args.host}:{args.port}")
+    run(serve(responder, args.host, args.port, args.stats))
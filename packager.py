@@ -0,0 +1,157 @@
+#!/usr/bin/python
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from shutil import copyfileobj
+from zipfile import ZipFile
+from hashlib import sha256
+from zlib import compressobj, crc32, DEFLATED
+from struct import pack as encode
+from os import cpu_count, replace
+from os.path import isfile, basename
+from argparse import ArgumentParser
+
+CHUNK = 1024 * 1024
+MANIFEST = "SHA256SUMS"
+# Members are never recompressed when their content is compressed already
+COMPRESSED = (".zip", ".gz", ".tgz", ".xz", ".bz2", ".zst", ".7z", ".png", ".jpg", ".jpeg")
+LEVEL = 6
+DOS_DATE = (0 << 9) | (1 << 5) | 1      # 1980-01-01 00:00, the same in every archive
+UNIX_FILE = 0o100644 << 16
+LIMIT = 0xFFFFFFFF                      # zip64 is not needed for task archives
+
+
+class Member:
+    def __init__(self, name: str, method: int, crc: int, size: int, data, digest: str):
+        self.name = name
+        self.method = method            # 0 - stored, 8 - deflated
+        self.crc = crc
+        self.size = size
+        self.data = data                # content to write, or None for file which is copied as is
+        self.compressed = size if data is None else data.tell()
+        self.digest = digest
+        self.offset = 0
+
+    def flags(self) -> int:
+        return 0x800 if not self.name.isascii() else 0      # UTF-8 name
+
+
+def compress(path: str, name: str) -> Member:
+    # One pass over the file computes CRC-32 and SHA-256 and deflates it chunk by chunk
+    digest, crc, size = sha256(), 0, 0
+    deflate = None if name.lower().endswith(COMPRESSED) else compressobj(LEVEL, DEFLATED, -15)
+    data = SpooledTemporaryFile(max_size=16 * CHUNK) if deflate is not None else None
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK):
+            digest.update(chunk)
+            crc = crc32(chunk, crc)
+            size += len(chunk)
+            if deflate is not None:
+                data.write(deflate.compress(chunk))
+    if deflate is not None:
+        data.write(deflate.flush())
+        # Incompressible content (e.g. keys in DER) is stored as is
+        if data.tell() >= size:
+            data.close()
+            data = None
+    if size > LIMIT:
+        raise ValueError(f"{path} is larger than 4 GiB")
+    return Member(name, 8 if data is not None else 0, crc, size, data, digest.hexdigest())
+
+
+def write_member(archive, member: Member, source: str):
+    member.offset = archive.tell()
+    name = member.name.encode()
+    archive.write(encode("<IHHHHHIIIHH", 0x04034B50, 20, member.flags(), member.method, 0, DOS_DATE,
+                         member.crc, member.compressed, member.size, len(name), 0) + name)
+    if member.data is None:
+        with open(source, "rb") as file:
+            copyfileobj(file, archive, CHUNK)
+    else:
+        member.data.seek(0)
+        copyfileobj(member.data, archive, CHUNK)
+        member.data.close()
+
+
+def write_directory(archive, members: list):
+    start = archive.tell()
+    for member in members:
+        name = member.name.encode()
+        archive.write(encode("<IHHHHHHIIIHHHHHII", 0x02014B50, 3 << 8 | 20, 20, member.flags(), member.method, 0, DOS_DATE,
+                             member.crc, member.compressed, member.size, len(name), 0, 0, 0, 0, UNIX_FILE, member.offset) + name)
+    end = archive.tell()
+    if end > LIMIT or len(members) > 0xFFFF:
+        raise ValueError("archive is larger than 4 GiB")
+    archive.write(encode("<IHHHHIIH", 0x06054B50, 0, 0, len(members), len(members), end - start, start, 0))
+
+
+def pack(archive_name: str, files: list, workers: int = None) -> list:
+    # Writes (path, name) files in the given order with SHA-256 manifest, returns names of missing files.
+    # Members without timestamps and owners make the archive identical for identical files
+    found = [(path, name) for path, name in files if isfile(path)]
+    missing = [name for path, name in files if not isfile(path)]
+
+    with ThreadPoolExecutor(workers or cpu_count() or 1) as pool, open(f"{archive_name}.tmp", "wb") as archive:
+        # zlib releases GIL, so members are compressed in parallel and written in order as soon as they are ready
+        members = []
+        for (path, _), member in zip(found, pool.map(lambda file: compress(*file), found)):
+            write_member(archive, member, path)
+            members.append(member)
+
+        # Manifest in sha256sum format is the last member, so it can be checked after unpacking as well
+        manifest = "".join(f"{member.digest}  {member.name}\n" for member in members).encode()
+        listing = SpooledTemporaryFile()
+        listing.write(manifest)
+        members.append(Member(MANIFEST, 0, crc32(manifest), len(manifest), listing, sha256(manifest).hexdigest()))
+        write_member(archive, members[-1], None)
+
+        write_directory(archive, members)
+    replace(f"{archive_name}.tmp", archive_name)
+    return missing
+
+
+def check(archive_name: str) -> list:
+    # Members whose content differs from the manifest, checked while streaming them out of the archive
+    broken = []
+    with ZipFile(archive_name) as archive:
+        if MANIFEST not in archive.namelist():
+            raise ValueError(f"{archive_name} has no {MANIFEST} manifest")
+        listed = dict(reversed(line.split("  ", 1)) for line in archive.read(MANIFEST).decode().splitlines())
+        for name in archive.namelist():
+            if name == MANIFEST:
+                continue
+            digest = sha256()
+            with archive.open(name) as member:
+                while chunk := member.read(CHUNK):
+                    digest.update(chunk)
+            if listed.pop(name, None) != digest.hexdigest():
+                broken.append(name)
+        broken += listed    # listed in manifest, but absent
+    return broken
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Packs files into reproducible zip archive with SHA-256 manifest or checks such archive")
+    parser.add_argument("archive")
+    parser.add_argument("files", nargs="*", help="files stored under their base names")
+    parser.add_argument("--check", action="store_true", help="check members of the archive against its manifest")
+    parser.add_argument("--workers", type=int, default=cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.check:
+        try:
+            broken = check(args.archive)
+        except ValueError as error:
+            print(f"\x1b[1;31m{error}\x1b[0m")
+            exit(1)
+        for name in broken:
+            print(f"\x1b[1;31m{name}: checksum mismatch\x1b[0m")
+        if len(broken) == 0:
+            print(f"{args.archive}: OK")
+        exit(1 if broken else 0)
+
+    missing = pack(args.archive, [(file, basename(file)) for file in args.files], args.workers)
+    for name in missing:
+        print(f"\x1b[1;31m{name} is not found\x1b[0m")
+    exit(1 if missing else 0)
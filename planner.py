@@ -0,0 +1,370 @@
+#!/usr/bin/python
+
+from base import Config, arguments
+from scheduler import Scheduler
+from keypool import KeyPool
+from backend import make_backend
+from cache import BuildCache
+from revocation import RevocationDB, update_database
+from crl import build_crl, build_delta
+from verify import check_certificates
+from tracing import tracer
+from workspace import Workspace
+from packager import pack
+from truststore import TrustStore, load_leaf, write_chain as save_chain
+
+from os import remove
+from os.path import isfile
+from shutil import copyfile
+from functools import partial
+
+
+class Task:
+    def __init__(self, user: Config, no: str, keys: str = None):
+        self.user = user
+        self.config = Config(f"tasks/{no}.json")
+        self.no = no
+        self.keys = keys            # key algorithm overriding profiles of the config
+        self.workdir = f"{user.name}-{user.group}-{no}"
+        self.prefix = f"{user.name}-{user.group}"
+        self.archive_name = f"{self.workdir}/{self.prefix}-{no}.zip"
+        self.email_topic = f"{user.university}-{user.group}-{no}"
+        # Only archived files and files used after the build (listed in "keep") are written to workdir
+        self.workspace = Workspace(self.workdir, keep=[*self.archive_files(), f"{self.prefix}-{no}.zip",
+                                                       *[self.format(file) for file in getattr(self.config, "keep", [])]],
+                                   persist=["revocation.db"])
+
+    def __str__(self) -> str:
+        return self.workdir
+
+    def format(self, template: str) -> str:
+        return template.format(name=self.user.name, group=self.user.group, email=self.user.email, prefix=self.prefix)
+
+    def path(self, name: str) -> str:
+        return self.file(f"{self.prefix}-{name}")
+
+    def file(self, name: str) -> str:
+        return self.workspace.path(name)
+
+    def key_profile(self, tier: str) -> tuple:
+        # Algorithm and RSA key length of ca, intr or basic tier
+        return self.keys or getattr(self.config, f"{tier}_key", "rsa"), getattr(self.config, f"{tier}_keylen")
+
+    def subject(self, cn: str) -> str:
+        return f"/C=RU/ST=Moscow/L=Moscow/O={self.user.name}/OU={self.user.name} {self.no.upper()}/CN={self.user.name} {cn}/emailAddress={self.user.email}"
+
+    def archive_files(self) -> list:
+        return [self.format(file) for file in self.config.archive]
+
+
+class Planner:
+    def __init__(self, user: Config, tasks: list, graph: Scheduler, backend, share: bool = True):
+        self.user = user
+        self.tasks = tasks
+        self.graph = graph
+        self.backend = backend
+        self.share = share
+        self.shared = Workspace(f"{user.name}-{user.group}-shared")
+        self.shared_keys = {}       # (role, keylen) -> path of the key generated once for all tasks
+
+    def plan(self):
+        if self.share:
+            self.shared.create()
+        for task in self.tasks:
+            task.workspace.create()
+            self.hierarchy(task)
+            for leaf in task.config.leaves:
+                self.leaf(task, leaf)
+            if hasattr(task.config, "crl"):
+                self.crl(task)
+            if hasattr(task.config, "ocsp"):
+                self.ocsp(task)
+            # Archives of tasks with manual steps are generated by their scripts
+            if not getattr(task.config, "capture", False):
+                self.archive(task)
+
+    def close(self):
+        # Intermediate files are dropped from memory, kept ones are already in workdirs
+        self.shared.close()
+        for task in self.tasks:
+            task.workspace.close()
+
+    def key(self, task: Task, role: str, tier: str):
+        out = task.path(f"{role}.key")
+        algorithm, keylen = task.key_profile(tier)
+        if not self.share:
+            self.graph.add(f"[{task.no}] Generating {role} key",
+                           partial(self.backend.key, out, keylen, password=self.user.name, algorithm=algorithm),
+                           outputs=[out])
+            return
+
+        # Keys of the same role, algorithm and length are generated once and copied to every task
+        if (role, algorithm, keylen) not in self.shared_keys:
+            size = keylen if algorithm == "rsa" else algorithm.replace(":", "-")
+            shared = self.shared.path(f"{task.prefix}-{role}-{size}.key")
+            self.graph.add(f"Generating shared {role} key",
+                           partial(self.backend.key, shared, keylen, password=self.user.name, algorithm=algorithm),
+                           outputs=[shared])
+            self.shared_keys[(role, algorithm, keylen)] = shared
+        shared = self.shared_keys[(role, algorithm, keylen)]
+        self.graph.add(f"[{task.no}] Copying shared {role} key", partial(copyfile, shared, out),
+                       inputs=[shared], outputs=[out])
+
+    def archive(self, task: Task):
+        self.graph.add(f"[{task.no}] Generating archive", partial(make_archive, task, self.graph.workers),
+                       inputs=[task.file(file) for file in task.archive_files()],
+                       outputs=[task.archive_name],
+                       cache=False)    # archive is cheaper to pack than to copy from the cache
+
+    def hierarchy(self, task: Task):
+        self.key(task, "ca", "ca")
+        self.ca_certificate(task)
+        self.key(task, "intr", "intr")
+        self.intr_certificate(task)
+
+    def ca_certificate(self, task: Task):
+        config = task.config
+
+        #################### CA Certificate ##########################
+        # Generating self-signed certificate with specified RSA key
+        self.graph.add(f"[{task.no}] Generating CA certificate",
+                       partial(self.backend.self_signed,
+                               key=task.path("ca.key"), password=self.user.name,
+                               subject=task.subject("CA"),
+                               days=config.ca_time,
+                               extensions=["basicConstraints=critical,CA:TRUE",
+                                           "keyUsage=critical,digitalSignature,keyCertSign,cRLSign"],
+                               out=task.path("ca.crt")),
+                       inputs=[task.path("ca.key")],
+                       outputs=[task.path("ca.crt")])
+
+    def intr_certificate(self, task: Task):
+        config = task.config
+
+        #################### Intermediate CA Certificate #################
+        # Generating certificate signed by CA
+        self.graph.add(f"[{task.no}] Generating Intermediate certificate",
+                       partial(self.backend.issue,
+                               key=task.path("intr.key"), password=self.user.name,
+                               subject=task.subject("Intermediate CA"),
+                               days=config.intr_time,
+                               extensions=["basicConstraints=critical,pathlen:0,CA:TRUE",
+                                           "keyUsage=critical,digitalSignature,keyCertSign,cRLSign"],
+                               ca_cert=task.path("ca.crt"), ca_key=task.path("ca.key"), ca_password=self.user.name,
+                               out=task.path("intr.crt")),
+                       inputs=[task.path("ca.crt"), task.path("ca.key"), task.path("intr.key")],
+                       outputs=[task.path("intr.crt")])
+
+    def leaf(self, task: Task, leaf: dict):
+        self.leaf_key(task, leaf)
+        self.leaf_certificate(task, leaf)
+
+    def leaf_key(self, task: Task, leaf: dict):
+        name = leaf["name"]
+        password = self.user.name if leaf.get("encrypted", False) else None
+        algorithm, keylen = task.key_profile(leaf_tier(leaf))
+
+        # Taking key of the tier profile (RSA ones from the pool), leaf keys are encrypted only when profile says so
+        self.graph.add(f"[{task.no}] Generating {leaf['cn']} key",
+                       partial(self.backend.key, task.path(f"{name}.key"), keylen, password=password, algorithm=algorithm),
+                       outputs=[task.path(f"{name}.key")])
+
+    def leaf_certificate(self, task: Task, leaf: dict):
+        config = task.config
+        name = leaf["name"]
+        password = self.user.name if leaf.get("encrypted", False) else None
+
+        # Generating certificate signed by Intermediate CA
+        self.graph.add(f"[{task.no}] Generating {leaf['cn']} certificate",
+                       partial(self.backend.issue,
+                               key=task.path(f"{name}.key"), password=password,
+                               subject=task.subject(leaf["cn"]),
+                               days=getattr(config, leaf.get("time", "basic_time")),
+                               extensions=[task.format(extension) for extension in leaf["extensions"]],
+                               ca_cert=task.path("intr.crt"), ca_key=task.path("intr.key"), ca_password=self.user.name,
+                               out=task.path(f"{name}.crt")),
+                       inputs=[task.path("intr.crt"), task.path("intr.key"), task.path(f"{name}.key")],
+                       outputs=[task.path(f"{name}.crt")])
+
+    def chain(self, task: Task):
+        self.graph.add(f"[{task.no}] Generating certificate chain",
+                       partial(write_chain, task.path("chain.crt"), task.path("intr.crt"), [task.path("ca.crt")], root_first=True),
+                       inputs=[task.path("ca.crt"), task.path("intr.crt")],
+                       outputs=[task.path("chain.crt")])
+
+    def database(self, task: Task, conf: str, lines: list):
+        # Configuration of openssl ca and its database, which is kept between runs of the same issuer
+        self.graph.add(f"[{task.no}] Writing {conf}",
+                       partial(write_database, task.file(conf), task.file("index.txt"), task.file("revocation.db"), task.path("intr.crt"), lines),
+                       inputs=[task.path("intr.crt")],
+                       outputs=[task.file(conf), task.file("index.txt"), task.file("revocation.db")],
+                       cache=False)    # database outlives the run, restoring it would roll back CRL numbers
+
+    def revocations(self, task: Task, valid: list = None, revoked: list = None):
+        # Statuses are kept in the indexed database, index.txt is exported from it for openssl
+        valid, revoked = valid or [], revoked or []
+        certificates = [task.path(f"{leaf}.crt") for leaf in valid + revoked]
+        self.graph.add(f"[{task.no}] Registering {', '.join(valid + revoked)} certificates",
+                       partial(update_database, task.file("revocation.db"), task.file("index.txt"),
+                               valid=[task.path(f"{leaf}.crt") for leaf in valid],
+                               revoked=[task.path(f"{leaf}.crt") for leaf in revoked]),
+                       inputs=certificates + [task.file("revocation.db"), task.file("index.txt")],
+                       outputs=[task.file("revocation.db"), task.file("index.txt")],
+                       cache=False)
+
+    def crl(self, task: Task):
+        crl = task.config.crl
+
+        self.database(task, "crl.conf", ["[ basic_cert ]",
+                                         f"crlDistributionPoints={task.format(crl['distrib_point'])}"])
+        self.revocations(task, revoked=crl["revoke"])
+        self.revocation_list(task)
+        self.chain(task)
+        self.check_revocations(task)
+
+    def revocation_list(self, task: Task):
+        crl = task.config.crl
+        crl_file = task.file(task.format(crl['file']))
+        delta = crl.get("delta")
+
+        # CRL is streamed from the revocation database, so its size does not depend on available memory
+        self.graph.add(f"[{task.no}] Generating CRL",
+                       partial(build_crl, task.file("revocation.db"), task.path("intr.crt"), task.path("intr.key"),
+                               self.user.name, crl_file, crl["days"], freshest=task.format(delta["url"]) if delta else None),
+                       inputs=[task.path("intr.crt"), task.path("intr.key"), task.file("revocation.db")],
+                       outputs=[crl_file, task.file("revocation.db")],
+                       cache=False)    # CRL validity depends on the time of generation
+        if delta:
+            # Delta CRL over the full one just issued, clients find it by Freshest CRL extension of the full CRL
+            self.graph.add(f"[{task.no}] Generating delta CRL",
+                           partial(build_delta, task.file("revocation.db"), task.path("intr.crt"), task.path("intr.key"),
+                                   self.user.name, task.file(task.format(delta["file"])), delta["days"]),
+                           inputs=[task.path("intr.crt"), task.path("intr.key"), task.file("revocation.db")],
+                           outputs=[task.file(task.format(delta["file"])), task.file("revocation.db")],
+                           cache=False)
+
+    def check_revocations(self, task: Task):
+        crl = task.config.crl
+        crl_files = [task.file(task.format(crl['file']))]
+        if "delta" in crl:
+            crl_files.append(task.file(task.format(crl["delta"]["file"])))
+
+        # Testing valid and revoked certificates, chain and CRLs are parsed once for all of them
+        certificates = [task.path(f"{leaf}.crt") for leaf in crl["verify"]]
+        self.graph.add(f"[{task.no}] Testing {', '.join(crl['verify'])} certificates",
+                       partial(check_certificates, task.path("chain.crt"), crl_files, certificates),
+                       inputs=[*crl_files, task.path("chain.crt"), *certificates])
+
+    def ocsp(self, task: Task):
+        ocsp = task.config.ocsp
+
+        self.database(task, "ocsp.conf", ["[ basic_cert ]",
+                                          f"authorityInfoAccess = OCSP;URI:{task.format(ocsp['url']).rstrip('/')}",
+                                          "[ req ]",
+                                          f"database = {task.file('index.txt')}"])
+        self.revocations(task, valid=ocsp["valid"], revoked=ocsp["revoke"])
+
+        self.chain(task)
+
+        for leaf in ocsp["chains"]:
+            self.leaf_chain(task, leaf)
+
+    def leaf_chain(self, task: Task, leaf: str):
+        # Leaf certificate followed by its issuers up to the root, the order servers send them in
+        self.graph.add(f"[{task.no}] Generating {leaf} chain",
+                       partial(write_chain, task.path(f"{leaf}-chain.crt"), task.path(f"{leaf}.crt"), [task.path("chain.crt")]),
+                       inputs=[task.path(f"{leaf}.crt"), task.path("chain.crt")],
+                       outputs=[task.path(f"{leaf}-chain.crt")])
+
+
+def leaf_tier(leaf: dict) -> str:
+    # Leaves take key profile of the basic tier unless their keylen field names another one
+    return leaf.get("keylen", "basic_keylen").removesuffix("_keylen")
+
+
+def write_database(conf: str, index: str, database: str, issuer: str, lines: list):
+    with open(conf, "w") as config:
+        for line in lines:
+            config.write(f"{line}\n")
+        config.write(f"[ ca ]\n")
+        config.write(f"default_ca=CA_default\n")
+        config.write(f"[ CA_default ]\n")
+        config.write(f"database = {index}\n")
+        config.write(f"default_md = sha256\n")
+        config.write(f"default_crl_days = 30\n")
+        config.write(f"crl_extensions = crl_ext\n")
+        config.write(f"[ crl_ext ]\n")
+        config.write(f"authorityKeyIdentifier=keyid:always\n")
+
+    # Statuses and CRL numbering go on while the Intermediate CA keeps its name and key
+    entry = load_leaf(issuer)
+    db = RevocationDB(database)
+    db.use_issuer(f"{entry.subject.hex()}:{(entry.ski or b'').hex()}")
+    db.export_index(index)
+    db.close()
+
+
+def write_chain(out: str, leaf: str, bundles: list, root_first: bool = False):
+    # Path from the certificate to a self-signed root is looked up in the bundles, so their order and extra certificates do not matter
+    store = TrustStore(bundles)
+    path = store.build(load_leaf(leaf))
+    if path is None:
+        store.close()
+        raise ValueError(f"no chain from {leaf} to a root of {', '.join(bundles)}")
+    save_chain(out, list(reversed(path)) if root_first else path)
+    store.close()
+    print(f"Generated certificate chain: {out}")
+
+
+def make_archive(task: Task, workers: int = None):
+    # Generating reproducible archive with SHA-256 manifest of the solution, incomplete solution is not archived at all
+    missing = [file for file in task.archive_files() if not isfile(task.file(file))]
+    if missing:
+        if isfile(task.archive_name): remove(task.archive_name)
+        raise FileNotFoundError(f"{', '.join(missing)} not found")
+    pack(task.archive_name, [(task.file(file), file) for file in task.archive_files()], workers)
+
+
+def generate(user: Config, numbers: list, args, share: bool = True):
+    # Every started process is traced, trace and summary are written when the generator exits
+    if getattr(args, "profile", None):
+        tracer.enable(args.profile, task=numbers[0] if len(numbers) == 1 else None)
+    # Steps with unchanged inputs are restored from the build cache instead of being rebuilt
+    cache = BuildCache(limit=args.cache_size * 1024 * 1024, force=args.force)
+    if args.clean: cache.clean()
+    # Independent steps (e.g. all key generations) are executed concurrently
+    graph = Scheduler(workers=getattr(args, "jobs", None), cache=cache)
+    # Keys are taken from the pre-generated pool, missing ones are generated inline
+    pool = KeyPool()
+    backend = make_backend(args.backend, pool)
+
+    tasks = [Task(user, no, getattr(args, "keys", None)) for no in numbers]
+    planner = Planner(user, tasks, graph, backend, share)
+    planner.plan()
+    succeeded = graph.run()
+    planner.close()
+
+    pool.report()
+    cache.report()
+    pool.refill()
+    return tasks, succeeded
+
+
+if __name__ == "__main__":
+
+    parser = arguments("Generates solutions for several tasks in one pass, sharing CA and Intermediate keys between them")
+    parser.add_argument("--tasks", default="p1_1,p1_2,p1_3", help="comma separated list of tasks")
+    parser.add_argument("--no-share", action="store_true", help="generate own CA and Intermediate keys for every task")
+    args = parser.parse_args()
+
+    user = Config("user.json")
+    tasks, succeeded = generate(user, args.tasks.split(","), args, share=not args.no_share)
+
+    for task in tasks:
+        if getattr(task.config, "capture", False):
+            print(f"Certificates for {task.no} are ready, run its generator to capture traffic (they will be reused from the build cache)")
+        elif isfile(task.archive_name):
+            print(f"Results saved in \x1b[1;4m{task.archive_name}\x1b[0m. To pass HW, send this archive to \x1b[1;4minsecon@ispras.ru\x1b[0m with topic \x1b[1;4m{task.email_topic}\x1b[0m.")
+        else:
+            print(f"\x1b[1;31mSomething gone wrong with {task.no}!\x1b[0m")
+    exit(0 if succeeded else 1)
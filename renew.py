@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+from base import Config, KEY_ALGORITHMS
+from planner import Task, Planner, leaf_tier
+from scheduler import Scheduler
+from keypool import KeyPool
+from backend import make_backend
+from truststore import load_leaf
+from crl import crl_header, crl_dates
+from tracing import tracer, run
+
+from heapq import heapify, heappop
+from subprocess import PIPE
+from datetime import datetime, timedelta, timezone
+from glob import glob
+from re import search
+from os import walk, chdir, getcwd
+from os.path import join, isfile, isdir, basename, splitext, relpath, abspath
+from argparse import ArgumentParser
+
+TIERS = ["ca", "intr", "leaf"]
+
+
+def key_profile(certificate: str) -> tuple:
+    # Algorithm and RSA key length of the certificate key in the form of task profiles
+    text = run(["openssl", "x509", "-in", certificate, "-noout", "-text"], stdout=PIPE, check=True, text=True).stdout
+    if "rsaEncryption" in text:
+        return "rsa", int(search(r"Public-Key: \((\d+) bit\)", text).group(1))
+    if "ED25519" in text:
+        return "ed25519", None
+    curve = search(r"NIST CURVE: (P-\d+)", text)
+    return f"ec:{curve.group(1)}" if curve else "unknown", None
+
+
+def find_userdirs(roots: list):
+    # Directories with user.json and tasks, as generators and batch.py leave them
+    for root in roots:
+        for directory, subdirs, files in walk(root):
+            if "user.json" in files and isdir(join(directory, "tasks")):
+                yield abspath(directory)
+                subdirs[:] = []             # workdirs never contain other users
+
+
+def expirations(userdir: str) -> list:
+    # (notAfter, userdir, task, name) of every certificate and CRL in workdirs of the user
+    user = Config(join(userdir, "user.json"))
+    found = []
+    for config_file in sorted(glob(join(userdir, "tasks", "*.json"))):
+        no = splitext(basename(config_file))[0]
+        config = Config(config_file)
+        workdir = join(userdir, f"{user.name}-{user.group}-{no}")
+        if not isdir(workdir):
+            continue
+        for name in ["ca", "intr", *[leaf["name"] for leaf in config.leaves]]:
+            certificate = join(workdir, f"{user.name}-{user.group}-{name}.crt")
+            if isfile(certificate):
+                found.append((load_leaf(certificate).not_after, userdir, no, name))
+        if hasattr(config, "crl"):
+            crl_file = join(workdir, config.crl["file"].format(name=user.name, group=user.group))
+            if not isfile(crl_file):
+                continue
+            next_update = crl_dates(crl_header(crl_file))[1]
+            if next_update is None:
+                # CRL without nextUpdate has no date to renew it by
+                print(f"\x1b[1;33m{relpath(crl_file)} has no next update, it is not renewed\x1b[0m")
+            else:
+                found.append((next_update, userdir, no, "crl"))
+    return found
+
+
+class Renewal(Planner):
+    # Steps of the planner applied to existing workdirs: only due certificates and files depending on them are rebuilt
+    def __init__(self, user: Config, backend, rekey: list):
+        super().__init__(user, [], None, backend, share=False)
+        self.rekey = rekey
+
+    def needs_key(self, task: Task, name: str, tier: str) -> bool:
+        # Key is replaced when the policy says so for the certificate, or when it no longer matches the profile of the task
+        if (name if name in ["ca", "intr"] else "leaf") in self.rekey:
+            return True
+        algorithm, keylen = key_profile(task.path(f"{name}.crt"))
+        profile, profile_keylen = task.key_profile(tier)
+        return algorithm != profile or (algorithm == "rsa" and keylen != profile_keylen)
+
+    def renew(self, task: Task, due: set) -> list:
+        # Plans renewal of the task in a new graph and returns names of certificates signed again,
+        # raises FileNotFoundError when the task can not be renewed in place
+        self.graph = Scheduler()
+        leaves = {leaf["name"]: leaf for leaf in task.config.leaves}
+        renewed, rekeyed = set(due) - {"crl"}, set()
+        for name in ["ca", "intr", *leaves]:
+            if name not in renewed:
+                continue
+            tier = name if name in ["ca", "intr"] else leaf_tier(leaves[name])
+            if self.needs_key(task, name, tier):
+                rekeyed.add(name)
+                # Certificates issued by the old key are signed again by the new one
+                if name == "ca": renewed.add("intr")
+                if name == "intr": renewed.update(leaves)
+
+        if "ca" in renewed:
+            if "ca" in rekeyed: self.key(task, "ca", "ca")
+            self.ca_certificate(task)
+        if "intr" in renewed:
+            if "intr" in rekeyed: self.key(task, "intr", "intr")
+            self.intr_certificate(task)
+        for name, leaf in leaves.items():
+            if name in renewed:
+                if name in rekeyed: self.leaf_key(task, leaf)
+                self.leaf_certificate(task, leaf)
+
+        # New serials get the statuses of the certificates they replace
+        if hasattr(task.config, "crl"):
+            revoked = [name for name in task.config.crl["revoke"] if name in renewed]
+            if revoked:
+                self.revocations(task, revoked=revoked)
+        if hasattr(task.config, "ocsp"):
+            valid = [name for name in task.config.ocsp["valid"] if name in renewed]
+            revoked = [name for name in task.config.ocsp["revoke"] if name in renewed]
+            if valid or revoked:
+                self.revocations(task, valid=valid, revoked=revoked)
+
+        hierarchy = bool(renewed & {"ca", "intr"})
+        if hierarchy and (hasattr(task.config, "crl") or hasattr(task.config, "ocsp")):
+            self.chain(task)
+        if hasattr(task.config, "crl") and (renewed or "crl" in due):
+            self.revocation_list(task)
+            self.check_revocations(task)
+        if hasattr(task.config, "ocsp"):
+            for leaf in task.config.ocsp["chains"]:
+                if hierarchy or leaf in renewed:
+                    self.leaf_chain(task, leaf)
+
+        if not getattr(task.config, "capture", False):
+            self.archive(task)
+
+        # Files which no step produces must be in workdir, issuer keys are kept there since tasks list them in "keep"
+        missing = sorted({path for step in self.graph.steps for path in step.inputs if path not in self.graph.writers and not isfile(path)})
+        if missing:
+            raise FileNotFoundError(f"{', '.join(missing)} not found, regenerate the task with its generator")
+        if getattr(task.config, "capture", False):
+            print(f"\x1b[1;33m[{task.no}] Captures of {task.workdir} show the old certificates, run its generator with --reuse to capture them again\x1b[0m")
+        return sorted(renewed)
+
+
+def renew_user(userdir: str, due: dict, args) -> tuple:
+    # Workdirs are relative to the user directory, as the generators create them
+    cwd = getcwd()
+    chdir(userdir)
+    try:
+        user = Config("user.json")
+        renewal = Renewal(user, make_backend(args.backend, KeyPool()), args.rekey or [])
+        renewed, failed = [], []
+        for no, names in sorted(due.items()):
+            task = Task(user, no, args.keys)
+            try:
+                names = renewal.renew(task, names)
+            except FileNotFoundError as error:
+                print(f"\x1b[1;31m[{no}] {relpath(userdir, cwd)}: {error}\x1b[0m")
+                failed.append(no)
+                continue
+            if renewal.graph.run():
+                renewed += [(no, name) for name in names]
+            else:
+                failed.append(no)
+        return renewed, failed
+    finally:
+        chdir(cwd)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Renews certificates and CRLs of existing workdirs which expire soon, everything else is left as it is")
+    parser.add_argument("directories", nargs="*", default=["."], help="user directories or directories containing them (e.g. batch output)")
+    parser.add_argument("--window", type=int, default=30, metavar="DAYS", help="renew certificates expiring within this number of days")
+    parser.add_argument("--crl-window", type=int, default=7, metavar="DAYS", help="renew CRLs whose next update is within this number of days")
+    parser.add_argument("--rekey", action="append", choices=TIERS,
+                        help="generate new keys for renewed certificates of the tier, keys not matching the task profile are always replaced")
+    parser.add_argument("--keys", choices=KEY_ALGORITHMS, help="key algorithm of new keys instead of the profiles of task configs")
+    parser.add_argument("--backend", choices=["cli", "inprocess"], default="cli")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be renewed")
+    parser.add_argument("--profile", nargs="?", const="profile.json", metavar="FILE", help="trace renewal steps into Chrome trace file")
+    args = parser.parse_args()
+
+    if args.profile:
+        tracer.enable(args.profile)
+
+    # Min-heap on expiration time: only entries inside the window are taken from it, the rest of the fleet is never touched
+    heap = [entry for userdir in find_userdirs(args.directories) for entry in expirations(userdir)]
+    heapify(heap)
+    scanned = len(heap)
+    now = datetime.now(timezone.utc)
+    due = {}
+    while heap and heap[0][0] <= now + timedelta(days=max(args.window, args.crl_window)):
+        expires, userdir, no, name = heappop(heap)
+        if expires > now + timedelta(days=args.crl_window if name == "crl" else args.window):
+            continue
+        print(f"{relpath(userdir)} [{no}] {name} expires {expires:%Y-%m-%d %H:%M} UTC ({(expires - now).days} days)")
+        due.setdefault(userdir, {}).setdefault(no, set()).add(name)
+
+    print(f"{sum(len(names) for tasks in due.values() for names in tasks.values())} of {scanned} certificates and CRLs are due "
+          f"in {len(due)} user directories")
+    if args.dry_run or not due:
+        exit(0)
+
+    renewed, failed = 0, 0
+    for userdir, tasks in due.items():
+        done, skipped = renew_user(userdir, tasks, args)
+        renewed += len(done)
+        failed += len(skipped)
+
+    print(f"\nRenewed {renewed} certificates, {failed} tasks failed")
+    exit(1 if failed else 0)
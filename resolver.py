@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+from asyncio import DatagramProtocol, get_running_loop, run
+from socket import socket, AF_INET, SOCK_DGRAM, inet_aton, inet_ntoa, timeout as SocketTimeout
+from struct import pack, unpack_from, error as struct_error
+from os import urandom, chown
+from os.path import join, dirname, abspath
+from pwd import getpwnam
+from tempfile import mkdtemp
+from time import sleep
+from argparse import ArgumentParser
+
+HOST = "127.0.0.1"
+PORT = 5354             # 53 needs root and 5353 is taken by mDNS
+TTL = 60
+A, AAAA = 1, 28
+NOERROR, FORMERR, NXDOMAIN, REFUSED = 0, 1, 3, 5
+
+
+def parse_query(data: bytes) -> tuple:
+    # (id, flags, name, type, raw question) of the first question, compressed names are never sent in queries
+    ident, flags, questions = unpack_from("!HHH", data)
+    if questions != 1:
+        raise ValueError("one question is expected")
+    labels, offset = [], 12
+    while data[offset] != 0:
+        length = data[offset]
+        labels.append(data[offset + 1:offset + 1 + length].decode("ascii").lower())
+        offset += 1 + length
+    qtype, qclass = unpack_from("!HH", data, offset + 1)
+    return ident, flags, ".".join(labels), qtype, data[12:offset + 5]
+
+
+def encode_name(name: str) -> bytes:
+    return b"".join(bytes([len(label)]) + label.encode("ascii") for label in name.strip(".").split(".")) + b"\0"
+
+
+class NameServer(DatagramProtocol):
+    def __init__(self, records: dict):
+        self.records = {name.lower().strip("."): address for name, address in records.items()}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def answer(self, data: bytes) -> bytes:
+        try:
+            ident, flags, name, qtype, question = parse_query(data)
+        except (ValueError, IndexError, UnicodeDecodeError, struct_error):
+            return pack("!HHHHHH", unpack_from("!H", data)[0] if len(data) >= 2 else 0, 0x8000 | FORMERR, 0, 0, 0, 0)
+        # Only task names are answered, everything else is left to the system resolver
+        code = NOERROR if name in self.records else REFUSED
+        answers = b""
+        if code == NOERROR and qtype == A:
+            # Name is a pointer to the question at offset 12
+            answers = pack("!HHHIH", 0xC00C, A, 1, TTL, 4) + inet_aton(self.records[name])
+        # Authoritative answer, recursion desired is copied from the query; AAAA of a task name is empty (NODATA)
+        header = pack("!HHHHHH", ident, 0x8400 | (flags & 0x0100) | code, 1, 1 if answers else 0, 0, 0)
+        return header + question + answers
+
+    def datagram_received(self, data: bytes, address):
+        self.transport.sendto(self.answer(data), address)
+
+
+async def serve(records: dict, host: str, port: int):
+    loop = get_running_loop()
+    await loop.create_datagram_endpoint(lambda: NameServer(records), local_addr=(host, port))
+    await loop.create_future()
+
+
+def lookup(name: str, host: str = HOST, port: int = PORT, wait: float = 1) -> str:
+    # A record of the name from the stub, None when the stub does not know it or does not answer
+    ident = urandom(2)
+    query = ident + pack("!HHHHH", 0x0100, 1, 0, 0, 0) + encode_name(name) + pack("!HH", A, 1)
+    with socket(AF_INET, SOCK_DGRAM) as client:
+        client.settimeout(wait)
+        try:
+            client.sendto(query, (host, port))
+            response = client.recv(512)
+        except (SocketTimeout, ConnectionRefusedError):
+            return None
+    if response[:2] != ident or response[3] & 0x0F != NOERROR or unpack_from("!H", response, 6)[0] == 0:
+        return None
+    return inet_ntoa(response[-4:])
+
+
+def wait_until_ready(name: str, host: str = HOST, port: int = PORT, attempts: int = 50) -> str:
+    # Stub started as a separate process answers in a few milliseconds
+    for _ in range(attempts):
+        address = lookup(name, host, port, wait=0.1)
+        if address is not None:
+            return address
+        sleep(0.01)
+    return None
+
+
+def command(records: dict, host: str = HOST, port: int = PORT) -> list:
+    # Arguments for running the stub as a separate process
+    return ["python3", join(dirname(abspath(__file__)), "resolver.py"), "--host", host, "--port", f"{port}",
+            *[f"{name}={address}" for name, address in records.items()]]
+
+
+def nginx_directive(host: str = HOST, port: int = PORT) -> str:
+    # nginx resolves OCSP responders of stapled certificates itself, so it is pointed to the stub
+    return f"resolver  {host}:{port} valid={TTL}s ipv6=off;"
+
+
+def ocsp_client(url: str, records: dict) -> list:
+    # openssl ocsp connects to the address of the name and keeps the name in Host header, so /etc/hosts is not read
+    scheme, rest = url.split("://", 1)
+    authority, _, path = rest.partition("/")
+    name, _, port = authority.partition(":")
+    address = records.get(name, name)
+    return ["-url", f"{scheme}://{address}{':' + port if port else ''}/{path}", "-header", f"Host={authority}"]
+
+
+def firefox_profile(address: str, owner: str = None) -> str:
+    # Throwaway profile resolving every name to the task address, DNS over HTTPS is off so the override always works
+    profile = mkdtemp(prefix="insecon-firefox-")
+    with open(join(profile, "user.js"), "w") as prefs:
+        prefs.write(f'user_pref("network.dns.forceResolve", "{address}");\n')
+        prefs.write('user_pref("network.trr.mode", 5);\n')
+        prefs.write('user_pref("browser.shell.checkDefaultBrowser", false);\n')
+    if owner is not None:
+        user = getpwnam(owner)
+        for path in [profile, join(profile, "user.js")]:
+            chown(path, user.pw_uid, user.pw_gid)
+    return profile
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Answers A queries for the given names on loopback, so nothing is written to /etc/hosts")
+    parser.add_argument("records", nargs="+", metavar="NAME=ADDRESS")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    try:
+        run(serve(dict(record.split("=", 1) for record in args.records), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+
+from tracing import run
+
+from sqlite3 import connect
+from subprocess import PIPE
+from datetime import datetime, timezone
+from os import replace
+from argparse import ArgumentParser
+
+try:
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+except ImportError:
+    x509 = None
+
+TIME_FORMAT = "%y%m%d%H%M%SZ"       # Format of times in openssl ca index.txt
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    serial TEXT PRIMARY KEY,
+    expires TEXT NOT NULL,
+    revoked TEXT,
+    reason TEXT,
+    subject TEXT NOT NULL,
+    changed INTEGER NOT NULL DEFAULT 0          -- number of the first CRL which includes the last change
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS revoked_certificates ON certificates (revoked) WHERE revoked IS NOT NULL;
+CREATE INDEX IF NOT EXISTS changed_certificates ON certificates (changed);
+CREATE TABLE IF NOT EXISTS crls (
+    number INTEGER PRIMARY KEY,
+    issued TEXT NOT NULL,
+    base INTEGER                                -- number of the base CRL for delta CRLs
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+PENDING = "(SELECT COALESCE(MAX(number), 0) + 1 FROM crls)"
+
+
+def serial_hex(serial) -> str:
+    # Serials are kept as openssl prints them: upper case hex with even number of digits
+    if isinstance(serial, str):
+        serial = int(serial, 16)
+    digits = f"{serial:X}"
+    return digits if len(digits) % 2 == 0 else f"0{digits}"
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.strptime(value, TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def openssl_subject(name) -> str:
+    # Subject as openssl prints it with -nameopt compat, the format of index.txt
+    fields = []
+    for attribute in name:
+        field = "emailAddress" if attribute.oid == NameOID.EMAIL_ADDRESS else attribute.rfc4514_attribute_name
+        fields.append(f"{field}={attribute.value}")
+    return "/" + "/".join(fields)
+
+
+def certificate_record(certificate: str) -> tuple:
+    # Serial, expiration time and subject of certificate in index.txt format, parsed in process when cryptography is installed
+    if x509 is not None:
+        with open(certificate, "rb") as pem:
+            parsed = x509.load_pem_x509_certificate(pem.read())
+        return serial_hex(parsed.serial_number), parsed.not_valid_after_utc.strftime(TIME_FORMAT), openssl_subject(parsed.subject)
+    fields = run(["openssl", "x509", "-in", certificate, "-noout", "-serial", "-enddate", "-subject", "-nameopt", "compat"],
+                 stdout=PIPE, check=True, text=True).stdout
+    fields = dict(line.split("=", 1) for line in fields.splitlines())
+    expires = datetime.strptime(fields["notAfter"], "%b %d %H:%M:%S %Y GMT").strftime(TIME_FORMAT)
+    return serial_hex(fields["serial"]), expires, fields["subject"]
+
+
+class RevocationDB:
+    def __init__(self, path: str):
+        self.path = path
+        self.db = connect(path, check_same_thread=False)
+        # Revocations are appended to write-ahead log instead of rewriting the database
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Databases created before CRL numbering have no change marks
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(certificates)")]
+        if len(columns) != 0 and "changed" not in columns:
+            self.db.execute("ALTER TABLE certificates ADD COLUMN changed INTEGER NOT NULL DEFAULT 0")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def use_issuer(self, issuer: str) -> bool:
+        # Statuses and CRL numbers belong to one issuer, the database of another one (or of its old key) starts from scratch
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'issuer'").fetchone()
+        if row is not None and row[0] == issuer:
+            return False
+        with self.db:
+            self.db.execute("DELETE FROM certificates")
+            self.db.execute("DELETE FROM crls")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('issuer', ?)", (issuer,))
+        return True
+
+    def add(self, records: list):
+        # Records are (serial, expires, subject), already known certificates are kept as is
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO certificates (serial, expires, subject) VALUES (?, ?, ?)",
+                                [(serial_hex(serial), expires, subject) for serial, expires, subject in records])
+
+    def add_certificates(self, certificates: list):
+        self.add([certificate_record(certificate) for certificate in certificates])
+
+    def revoke(self, serials: list, reason: str = None, when: datetime = None) -> int:
+        # Number of certificates revoked, unknown and already revoked serials are not counted
+        revoked = (when or datetime.now(timezone.utc)).strftime(TIME_FORMAT)
+        with self.db:
+            return self.db.executemany(f"UPDATE certificates SET revoked = ?, reason = ?, changed = {PENDING} WHERE serial = ? AND revoked IS NULL",
+                                       [(revoked, reason, serial_hex(serial)) for serial in serials]).rowcount
+
+    def unrevoke(self, serials: list):
+        with self.db:
+            self.db.executemany(f"UPDATE certificates SET revoked = NULL, reason = NULL, changed = {PENDING} WHERE serial = ? AND revoked IS NOT NULL",
+                                [(serial_hex(serial),) for serial in serials])
+
+    def status(self, serial) -> tuple:
+        # ("V" | "R" | "U", revocation time, reason) with lookup by primary key
+        row = self.db.execute("SELECT revoked, reason FROM certificates WHERE serial = ?", (serial_hex(serial),)).fetchone()
+        if row is None:
+            return ("U", None, None)
+        if row[0] is None:
+            return ("V", None, None)
+        return ("R", parse_time(row[0]), row[1])
+
+    def changes(self, since: int = None):
+        # Raw (serial, revocation time, reason) rows for CRLs read in batches, time is None for certificates removed from CRL
+        if since is None:
+            cursor = self.db.execute("SELECT serial, revoked, reason FROM certificates WHERE revoked IS NOT NULL")
+        else:
+            cursor = self.db.execute("SELECT serial, revoked, reason FROM certificates WHERE changed > ?", (since,))
+        while rows := cursor.fetchmany(10000):
+            yield from rows
+
+    def reserve_crl(self, issued: str, base: int = None) -> int:
+        # CRL numbers grow monotonically, changes made after reservation get into the next CRL
+        with self.db:
+            if base is not None and self.db.execute("SELECT 1 FROM crls WHERE number = ? AND base IS NULL", (base,)).fetchone() is None:
+                raise ValueError(f"there is no full CRL with number {base}")
+            return self.db.execute(f"INSERT INTO crls VALUES ({PENDING}, ?, ?) RETURNING number", (issued, base)).fetchone()[0]
+
+    def last_crl(self) -> int:
+        # Number of the last full CRL, the base for delta CRLs
+        return self.db.execute("SELECT MAX(number) FROM crls WHERE base IS NULL").fetchone()[0]
+
+    def version(self) -> int:
+        # Changes with every commit made by other connections
+        return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def import_index(self, filename: str):
+        rows = []
+        with open(filename) as index:
+            for line in index:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 6:
+                    continue
+                status, expires, revocation, serial, _, subject = fields[:6]
+                revoked, _, reason = revocation.partition(",")
+                rows.append((serial_hex(serial), expires, revoked or None, reason or None, subject))
+        # Only new revocations and changed statuses get into the next CRL, known certificates keep their marks
+        with self.db:
+            self.db.executemany(f"""INSERT INTO certificates VALUES (?, ?, ?, ?, ?, CASE WHEN ?3 IS NULL THEN 0 ELSE {PENDING} END)
+                                    ON CONFLICT (serial) DO UPDATE SET expires = excluded.expires, subject = excluded.subject,
+                                    revoked = excluded.revoked, reason = excluded.reason,
+                                    changed = CASE WHEN revoked IS excluded.revoked AND reason IS excluded.reason THEN changed ELSE {PENDING} END""",
+                                rows)
+
+    def export_index(self, filename: str):
+        # index.txt for openssl ca and openssl ocsp, replaced atomically
+        with open(f"{filename}.tmp", "w") as index:
+            for serial, expires, revoked, reason, subject in self.db.execute("SELECT serial, expires, revoked, reason, subject FROM certificates"):
+                status = "V" if revoked is None else "R"
+                revocation = "" if revoked is None else (f"{revoked},{reason}" if reason else revoked)
+                index.write(f"{status}\t{expires}\t{revocation}\t{serial}\tunknown\t{subject}\n")
+        replace(f"{filename}.tmp", filename)
+
+
+def update_database(database: str, index: str, valid: list = None, revoked: list = None, reason: str = None):
+    # Registers certificates, revokes some of them and keeps index.txt in sync for openssl
+    valid, revoked = valid or [], revoked or []
+    # Every certificate is parsed once, revoked ones give their serials from the same record
+    records = {certificate: certificate_record(certificate) for certificate in valid + revoked}
+    db = RevocationDB(database)
+    db.add(list(records.values()))
+    db.revoke([records[certificate][0] for certificate in revoked], reason)
+    db.export_index(index)
+    db.close()
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Revocation database indexed by serial number")
+    parser.add_argument("database", help="SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("import", help="load openssl ca index.txt").add_argument("index")
+    commands.add_parser("export", help="write openssl ca index.txt").add_argument("index")
+    commands.add_parser("add", help="register certificates").add_argument("certificates", nargs="+")
+    revoke = commands.add_parser("revoke", help="revoke serials (hex)")
+    revoke.add_argument("serials", nargs="+")
+    revoke.add_argument("--reason", help="e.g. keyCompromise")
+    commands.add_parser("unrevoke", help="remove revocation of serials (hex)").add_argument("serials", nargs="+")
+    commands.add_parser("status", help="show status of serials (hex)").add_argument("serials", nargs="+")
+    args = parser.parse_args()
+
+    db = RevocationDB(args.database)
+    if args.command == "import":
+        db.import_index(args.index)
+    elif args.command == "export":
+        db.export_index(args.index)
+    elif args.command == "add":
+        db.add_certificates(args.certificates)
+    elif args.command == "revoke":
+        db.revoke(args.serials, args.reason)
+    elif args.command == "unrevoke":
+        db.unrevoke(args.serials)
+    elif args.command == "status":
+        for serial in args.serials:
+            status, revoked, reason = db.status(serial)
+            print(f"{serial_hex(serial)}: {dict(V='valid', R='revoked', U='unknown')[status]}"
+                  + (f" at {revoked}" + (f" ({reason})" if reason else "") if revoked else ""))
+    db.close()
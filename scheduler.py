@@ -0,0 +1,95 @@
+from tracing import tracer, run
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from os import cpu_count
+
+
+class Step:
+    def __init__(self, name: str, action, inputs: list = [], outputs: list = [], cache: bool = True):
+        self.name = name
+        self.action = action            # openssl argument list or python callable
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cacheable = cache and len(self.outputs) != 0
+        self.depends = set()
+
+    def __call__(self):
+        if callable(self.action):
+            self.action()
+        else:
+            # Failed openssl step fails the build instead of leaving missing files for the next steps
+            run(self.action, check=True)
+
+
+class Scheduler:
+    def __init__(self, workers: int = None, cache=None):
+        # Every openssl step is a separate child process, so threads are enough to keep all cores busy
+        self.workers = workers or cpu_count() or 1
+        self.cache = cache
+        self.steps = []
+        self.writers = {}               # path -> last step which wrote it
+        self.readers = {}               # path -> steps which read it after the last write
+
+    def add(self, name: str, action, inputs: list = [], outputs: list = [], cache: bool = True) -> Step:
+        step = Step(name, action, inputs, outputs, cache)
+
+        # Step must wait for the steps producing its inputs
+        for path in step.inputs:
+            if path in self.writers:
+                step.depends.add(self.writers[path])
+            self.readers.setdefault(path, []).append(step)
+
+        # Files modified in place (e.g. index.txt) keep the order of declaration
+        for path in step.outputs:
+            if path in self.writers:
+                step.depends.add(self.writers[path])
+            step.depends.update(reader for reader in self.readers.get(path, []) if reader is not step)
+            self.writers[path] = step
+            self.readers[path] = []
+
+        self.steps.append(step)
+        return step
+
+    def execute(self, step: Step):
+        with tracer.span(step.name) as trace:
+            if self.cache is None or not step.cacheable:
+                return step()
+            # Outputs are taken from the cache when inputs, parameters and parents are unchanged
+            key = self.cache.key(step)
+            trace["cached"] = self.cache.restore(key, step)
+            if not trace["cached"]:
+                step()
+                self.cache.store(key, step)
+
+    def run(self) -> bool:
+        pending = list(self.steps)
+        running = {}
+        done, failed = set(), set()
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            while pending or running:
+                # Steps are declared after their dependencies, so one pass is enough to skip whole failed branches
+                for step in list(pending):
+                    if step.depends & failed:
+                        pending.remove(step)
+                        failed.add(step)
+                        print(f"\x1b[1;31mSkipping '{step.name}' because of failed dependencies\x1b[0m")
+                    elif step.depends <= done:
+                        pending.remove(step)
+                        running[pool.submit(self.execute, step)] = step
+
+                if len(running) == 0:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    if future.exception() is None:
+                        done.add(step)
+                    else:
+                        failed.add(step)
+                        print(f"\x1b[1;31m'{step.name}' failed: {future.exception()}\x1b[0m")
+
+        if self.cache is not None:
+            self.cache.evict()
+        return len(failed) == 0
@@ -0,0 +1,264 @@
+#!/usr/bin/python
+
+from revocation import RevocationDB, TIME_FORMAT, serial_hex, openssl_subject
+from backend import parse_extensions, signature_hash
+
+from asyncio import start_unix_server, get_running_loop, gather, run, Lock as AsyncLock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from socket import socket, AF_UNIX
+from fcntl import flock, LOCK_EX, LOCK_UN
+from signal import SIGINT, SIGTERM
+from json import loads, dumps
+from random import getrandbits
+from os import makedirs, replace, remove, chmod, cpu_count
+from os.path import isfile, exists, basename, join, splitext
+from argparse import ArgumentParser
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import serialization
+except ImportError:
+    x509 = None
+
+LINE_LIMIT = 64 * 1024 * 1024
+
+
+class SerialFile:
+    # Next serial in hex, as openssl keeps it in -CAserial file. Serials are reserved in blocks under a file lock,
+    # so concurrent batches and several signers sharing the file never get the same serial
+    def __init__(self, path: str):
+        self.path = path
+
+    def allocate(self, count: int) -> list:
+        with open(f"{self.path}.lock", "a") as lock:
+            flock(lock, LOCK_EX)
+            try:
+                if isfile(self.path):
+                    with open(self.path) as serial:
+                        first = int(serial.read().strip(), 16)
+                else:
+                    # Random 63-bit start, like -CAcreateserial, keeps serials of different CAs apart
+                    first = getrandbits(63) | 1 << 62
+                with open(f"{self.path}.tmp", "w") as serial:
+                    serial.write(f"{serial_hex(first + count)}\n")
+                replace(f"{self.path}.tmp", self.path)
+            finally:
+                flock(lock, LOCK_UN)
+        return list(range(first, first + count))
+
+
+class Signer:
+    def __init__(self, cert: str, key: str, password: str, serial: str, database: str = None, index: str = None, workers: int = None):
+        # Issuer key is decrypted once, every request afterwards costs only its signature
+        with open(cert, "rb") as pem:
+            self.cert = x509.load_pem_x509_certificate(pem.read())
+        with open(key, "rb") as pem:
+            self.key = serialization.load_pem_private_key(pem.read(), password=password.encode() if password else None)
+        self.serials = SerialFile(serial)
+        self.db = RevocationDB(database) if database is not None else None
+        self.index = index
+        self.db_lock = AsyncLock()
+        self.pool = ThreadPoolExecutor(workers or cpu_count() or 1)
+        self.issued, self.revoked = 0, 0
+
+    def sign(self, csr: str, serial: int, days: int, extensions: list):
+        request = x509.load_pem_x509_csr(csr.encode())
+        if not request.is_signature_valid:
+            raise ValueError(f"signature of request for {openssl_subject(request.subject)} is invalid")
+        now = datetime.now(timezone.utc)
+        builder = (x509.CertificateBuilder()
+                   .subject_name(request.subject)
+                   .issuer_name(self.cert.subject)
+                   .public_key(request.public_key())
+                   .serial_number(serial)
+                   .not_valid_before(now)
+                   .not_valid_after(now + timedelta(days=days)))
+        # Extensions of the request are copied as -copy_extensions copy does, explicitly given ones replace them
+        added = parse_extensions(extensions)
+        replaced = {extension.oid for extension, _ in added}
+        for extension in request.extensions:
+            if extension.oid not in replaced:
+                builder = builder.add_extension(extension.value, critical=extension.critical)
+        for extension, critical in added:
+            builder = builder.add_extension(extension, critical=critical)
+        present = replaced | {extension.oid for extension in request.extensions}
+        if x509.SubjectKeyIdentifier.oid not in present:
+            builder = builder.add_extension(x509.SubjectKeyIdentifier.from_public_key(request.public_key()), critical=False)
+        if x509.AuthorityKeyIdentifier.oid not in present:
+            builder = builder.add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(self.key.public_key()), critical=False)
+        return builder.sign(self.key, signature_hash(self.key))
+
+    async def record(self, change, *args):
+        # Batch is one transaction of the database, index.txt is replaced after it, so readers never see half of a batch
+        async with self.db_lock:
+            result = await get_running_loop().run_in_executor(None, change, *args)
+            if self.index is not None:
+                await get_running_loop().run_in_executor(None, self.db.export_index, self.index)
+        return result
+
+    async def issue(self, requests: list) -> list:
+        # Requests are {"csr": PEM, "days": N, "extensions": [openssl -addext strings]}, signed in parallel
+        loop = get_running_loop()
+        # Serial file lock may wait for other signers, so it is taken outside of the event loop
+        serials = await loop.run_in_executor(None, self.serials.allocate, len(requests))
+        certificates = await gather(*[loop.run_in_executor(self.pool, self.sign, request["csr"], serial, request.get("days", 30),
+                                                           request.get("extensions", []))
+                                      for request, serial in zip(requests, serials)])
+        if self.db is not None:
+            await self.record(self.db.add, [(certificate.serial_number, certificate.not_valid_after_utc.strftime(TIME_FORMAT),
+                                             openssl_subject(certificate.subject)) for certificate in certificates])
+        self.issued += len(certificates)
+        return [certificate.public_bytes(serialization.Encoding.PEM).decode() for certificate in certificates]
+
+    def revoke_known(self, serials: list, reason: str = None) -> tuple:
+        # Number of certificates revoked now and serials the database does not know, already revoked ones count in neither
+        revoked = self.db.revoke(serials, reason)
+        return revoked, [serial_hex(serial) for serial in serials if self.db.status(serial)[0] == "U"]
+
+    async def revoke(self, serials: list, reason: str = None) -> tuple:
+        if self.db is None:
+            raise ValueError("signer runs without revocation database")
+        revoked, unknown = await self.record(self.revoke_known, serials, reason)
+        self.revoked += revoked
+        return revoked, unknown
+
+    async def handle(self, reader, writer):
+        # JSON request per line, JSON response per line, connection is kept for any number of batches
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Line over the limit is dropped from the buffer, the connection goes on with the next one
+                    line = None
+                if line == b"":
+                    break
+                try:
+                    if line is None:
+                        raise ValueError(f"request is longer than {LINE_LIMIT} bytes")
+                    request = loads(line)
+                    if request["op"] == "issue":
+                        response = {"ok": True, "certificates": await self.issue(request["requests"])}
+                    elif request["op"] == "revoke":
+                        revoked, unknown = await self.revoke(request["serials"], request.get("reason"))
+                        response = {"ok": True, "revoked": revoked, "unknown": unknown}
+                    elif request["op"] == "stats":
+                        response = {"ok": True, "issued": self.issued, "revoked": self.revoked}
+                    else:
+                        raise ValueError(f"unknown operation {request['op']}")
+                except Exception as error:
+                    # Any failure of a batch is reported to its client, the signer and the connection keep working
+                    response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+                writer.write(dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(signer: Signer, path: str):
+    if exists(path):
+        remove(path)
+    # Batch of requests comes in one line, so the line limit is raised from 64 KiB
+    server = await start_unix_server(signer.handle, path, limit=LINE_LIMIT)
+    # Only the owner may ask for signatures
+    chmod(path, 0o600)
+    loop = get_running_loop()
+    for signal in [SIGINT, SIGTERM]:
+        loop.add_signal_handler(signal, server.close)
+    try:
+        await server.serve_forever()
+    except BaseException:
+        pass
+    remove(path)
+    signer.pool.shutdown()
+    if signer.db is not None:
+        signer.db.close()
+    print(f"Issued {signer.issued} certificates, revoked {signer.revoked}")
+
+
+class SignerClient:
+    def __init__(self, path: str):
+        self.socket = socket(AF_UNIX)
+        self.socket.connect(path)
+        self.stream = self.socket.makefile("rwb")
+
+    def call(self, request: dict) -> dict:
+        self.stream.write(dumps(request).encode() + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise RuntimeError("signer closed the connection")
+        response = loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response
+
+    def issue(self, requests: list) -> list:
+        return self.call({"op": "issue", "requests": requests})["certificates"]
+
+    def revoke(self, serials: list, reason: str = None) -> tuple:
+        response = self.call({"op": "revoke", "serials": serials, "reason": reason})
+        return response["revoked"], response["unknown"]
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Signing service which keeps the issuer key decrypted and signs batches of requests over Unix socket")
+    parser.add_argument("socket")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the signer")
+    serve_parser.add_argument("--cert", required=True, help="issuer certificate")
+    serve_parser.add_argument("--key", required=True, help="issuer key")
+    serve_parser.add_argument("--passin", default="", help="password of the issuer key")
+    serve_parser.add_argument("--serial", required=True, help="file with the next serial, created when absent")
+    serve_parser.add_argument("--db", help="revocation database, issued certificates are registered in it")
+    serve_parser.add_argument("--index", help="openssl ca index.txt exported from the database after every batch")
+    serve_parser.add_argument("--workers", type=int, default=cpu_count() or 1)
+    issue_parser = commands.add_parser("issue", help="sign requests as one batch")
+    issue_parser.add_argument("requests", nargs="+", help="PEM requests, certificates are written next to them with .crt suffix")
+    issue_parser.add_argument("--days", type=int, default=30)
+    issue_parser.add_argument("--addext", action="append", default=[], help="extension in openssl -addext format")
+    issue_parser.add_argument("--out", help="directory for certificates")
+    revoke_parser = commands.add_parser("revoke", help="revoke serials (hex)")
+    revoke_parser.add_argument("serials", nargs="+")
+    revoke_parser.add_argument("--reason", help="e.g. keyCompromise")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if x509 is None:
+            print(f"Python package cryptography is needed for the signer, install it with pip")
+            print(f"e.g. \x1b[1mpip install cryptography\x1b[0m")
+            exit(1)
+        run(serve(Signer(args.cert, args.key, args.passin, args.serial, args.db, args.index, args.workers), args.socket))
+        exit(0)
+
+    client = SignerClient(args.socket)
+    try:
+        if args.command == "issue":
+            if args.out: makedirs(args.out, exist_ok=True)
+            requests = []
+            for path in args.requests:
+                with open(path) as csr:
+                    requests.append({"csr": csr.read(), "days": args.days, "extensions": args.addext})
+            for path, certificate in zip(args.requests, client.issue(requests)):
+                out = join(args.out, f"{splitext(basename(path))[0]}.crt") if args.out else f"{splitext(path)[0]}.crt"
+                with open(out, "w") as pem:
+                    pem.write(certificate)
+        else:
+            revoked, unknown = client.revoke([serial_hex(serial) for serial in args.serials], args.reason)
+            print(f"Revoked {revoked} certificates")
+            if unknown:
+                print(f"\x1b[1;31mUnknown serials: {', '.join(unknown)}\x1b[0m")
+                exit(1)
+    except RuntimeError as error:
+        print(f"\x1b[1;31m{error}\x1b[0m")
+        exit(1)
+    finally:
+        client.close()
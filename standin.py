@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+from asyncio import start_server, run, wait_for, IncompleteReadError, TimeoutError as AsyncTimeoutError
+from ssl import SSLContext, PROTOCOL_TLS_SERVER
+from json import dumps
+from time import time
+from re import search
+from os import environ, chmod
+from os.path import join, abspath, isfile
+from sys import argv, stderr, stdout
+from argparse import ArgumentParser
+
+# System programs the generators call, each one is replaced by a wrapper script running this module
+COMMANDS = ["nginx", "trust", "systemctl", "firefox", "ifconfig"]
+
+
+def record(command: str, args: list):
+    # Calls are appended to the log, so a benchmark can tell which system parts a generator touched
+    log = environ.get("INSECON_STANDIN_LOG")
+    if log is not None:
+        with open(log, "a") as calls:
+            calls.write(dumps({"time": time(), "command": command, "args": args}) + "\n")
+
+
+def install(directory: str) -> list:
+    # Wrapper for every command, the directory is put first in PATH of the generator
+    wrappers = []
+    for command in COMMANDS:
+        wrapper = join(directory, command)
+        with open(wrapper, "w") as script:
+            script.write(f"#!/bin/sh\nexec python3 {abspath(__file__)} {command} \"$@\"\n")
+        chmod(wrapper, 0o755)
+        wrappers.append(wrapper)
+    return wrappers
+
+
+def parse_sites(config: str) -> list:
+    # TLS server blocks of nginx config rendered by nginx_config.render
+    sites = []
+    for block in config.split("server {")[1:]:
+        certificate = search(r"ssl_certificate\s+([^;]+);", block)
+        if certificate is None:
+            continue
+        sites.append({"port": int(search(r"listen\s+(?:[\d.]+:)?(\d+)", block).group(1)),
+                      "name": search(r"server_name\s+([^;]+);", block).group(1).strip(),
+                      "cert": certificate.group(1).strip(),
+                      "key": search(r"ssl_certificate_key\s+([^;]+);", block).group(1).strip(),
+                      "root": search(r"root\s+([^;]+);", block).group(1).strip()})
+    return sites
+
+
+class Sites:
+    # Serves index.html of the sites over TLS, the certificate is chosen by SNI as nginx does
+    def __init__(self, sites: list):
+        self.roots = {site["name"]: site["root"] for site in sites}
+        self.contexts = {}
+        for site in sites:
+            context = SSLContext(PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(site["cert"], site["key"])
+            self.contexts[site["name"]] = context
+        self.default = self.contexts[sites[0]["name"]]
+        self.default.sni_callback = self.select
+
+    def select(self, connection, name, context):
+        if name in self.contexts:
+            connection.context = self.contexts[name]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = await wait_for(reader.readuntil(b"\r\n\r\n"), 30)
+                lines = head.decode("latin-1").split("\r\n")
+                headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+                index = join(self.roots.get(headers.get("host", "").split(":")[0], ""), "index.html")
+                body = b""
+                if isfile(index):
+                    with open(index, "rb") as page:
+                        body = page.read()
+                close = headers.get("connection", "").lower() == "close"
+                writer.write(f"HTTP/1.1 {200 if body else 404} {'OK' if body else 'Not Found'}\r\nServer: nginx (stand-in)\r\n"
+                             f"Content-Type: text/html; charset=UTF-8\r\nContent-Length: {len(body)}\r\n"
+                             f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode() + body)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, IncompleteReadError, AsyncTimeoutError, OSError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(sites: list):
+    handler = Sites(sites)
+    servers = [await start_server(handler.handle, "0.0.0.0", port, ssl=handler.default) for port in sorted({site["port"] for site in sites})]
+    await servers[0].serve_forever()
+
+
+def nginx(args: list) -> int:
+    # -v and -t answer as nginx does, signals are accepted, a config given with -c is served
+    if "-v" in args or "-V" in args:
+        stderr.write("nginx version: nginx/1.25.3 (stand-in)\n")
+        return 0
+    if "-s" in args:
+        return 0
+    config = args[args.index("-c") + 1] if "-c" in args else None
+    if "-t" in args:
+        stderr.write(f"nginx: the configuration file {config} syntax is ok\nnginx: configuration file {config} test is successful\n")
+        return 0
+    if config is None:
+        return 0
+    with open(config) as file:
+        sites = parse_sites(file.read())
+    if sites:
+        run(serve(sites))
+    return 0
+
+
+if __name__ == "__main__":
+
+    if len(argv) > 1 and argv[1] in COMMANDS:
+        record(argv[1], argv[2:])
+        stdout.flush()
+        exit(nginx(argv[2:]) if argv[1] == "nginx" else 0)
+
+    parser = ArgumentParser(description="Recording stand-ins for nginx, trust, systemctl, firefox and ifconfig used by benchmarks")
+    parser.add_argument("directory", help="directory for wrapper scripts, put it first in PATH")
+    args = parser.parse_args()
+    for wrapper in install(args.directory):
+        print(wrapper)
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+from tracing import run
+
+from subprocess import PIPE, DEVNULL
+from datetime import datetime, timezone
+from os import replace, remove, stat
+from os.path import isfile, join, dirname, abspath
+from time import sleep
+from argparse import ArgumentParser
+
+
+class Stapler:
+    def __init__(self, index: str, chain: str, issuer: str, rsigner: str, rkey: str, password: str,
+                 validity: int = 60, reload: list = None):
+        self.index = index
+        self.chain = chain
+        self.issuer = issuer
+        self.rsigner = rsigner
+        self.rkey = rkey
+        self.password = password
+        self.validity = validity        # minutes until nextUpdate of every response
+        self.reload = reload            # command making the server read new responses, e.g. nginx -s reload
+        self.staples = []               # (certificate, response file)
+        self.index_mtime = None
+
+    def add(self, certificate: str, staple: str):
+        self.staples.append((certificate, staple))
+
+    def build(self, certificate: str, out: str):
+        # openssl ocsp answers locally generated request from index.txt without any network round trip
+        run(["openssl", "ocsp", "-index", self.index, "-CA", self.chain,
+             "-rsigner", self.rsigner, "-rkey", self.rkey, "-passin", f"pass:{self.password}",
+             "-issuer", self.issuer, "-cert", certificate, "-no_nonce", "-nmin", f"{self.validity}",
+             "-respout", out], stdout=DEVNULL, stderr=DEVNULL, check=True)
+
+    def refresh(self, force: bool = False) -> bool:
+        # Responses are rebuilt when statuses may have changed or when half of their validity is gone
+        mtime = stat(self.index).st_mtime_ns
+        index_changed = mtime != self.index_mtime
+        self.index_mtime = mtime
+
+        changed = []
+        for certificate, staple in self.staples:
+            served = describe(staple) if isfile(staple) else None
+            expiring = served is None or datetime.now(timezone.utc) >= served["refresh"]
+            if not (force or index_changed or expiring):
+                continue
+            self.build(certificate, f"{staple}.tmp")
+            fresh = describe(f"{staple}.tmp")
+            # Same status from the same index is not worth a reload until the served response gets old
+            if not force and not expiring and served["status"] == fresh["status"]:
+                remove(f"{staple}.tmp")
+                continue
+            replace(f"{staple}.tmp", staple)
+            changed.append(staple)
+            print(f"Stapled {fresh['status']} response for {certificate} valid until {fresh['next']:%Y-%m-%d %H:%M:%S} UTC")
+
+        if changed and self.reload is not None:
+            run(self.reload)
+        return len(changed) != 0
+
+    def command(self, period: int = 60) -> list:
+        # Arguments for running the refresh loop as a separate process
+        return ["python3", join(dirname(abspath(__file__)), "stapling.py"), "--index", self.index, "--CA", self.chain,
+                "--issuer", self.issuer, "--rsigner", self.rsigner, "--rkey", self.rkey, "--passin", self.password,
+                "--validity", f"{self.validity}", "--check", f"{period}", "--reload", " ".join(self.reload or []),
+                *[f"{certificate}:{staple}" for certificate, staple in self.staples]]
+
+    def serve(self, period: int):
+        while True:
+            try: self.refresh()
+            except Exception as error: print(f"\x1b[1;31mFailed to refresh OCSP responses: {error}\x1b[0m")
+            sleep(period)
+
+
+def describe(staple: str) -> dict:
+    # Status line and update times of DER response
+    text = run(["openssl", "ocsp", "-respin", staple, "-resp_text", "-noverify"], stdout=PIPE, stderr=DEVNULL, text=True).stdout
+    fields = {}
+    for line in text.splitlines():
+        name, _, value = line.strip().partition(": ")
+        fields.setdefault(name, value)
+    this = datetime.strptime(fields["This Update"], "%b %d %H:%M:%S %Y GMT").replace(tzinfo=timezone.utc)
+    next_update = datetime.strptime(fields["Next Update"], "%b %d %H:%M:%S %Y GMT").replace(tzinfo=timezone.utc)
+    return {"status": f"{fields['Cert Status']} {fields.get('Revocation Time', '')}".strip(),
+            "next": next_update, "refresh": this + (next_update - this) / 2}
+
+
+def stapling_config(staple: str, chain: str) -> str:
+    # Server block directives serving the prepared response instead of asking the responder from nginx
+    return f"""ssl_stapling on;
+        ssl_stapling_file {staple};
+        ssl_stapling_verify on;
+        ssl_trusted_certificate {chain};"""
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Prepares OCSP responses for stapling and keeps them fresh")
+    parser.add_argument("staples", nargs="+", metavar="CERT:RESPONSE", help="server certificate and file for its DER response")
+    parser.add_argument("--index", required=True, help="openssl ca database")
+    parser.add_argument("--CA", required=True, dest="chain", help="certificates of issuers")
+    parser.add_argument("--issuer", required=True, help="issuer of the server certificates")
+    parser.add_argument("--rsigner", required=True, help="responder certificate")
+    parser.add_argument("--rkey", required=True, help="responder key")
+    parser.add_argument("--passin", default="", help="password for responder key")
+    parser.add_argument("--validity", type=int, default=60, help="minutes of validity of every response")
+    parser.add_argument("--check", type=int, default=60, metavar="SECONDS", help="period of status checks, 0 to refresh once")
+    parser.add_argument("--reload", default="nginx -s reload", help="command run after responses changed, empty to run nothing")
+    parser.add_argument("--config", action="store_true", help="print nginx directives for every response")
+    args = parser.parse_args()
+
+    stapler = Stapler(args.index, args.chain, args.issuer, args.rsigner, args.rkey, args.passin, args.validity,
+                      args.reload.split() if args.reload else None)
+    for pair in args.staples:
+        certificate, staple = pair.split(":", 1)
+        stapler.add(certificate, staple)
+        if args.config:
+            print(f"# {certificate}\n        {stapling_config(staple, args.chain)}")
+
+    if args.check == 0:
+        stapler.refresh(force=True)
+    else:
+        stapler.serve(args.check)
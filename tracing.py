@@ -0,0 +1,152 @@
+from subprocess import Popen, PIPE, CompletedProcess, CalledProcessError
+from threading import Lock, local, get_native_id
+from contextlib import contextmanager
+from resource import getrusage, RUSAGE_SELF
+from os import wait4, waitstatus_to_exitcode, getpid, memfd_create
+from time import perf_counter
+from json import dump
+from re import match
+import atexit
+
+SUMMARY_ROWS = 20
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.task = None                # task of processes started outside of scheduler steps
+        self.events = []                # Chrome trace events
+        self.processes = []             # rows of summary table
+        self.lock = Lock()
+        self.current = local()          # step executed by this thread
+        self.origin = perf_counter()
+
+    def enable(self, output: str, task: str = None):
+        if not self.enabled:
+            atexit.register(self.finish)
+        self.enabled = True
+        self.output = output
+        self.task = task
+
+    def timestamp(self, moment: float) -> float:
+        return round((moment - self.origin) * 1e6, 1)
+
+    def context(self) -> tuple:
+        step = getattr(self.current, "step", None)
+        task = match(r"\[(\w+)\]", step) if step else None
+        return step, task.group(1) if task else self.task
+
+    @contextmanager
+    def span(self, name: str):
+        # Scheduler step, processes started inside it are drawn under it in the same thread lane
+        previous = getattr(self.current, "step", None)
+        self.current.step = name
+        args = {}
+        start = perf_counter()
+        try:
+            yield args
+        finally:
+            self.current.step = previous
+            if self.enabled:
+                task = match(r"\[(\w+)\]", name)
+                args["task"] = task.group(1) if task else self.task
+                event = {"name": name, "cat": "step", "ph": "X", "ts": self.timestamp(start),
+                         "dur": self.timestamp(perf_counter()) - self.timestamp(start),
+                         "pid": getpid(), "tid": get_native_id(), "args": args}
+                with self.lock:
+                    self.events.append(event)
+
+    def run(self, command: list, name: str = None, check: bool = False, warn: bool = True,
+            stdin=None, stdout=None, stderr=None, input: bytes = None, text: bool = False, cwd: str = None) -> CompletedProcess:
+        # Child is reaped with wait4, so its own CPU time and peak memory are known,
+        # captured output goes through in-memory files, so the child never blocks on a full pipe
+        captured = {}
+        if stdout == PIPE: stdout = captured["stdout"] = open(memfd_create("stdout"), "w+b")
+        if stderr == PIPE: stderr = captured["stderr"] = open(memfd_create("stderr"), "w+b")
+        if input is not None: stdin = PIPE
+        parent_rss = getrusage(RUSAGE_SELF).ru_maxrss
+        start = perf_counter()
+        child = Popen(command, stdin=stdin, stdout=stdout, stderr=stderr, cwd=cwd)
+        if input is not None:
+            try: child.stdin.write(input.encode() if text else input)
+            except BrokenPipeError: pass
+            child.stdin.close()
+        _, status, usage = wait4(child.pid, 0)
+        finish = perf_counter()
+        child.returncode = waitstatus_to_exitcode(status)
+
+        output = {}
+        for stream, file in captured.items():
+            file.seek(0)
+            output[stream] = file.read().decode() if text else file.read()
+            file.close()
+
+        step, task = self.context()
+        name = name or " ".join(command[:2])
+        if self.enabled:
+            row = {"name": name, "step": step, "task": task, "wall_ms": round((finish - start) * 1000, 3),
+                   "user_ms": round(usage.ru_utime * 1000, 3), "sys_ms": round(usage.ru_stime * 1000, 3),
+                   # Linux reports at least the memory of this process at the moment of spawn
+                   "max_rss_mb": round(usage.ru_maxrss / 1024, 1), "parent_rss_mb": round(parent_rss / 1024, 1),
+                   "returncode": child.returncode, "command": " ".join(redact(command))}
+            event = {"name": name, "cat": "process", "ph": "X", "ts": self.timestamp(start),
+                     "dur": self.timestamp(finish) - self.timestamp(start),
+                     "pid": getpid(), "tid": get_native_id(), "args": row}
+            with self.lock:
+                self.processes.append(row)
+                self.events.append(event)
+
+        result = CompletedProcess(command, child.returncode, output.get("stdout"), output.get("stderr"))
+        if child.returncode != 0:
+            if check:
+                raise CalledProcessError(child.returncode, command, result.stdout, result.stderr)
+            if warn:
+                print(f"\x1b[1;31m'{name}'{f' in {step}' if step else ''} exited with code {child.returncode}\x1b[0m")
+        return result
+
+    def save(self, output: str):
+        # Chrome trace format, opens in chrome://tracing and ui.perfetto.dev
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event["ts"])
+        with open(output, "w") as trace:
+            dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace)
+
+    def report(self):
+        with self.lock:
+            rows = sorted(self.processes, key=lambda row: row["wall_ms"], reverse=True)
+        if len(rows) == 0:
+            print("Profile: no child processes were started")
+            return
+        wall = sum(row["wall_ms"] for row in rows)
+        cpu = sum(row["user_ms"] + row["sys_ms"] for row in rows)
+        failed = sum(row["returncode"] != 0 for row in rows)
+        print(f"\nProfile: {len(rows)} child processes, {wall / 1000:.2f} s of wall time, {cpu / 1000:.2f} s of CPU time, {failed} failed")
+        print(f"{'task':<6} {'step':<48} {'command':<16} {'wall ms':>9} {'user ms':>9} {'sys ms':>8} {'peak MB':>8} {'code':>4}")
+        for row in rows[:SUMMARY_ROWS]:
+            step = (row["step"] or "")[:48]
+            print(f"{row['task'] or '':<6} {step:<48} {row['name'][:16]:<16} {row['wall_ms']:>9.1f} {row['user_ms']:>9.1f} "
+                  f"{row['sys_ms']:>8.1f} {row['max_rss_mb']:>8.1f} {row['returncode']:>4}")
+        if len(rows) > SUMMARY_ROWS:
+            print(f"... {len(rows) - SUMMARY_ROWS} more in {self.output}")
+        print(f"Peak memory of a child includes {max(row['parent_rss_mb'] for row in rows):.1f} MB of this process at the moment of spawn")
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self.save(self.output)
+        self.report()
+        print(f"Trace saved in \x1b[1;4m{self.output}\x1b[0m, open it in ui.perfetto.dev or chrome://tracing")
+
+
+def redact(command: list) -> list:
+    # Passwords given as pass:secret are not written to the trace
+    return ["pass:***" if argument.startswith("pass:") else argument for argument in command]
+
+
+tracer = Tracer()
+
+
+def run(command: list, **kwargs) -> CompletedProcess:
+    # Drop-in replacement of subprocess.run for openssl and system tools
+    return tracer.run(command, **kwargs)
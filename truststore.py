@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+from crl import read, decode_oid, parse_time
+
+from mmap import mmap, ACCESS_READ
+from base64 import b64decode, b64encode
+from hashlib import sha1
+from datetime import datetime, timezone
+from collections import deque
+from os import replace, makedirs
+from os.path import basename, splitext, join
+from argparse import ArgumentParser
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+except ImportError:
+    x509 = None
+
+BEGIN, END = b"-----BEGIN CERTIFICATE-----", b"-----END CERTIFICATE-----"
+MAX_DEPTH = 8
+
+
+class Entry:
+    # Certificate of the bundle: fields needed for path building are read from DER once, the full parse is done on demand
+    __slots__ = ["data", "start", "end", "pem", "subject", "issuer", "ski", "aki", "ca", "pathlen", "not_before", "not_after", "parsed"]
+
+    def __init__(self, data, start: int, end: int, pem: bool):
+        self.data, self.start, self.end, self.pem = data, start, end, pem
+        self.parsed = None
+        self.scan(self.der())
+
+    def der(self) -> bytes:
+        if self.pem:
+            # Line breaks between armour lines are skipped by the decoder
+            return b64decode(self.data[self.start + len(BEGIN):self.end - len(END)])
+        return self.data[self.start:self.end]
+
+    def scan(self, der: bytes):
+        _, tbs, _ = read(der, 0)
+        _, offset, tbs_end = read(der, tbs)
+        fields = []
+        while offset < tbs_end:
+            tag, start, end = read(der, offset)
+            fields.append((tag, offset, start, end))
+            offset = end
+        version1 = fields[0][0] != 0xa0
+        if not version1:                        # explicit version is present in v3 certificates
+            fields = fields[1:]
+        # Names are indexed by digest of their encoding, as the same issuer always encodes its name the same way
+        self.issuer = sha1(der[fields[2][1]:fields[2][3]]).digest()
+        self.subject = sha1(der[fields[4][1]:fields[4][3]]).digest()
+        tag, start, end = read(der, fields[3][2])
+        self.not_before = parse_time(tag, der[start:end])
+        tag, start, end = read(der, end)
+        self.not_after = parse_time(tag, der[start:end])
+
+        self.ski, self.aki, self.pathlen = None, None, None
+        # v1 certificates have no extensions, self-signed ones are taken as CAs, as openssl does
+        self.ca = version1 and self.subject == self.issuer
+        for tag, _, start, end in fields[6:]:
+            if tag != 0xa3:
+                continue
+            _, offset, extensions_end = read(der, start)
+            while offset < extensions_end:
+                _, ext_start, ext_end = read(der, offset)
+                _, name_start, name_end = read(der, ext_start)
+                name = decode_oid(der[name_start:name_end])
+                tag, value_start, value_end = read(der, name_end)
+                if tag == 0x01:                 # critical flag
+                    tag, value_start, value_end = read(der, value_end)
+                if name == "2.5.29.14":         # subjectKeyIdentifier: OCTET STRING
+                    _, id_start, id_end = read(der, value_start)
+                    self.ski = der[id_start:id_end]
+                elif name == "2.5.29.35":       # authorityKeyIdentifier: SEQUENCE with optional [0] keyIdentifier
+                    _, inner, inner_end = read(der, value_start)
+                    if inner < inner_end and der[inner] == 0x80:
+                        _, id_start, id_end = read(der, inner)
+                        self.aki = der[id_start:id_end]
+                elif name == "2.5.29.19":       # basicConstraints: SEQUENCE with optional cA BOOLEAN and pathLenConstraint INTEGER
+                    _, inner, inner_end = read(der, value_start)
+                    if inner < inner_end and der[inner] == 0x01:
+                        _, flag_start, inner = read(der, inner)
+                        self.ca = der[flag_start] != 0
+                    if inner < inner_end and der[inner] == 0x02:
+                        _, length_start, length_end = read(der, inner)
+                        self.pathlen = int.from_bytes(der[length_start:length_end], "big")
+                offset = ext_end
+
+    def certificate(self):
+        if self.parsed is None:
+            self.parsed = x509.load_der_x509_certificate(self.der())
+        return self.parsed
+
+    def pem_text(self) -> str:
+        if self.pem:
+            return self.data[self.start:self.end].decode() + "\n"
+        encoded = b64encode(self.der()).decode()
+        return "-----BEGIN CERTIFICATE-----\n" + "\n".join(encoded[i:i + 64] for i in range(0, len(encoded), 64)) + "\n-----END CERTIFICATE-----\n"
+
+    def self_signed(self) -> bool:
+        return self.subject == self.issuer and (self.aki is None or self.ski is None or self.aki == self.ski)
+
+
+class TrustStore:
+    def __init__(self, bundles: list):
+        # Bundles are memory-mapped, only offsets and index fields of their certificates are kept
+        self.maps = []
+        self.entries = []
+        self.by_subject, self.by_ski, self.by_aki = {}, {}, {}
+        for bundle in bundles:
+            self.add(bundle)
+
+    def add(self, bundle: str):
+        with open(bundle, "rb") as file:
+            data = mmap(file.fileno(), 0, access=ACCESS_READ)
+        self.maps.append(data)
+        try:
+            for entry in entries(data):
+                self.index(entry)
+        except ValueError as error:
+            raise ValueError(f"{bundle}: {error}") from error
+
+    def index(self, entry: Entry):
+        self.entries.append(entry)
+        self.by_subject.setdefault(entry.subject, []).append(entry)
+        if entry.ski is not None:
+            self.by_ski.setdefault(entry.ski, []).append(entry)
+        if entry.aki is not None:
+            self.by_aki.setdefault(entry.aki, []).append(entry)
+
+    def issuers(self, entry: Entry, now: datetime) -> list:
+        # Candidates are found by key identifier when the certificate has one, by issuer name otherwise.
+        # Only CAs may issue, so end-entity certificates of the bundle never get to the signature check
+        if entry.aki is not None and entry.aki in self.by_ski:
+            candidates = [issuer for issuer in self.by_ski[entry.aki] if issuer.subject == entry.issuer]
+        else:
+            candidates = self.by_subject.get(entry.issuer, [])
+        return [issuer for issuer in candidates if issuer.ca and issuer.not_before <= now <= issuer.not_after and self.signed_by(entry, issuer)]
+
+    def copies(self, entry: Entry) -> list:
+        # Certificates of the store with the same key identifiers and subject, only these are compared byte by byte
+        if entry.aki is not None:
+            candidates = self.by_aki.get(entry.aki, [])
+        else:
+            candidates = self.by_subject.get(entry.subject, [])
+        return [other for other in candidates if other.subject == entry.subject and other.ski == entry.ski and other.der() == entry.der()]
+
+    def signed_by(self, entry: Entry, issuer: Entry) -> bool:
+        # Signatures are checked only for candidates on the way, and only when cryptography is installed
+        if x509 is None:
+            return True
+        try:
+            entry.certificate().verify_directly_issued_by(issuer.certificate())
+            return True
+        except (ValueError, TypeError, InvalidSignature):
+            return False
+
+    def build(self, leaf: Entry, now: datetime = None) -> list:
+        # Shortest path from the leaf to a self-signed certificate of the store, None when there is no such path
+        now = now or datetime.now(timezone.utc)
+        if leaf.self_signed():
+            return [leaf] if self.copies(leaf) else None
+        # Breadth-first search, so the first path reaching a root is the shortest one
+        queue, seen = deque([[leaf]]), {id(leaf)}
+        while queue:
+            path = queue.popleft()
+            if path[-1].self_signed():
+                return path
+            if len(path) > MAX_DEPTH:
+                continue
+            # pathLenConstraint limits the intermediates below the issuer, self-issued ones are not counted
+            below = sum(1 for entry in path[1:] if entry.subject != entry.issuer)
+            for issuer in self.issuers(path[-1], now):
+                if issuer.pathlen is not None and below > issuer.pathlen:
+                    continue
+                if id(issuer) not in seen:
+                    seen.add(id(issuer))
+                    queue.append(path + [issuer])
+        return None
+
+    def close(self):
+        for data in self.maps:
+            data.close()
+
+
+def entries(data):
+    # Certificates of PEM bundle, or of DER bundle where certificates follow one another
+    if data.find(BEGIN) != -1:
+        offset = data.find(BEGIN)
+        while offset != -1:
+            end = data.find(END, offset)
+            if end == -1:
+                raise ValueError(f"certificate at offset {offset} has no {END.decode()} line, the bundle is truncated")
+            end += len(END)
+            yield Entry(data, offset, end, True)
+            offset = data.find(BEGIN, end)
+    else:
+        offset = 0
+        while offset < len(data):
+            _, _, end = read(data, offset)
+            yield Entry(data, offset, end, False)
+            offset = end
+
+
+def load_leaf(filename: str) -> Entry:
+    # First certificate of the file, e.g. the leaf of a chain file
+    with open(filename, "rb") as file:
+        return next(entries(file.read()))
+
+
+def write_chain(out: str, path: list):
+    with open(f"{out}.tmp", "w") as chain:
+        for entry in path:
+            chain.write(entry.pem_text())
+    replace(f"{out}.tmp", out)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Builds ordered chains for certificates from large PEM or DER bundles of CA certificates")
+    parser.add_argument("certificates", nargs="+", help="leaf certificates")
+    parser.add_argument("--bundle", action="append", required=True, help="PEM or DER bundle, may be repeated")
+    parser.add_argument("--out", default=".", help="directory for NAME-chain.crt files")
+    parser.add_argument("--root-first", action="store_true", help="write root certificate first and the leaf last")
+    args = parser.parse_args()
+
+    try:
+        store = TrustStore(args.bundle)
+    except ValueError as error:
+        print(f"\x1b[1;31m{error}\x1b[0m")
+        exit(1)
+    print(f"Indexed {len(store.entries)} certificates")
+    makedirs(args.out, exist_ok=True)
+    failed = 0
+    for certificate in args.certificates:
+        try:
+            path = store.build(load_leaf(certificate))
+        except ValueError as error:
+            print(f"\x1b[1;31m{certificate}: {error}\x1b[0m")
+            failed += 1
+            continue
+        if path is None:
+            print(f"\x1b[1;31m{certificate}: no path to a trusted root\x1b[0m")
+            failed += 1
+            continue
+        out = join(args.out, f"{splitext(basename(certificate))[0]}-chain.crt")
+        write_chain(out, list(reversed(path)) if args.root_first else path)
+        print(f"{certificate}: {len(path)} certificates in {out}")
+    store.close()
+    exit(1 if failed else 0)
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+
+from tracing import run
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from datetime import datetime, timezone
+from os import cpu_count
+from sys import stdin, stdout, stderr
+from json import dumps
+from time import perf_counter
+from argparse import ArgumentParser
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.x509.oid import ExtendedKeyUsageOID
+except ImportError:
+    x509 = None
+
+PURPOSES = {"serverAuth": "SERVER_AUTH", "clientAuth": "CLIENT_AUTH", "OCSPSigning": "OCSP_SIGNING"}
+
+
+def load_certificates(filename: str) -> list:
+    with open(filename, "rb") as file:
+        data = file.read()
+    if b"-----BEGIN" in data:
+        return x509.load_pem_x509_certificates(data)
+    return [x509.load_der_x509_certificate(data)]
+
+
+def load_crl(filename: str):
+    with open(filename, "rb") as file:
+        data = file.read()
+    if b"-----BEGIN" in data:
+        return x509.load_pem_x509_crl(data)
+    return x509.load_der_x509_crl(data)
+
+
+class Verifier:
+    def __init__(self, chain: str, crls: list = [], purpose: str = None):
+        self.purpose = getattr(ExtendedKeyUsageOID, PURPOSES[purpose]) if purpose else None
+        self.crl_check = len(crls) != 0          # as openssl verify -crl_check, CRL of the leaf issuer is required
+        now = datetime.now(timezone.utc)
+
+        # Issuers by encoded subject, problems of the chain itself are reported for every certificate it issued
+        self.issuers = {}
+        self.errors = {}
+        for certificate in load_certificates(chain):
+            self.issuers[certificate.subject.public_bytes()] = certificate
+        for name, certificate in self.issuers.items():
+            issuer = self.issuers.get(certificate.issuer.public_bytes())
+            if issuer is None:
+                self.errors[name] = f"issuer of {certificate.subject.rfc4514_string()} is not in the chain"
+            elif not certificate.not_valid_before_utc <= now <= certificate.not_valid_after_utc:
+                self.errors[name] = f"{certificate.subject.rfc4514_string()} is expired or not yet valid"
+            else:
+                try: certificate.verify_directly_issued_by(issuer)
+                except (ValueError, TypeError, InvalidSignature): self.errors[name] = f"bad signature of {certificate.subject.rfc4514_string()}"
+        # Broken parent breaks the whole branch under it
+        for name, certificate in self.issuers.items():
+            parent = certificate
+            while name not in self.errors and parent.issuer != parent.subject:
+                parent = self.issuers.get(parent.issuer.public_bytes())
+                if parent is None:
+                    break
+                if parent.subject.public_bytes() in self.errors:
+                    self.errors[name] = self.errors[parent.subject.public_bytes()]
+
+        # Revoked serials by issuer, full CRLs are applied before delta CRLs, both in order of their numbers
+        self.revoked = {}
+        numbers = {}                # issuer -> number of the newest full CRL loaded
+        for crl in sorted((load_crl(crl) for crl in crls), key=lambda crl: (is_delta(crl), crl_number(crl))):
+            name = crl.issuer.public_bytes()
+            if name not in self.issuers:
+                raise ValueError(f"issuer of CRL {crl.issuer.rfc4514_string()} is not in the chain")
+            if not crl.is_signature_valid(self.issuers[name].public_key()):
+                raise ValueError(f"bad signature of CRL issued by {crl.issuer.rfc4514_string()}")
+            if crl.next_update_utc is not None and crl.next_update_utc < now:
+                self.errors.setdefault(name, f"CRL issued by {crl.issuer.rfc4514_string()} is expired")
+            if not is_delta(crl):
+                self.revoked.setdefault(name, set()).update(entry.serial_number for entry in crl)
+                numbers[name] = max(numbers.get(name, 0), crl_number(crl))
+                continue
+            # Delta CRL lists changes since its base, it applies only over a full CRL of the same issuer at least as new as the base
+            base = crl.extensions.get_extension_for_class(x509.DeltaCRLIndicator).value.crl_number
+            if name not in numbers:
+                raise ValueError(f"delta CRL {crl_number(crl)} issued by {crl.issuer.rfc4514_string()} has no full CRL to apply to")
+            if base > numbers[name] or crl_number(crl) <= numbers[name]:
+                raise ValueError(f"delta CRL {crl_number(crl)} issued by {crl.issuer.rfc4514_string()} over base {base} "
+                                 f"does not apply to full CRL {numbers[name]}")
+            revoked = self.revoked[name]
+            for entry in crl:
+                try: removed = entry.extensions.get_extension_for_class(x509.CRLReason).value.reason == x509.ReasonFlags.remove_from_crl
+                except x509.ExtensionNotFound: removed = False
+                if removed: revoked.discard(entry.serial_number)
+                else: revoked.add(entry.serial_number)
+
+    def verify(self, filename: str) -> dict:
+        result = {"certificate": filename}
+        try:
+            certificate = load_certificates(filename)[0]
+        except (OSError, ValueError) as error:
+            return {**result, "status": "error", "error": f"{error}"}
+        result["subject"] = certificate.subject.rfc4514_string()
+        result["serial"] = f"{certificate.serial_number:X}"
+        return {**result, **self.check(certificate)}
+
+    def check(self, certificate) -> dict:
+        name = certificate.issuer.public_bytes()
+        issuer = self.issuers.get(name)
+        if issuer is None:
+            return {"status": "invalid", "error": "unable to get local issuer certificate"}
+        if name in self.errors:
+            return {"status": "invalid", "error": self.errors[name]}
+        try:
+            certificate.verify_directly_issued_by(issuer)
+        except (ValueError, TypeError, InvalidSignature):
+            return {"status": "invalid", "error": "certificate signature failure"}
+
+        now = datetime.now(timezone.utc)
+        if now < certificate.not_valid_before_utc:
+            return {"status": "invalid", "error": "certificate is not yet valid"}
+        if now > certificate.not_valid_after_utc:
+            return {"status": "invalid", "error": "certificate has expired"}
+
+        try:
+            usage = certificate.extensions.get_extension_for_class(x509.KeyUsage).value
+            if not usage.digital_signature:
+                return {"status": "invalid", "error": "key usage does not include digitalSignature"}
+        except x509.ExtensionNotFound:
+            pass
+        if self.purpose is not None:
+            try:
+                purposes = certificate.extensions.get_extension_for_class(x509.ExtendedKeyUsage).value
+                if self.purpose not in purposes:
+                    return {"status": "invalid", "error": "unsupported certificate purpose"}
+            except x509.ExtensionNotFound:
+                pass
+
+        if self.crl_check and name not in self.revoked:
+            return {"status": "invalid", "error": "unable to get certificate CRL"}
+        if certificate.serial_number in self.revoked.get(name, ()):
+            return {"status": "revoked", "error": "certificate revoked"}
+        return {"status": "ok"}
+
+
+def crl_number(crl) -> int:
+    try:
+        return crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
+    except x509.ExtensionNotFound:
+        return 0
+
+
+def is_delta(crl) -> bool:
+    try:
+        crl.extensions.get_extension_for_class(x509.DeltaCRLIndicator)
+        return True
+    except x509.ExtensionNotFound:
+        return False
+
+
+########## Worker processes inherit verifier at fork, chain and CRLs are parsed only once ##########
+
+verifier = None
+
+
+def install(instance: Verifier):
+    global verifier
+    verifier = instance
+
+
+def check(filename: str) -> dict:
+    return verifier.verify(filename)
+
+
+def verify_all(chain: str, crls: list, certificates, purpose: str = None, workers: int = None):
+    # Results are yielded in order of certificates
+    instance = Verifier(chain, crls, purpose)
+    workers = workers or cpu_count() or 1
+    if workers == 1:
+        yield from map(instance.verify, certificates)
+        return
+    with ProcessPoolExecutor(workers, mp_context=get_context("fork"), initializer=install, initargs=(instance,)) as pool:
+        yield from pool.map(check, certificates, chunksize=64)
+
+
+def check_certificates(chain: str, crls: list, certificates: list) -> bool:
+    # Verification step of tasks, prints results in the format of openssl verify
+    if x509 is None:
+        crl_options = [option for crl in crls for option in ["-crl_check", "-CRLfile", crl]]
+        return all([run(["openssl", "verify", *crl_options, "-CAfile", chain, certificate], warn=False).returncode == 0
+                    for certificate in certificates])
+    ok = True
+    for result in verify_all(chain, crls, certificates, workers=1):
+        if result["status"] == "ok":
+            print(f"{result['certificate']}: OK")
+        else:
+            print(f"error {result['certificate']}: verification failed ({result['error']})")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Verifies many certificates against one chain and set of CRLs, writes JSONL results")
+    parser.add_argument("certificates", nargs="*")
+    parser.add_argument("--chain", required=True, help="CA certificates, e.g. prefix-chain.crt")
+    parser.add_argument("--crl", action="append", default=[], help="full or delta CRL, can be repeated")
+    parser.add_argument("--list", help="file with certificate paths, one per line, - for stdin")
+    parser.add_argument("--purpose", choices=PURPOSES, help="required extended key usage")
+    parser.add_argument("--workers", type=int, default=cpu_count() or 1)
+    parser.add_argument("--out", help="JSONL output instead of stdout")
+    args = parser.parse_args()
+
+    if x509 is None:
+        print(f"Python package cryptography is needed for batch verification, install it with pip")
+        print(f"e.g. \x1b[1mpip install cryptography\x1b[0m")
+        exit(1)
+
+    certificates = list(args.certificates)
+    if args.list is not None:
+        with (stdin if args.list == "-" else open(args.list)) as paths:
+            certificates += [line.strip() for line in paths if line.strip()]
+
+    start = perf_counter()
+    counts = {}
+    with (open(args.out, "w") if args.out else stdout) as out:
+        try:
+            for result in verify_all(args.chain, args.crl, certificates, args.purpose, args.workers):
+                out.write(dumps(result) + "\n")
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+        except ValueError as error:
+            print(f"\x1b[1;31m{error}\x1b[0m", file=stderr)
+            exit(1)
+    elapsed = perf_counter() - start
+
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"Verified {len(certificates)} certificates in {elapsed:.2f} s ({len(certificates) / elapsed:.0f} certificates/s): {summary}", file=stderr)
+    exit(0 if counts.get("ok", 0) == len(certificates) else 1)
@@ -0,0 +1,37 @@
+from os import makedirs, getuid, listdir, remove
+from os.path import isdir, islink, join, basename, abspath
+from shutil import rmtree
+from tempfile import gettempdir
+
+# Intermediate files live in memory (tmpfs), so unencrypted keys and requests never reach the disk
+SCRATCH_ROOT = join("/dev/shm" if isdir("/dev/shm") else gettempdir(), f"insecon-{getuid()}")
+
+
+class Workspace:
+    def __init__(self, workdir: str, keep: list = [], persist: list = []):
+        self.workdir = workdir
+        self.keep = set(keep)           # names of files which are archived or used after the build (e.g. by nginx)
+        self.persist = set(persist) & self.keep     # kept files which outlive runs (e.g. revocation database)
+        # Path is the same in every run, so the build cache recognises steps reading intermediate files
+        self.scratch = join(SCRATCH_ROOT, basename(abspath(workdir)))
+
+    def path(self, name: str) -> str:
+        return f"{self.workdir}/{name}" if name in self.keep else f"{self.scratch}/{name}"
+
+    def create(self):
+        if isdir(self.scratch): rmtree(self.scratch)
+        if isdir(self.workdir):
+            # Workdir is built again except files which outlive runs, SQLite journals stay with their databases
+            for name in listdir(self.workdir):
+                if name.removesuffix("-wal").removesuffix("-shm") in self.persist:
+                    continue
+                path = join(self.workdir, name)
+                if isdir(path) and not islink(path): rmtree(path)
+                else: remove(path)
+        makedirs(SCRATCH_ROOT, mode=0o700, exist_ok=True)
+        makedirs(self.scratch, mode=0o700)
+        if self.keep:
+            makedirs(self.workdir, exist_ok=True)
+
+    def close(self):
+        rmtree(self.scratch, ignore_errors=True)